@@ -0,0 +1,79 @@
+"""
+Geo-sharded analysis process (see missilemap.shards): an analysis worker, or the merger with --merger.
+
+Uses the server configuration file (MISSILEMAP_CONFIG environment variable) with an additional "shards" section:
+
+    {
+        "shards": {
+            "bbox": [22.0, 44.0, 40.0, 52.0],
+            "rows": 4,
+            "cols": 4,
+            "margin": 50000,
+            "ttl": 60.0
+        }
+    }
+
+"bbox" (min longitude, min latitude, max longitude, max latitude) is split into rows x cols shards extended
+by "margin" meters. Claims of shards not analyzed within "ttl" seconds are taken over by other workers.
+"cluster" section ("file" or "mongodb") selects the work queue & result stores, server workers must use the same
+cluster configuration to serve the merged targets (the "shards" section switches them to serve-only mode).
+"analysis" section "restarts" & "n_jobs" apply to the workers.
+
+Usage:
+    python analysis_worker.py [--merger]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+
+from missilemap.cluster import get_cluster
+from missilemap.shards import DEFAULT_CLAIM_TTL, DEFAULT_SHARD_MARGIN, get_shard_cluster, shard_grid, ShardMerger, ShardWorker
+from missilemap.storage import get_storage
+
+CONFIG_NAME = 'MISSILEMAP_CONFIG'
+DEFAULT_DB_URL = 'mongodb://localhost:21017'
+DEFAULT_DB_NAME = 'missilemap'
+
+
+async def run(config: dict, merger: bool):
+    """
+    Run a worker (or the merger) until interrupted
+    """
+    db_url = config.get('mongodb', {}).get('url', DEFAULT_DB_URL)
+    db_name = config.get('mongodb', {}).get('db_name', DEFAULT_DB_NAME)
+    cluster = config.get('cluster', {})
+    sharding = config['shards']
+
+    shards = shard_grid(tuple(sharding['bbox']), sharding['rows'], sharding['cols'], margin=sharding.get('margin', DEFAULT_SHARD_MARGIN))
+    queue, stores = get_shard_cluster(cluster.get('type'), shards, path=cluster.get('path'), url=db_url, database=db_name,
+                                      ttl=sharding.get('ttl', DEFAULT_CLAIM_TTL))
+    if merger:
+        lease, target_store = get_cluster(cluster.get('type'), path=cluster.get('path'), url=db_url, database=db_name)
+        server = ShardMerger(queue, stores, shards, target_store, lease=lease)
+    else:
+        storage = get_storage(db_type=config.get('db_type', 'mongodb'), url=db_url, database=db_name)
+        analysis = config.get('analysis', {})
+        server = ShardWorker(storage, queue, stores, shards, restarts=analysis.get('restarts', 1), n_jobs=analysis.get('n_jobs'))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--merger', action='store_true', help='run the merger instead of a worker')
+    args = parser.parse_args()
+
+    with open(os.environ[CONFIG_NAME], 'rb') as stream:
+        config = json.load(stream)
+    asyncio.run(run(config, args.merger))
+
+
+if __name__ == '__main__':
+    main()
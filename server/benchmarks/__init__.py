@@ -0,0 +1,6 @@
+"""
+Benchmarks for missile map server components.
+
+Run as modules from the server directory, e.g.:
+    python -m benchmarks.memory_storage
+"""
@@ -0,0 +1,167 @@
+"""
+Analysis benchmark on simulated scenarios.
+
+Runs analyze_sightings() on Simulator scenarios (three turning targets, one of them crossing the others)
+with and without physics-aware gating (bearing tolerance & plausible speed range) and with parallel
+multi-restart EM. Reports EM runs, EM iterations (assignment passes per run), runtime and fit quality.
+
+The scalable mode (fit on a stratified sample, see analyze_sightings() sample_size) is compared to the full
+analysis on dense scenarios (many observers per segment) for every sample size.
+
+Also measures sightings_to_targets() with & without the target index on a day of random raids
+(many segments spread over a large area & 24 hours).
+
+Usage:
+    python -m benchmarks.analysis [--scenarios 8] [--restarts 4] [--jobs -1] [--targets 200] [--sightings 2000]
+                                  [--dense-scenarios 2] [--dense-observers 100] [--sample-sizes 100 200 400]
+"""
+import argparse
+import json
+import random
+import time
+from unittest import mock
+
+from geopy import Point
+import numpy
+
+from missilemap import Sighting, Target
+from missilemap import analysis
+from missilemap.utils import get_bearing
+from simulator import Observer, random_location, Simulator
+
+# (start time, path) per simulated target:
+PATHS = (
+    (0, [Point(45.361285195897885, 33.90794799044153), Point(47.487079766379715, 33.081535775384715),
+         Point(49.47728424495352, 27.901909920451157), Point(49.83269083681804, 24.09401307480089)]),
+    (30, [Point(45.361285195897885, 33.90794799044153), Point(49.3, 33.081535775384715), Point(50.3, 28.3)]),
+    (300, [Point(48.5, 36.0), Point(47.0, 31.0), Point(48.0, 26.0)])
+)
+
+OBSERVER_RADIUS = 5000      # observer radius (meters)
+OBSERVERS_PER_SEGMENT = 10  # number of observers per path segment
+
+
+def scenario(seed: int, observers_per_segment: int = OBSERVERS_PER_SEGMENT):
+    """
+    Generate sightings for a scenario
+    """
+    r = random.Random(seed)
+
+    observers = []
+    for _, path in PATHS:
+        for p_from, p_to in zip(path[:-1], path[1:]):
+            for _ in range(observers_per_segment):
+                observers.append(Observer(location=random_location(p_from, p_to, OBSERVER_RADIUS, random=r), radius=OBSERVER_RADIUS))
+
+    targets = [Target(path=path, start_time=start_time) for start_time, path in PATHS]
+    return Simulator(targets=targets, observers=observers, random=r).sightings
+
+
+def measure(scenarios, **kwargs) -> dict:
+    """
+    Run analysis on all scenarios & collect EM statistics
+    """
+    runs = []  # (assignment passes, runtime) per EM run
+    em = analysis.expectation_maximization
+
+    def _em(*args, **kw):
+        with mock.patch.object(analysis, 'sightings_to_targets', wraps=analysis.sightings_to_targets) as assign:
+            start = time.perf_counter()
+            result = em(*args, **kw)
+            runs.append((assign.call_count, time.perf_counter() - start))
+        return result
+
+    start = time.perf_counter()
+    targets = []
+    with mock.patch.object(analysis, 'expectation_maximization', _em):
+        for sightings in scenarios:
+            targets.append(analysis.analyze_sightings(sightings, **kwargs))
+    elapsed = time.perf_counter() - start
+
+    scores = numpy.array([analysis._score(sightings, t) for sightings, t in zip(scenarios, targets)])
+
+    runs = numpy.array(runs) if runs else numpy.zeros((0, 2))
+    return {
+        'em_runs': len(runs),
+        'em_iterations_mean': runs[:, 0].mean() if len(runs) else None,
+        'em_iterations_max': int(runs[:, 0].max()) if len(runs) else None,
+        'em_seconds': runs[:, 1].sum(),
+        'total_seconds': elapsed,
+        'targets_mean': float(numpy.mean([len(t) for t in targets])),
+        'unexplained_mean': scores[:, 0].mean(),
+        'residual_mean': scores[:, 1].mean()
+    }
+
+
+def random_raids(n_targets: int, n_sightings: int, seed: int = 0):
+    """
+    Generate random straight segments over a day & sightings along them
+    """
+    rng = numpy.random.default_rng(seed)
+
+    targets = []
+    for _ in range(n_targets):
+        start = Point(rng.uniform(44.0, 52.0), rng.uniform(22.0, 40.0))
+        end = Point(start.latitude + rng.uniform(-1.0, 1.0), start.longitude + rng.uniform(-1.5, 1.5))
+        targets.append(Target(start_time=rng.uniform(0, 86400), path=[start, end]))
+
+    sightings = []
+    for idx in rng.integers(0, n_targets, n_sightings).tolist():
+        target = targets[idx]
+        timestamp = rng.uniform(target.start_time, target.end_time)
+        pos = target.at_time(timestamp)
+        sightings.append(Sighting(
+            timestamp=round(timestamp),
+            latitude=pos.latitude + rng.normal(0, 0.01),
+            longitude=pos.longitude + rng.normal(0, 0.01),
+            bearing=get_bearing(target.path[0], target.path[1])
+        ))
+
+    return targets, sightings
+
+
+def measure_assignment(n_targets: int, n_sightings: int) -> dict:
+    """
+    Measure sightings_to_targets() with & without the target index
+    """
+    targets, sightings = random_raids(n_targets, n_sightings)
+
+    result = {'targets': n_targets, 'sightings': n_sightings}
+    assignments = []
+    for indexed in (True, False):
+        start = time.perf_counter()
+        assignments.append(analysis.sightings_to_targets(sightings, targets, indexed=indexed))
+        result['indexed_seconds' if indexed else 'full_scan_seconds'] = time.perf_counter() - start
+
+    result['same_assignment'] = float(numpy.mean(numpy.array(assignments[0]) == numpy.array(assignments[1])))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', type=int, default=8, help='number of simulated scenarios')
+    parser.add_argument('--restarts', type=int, default=4, help='number of EM restarts for the multi-restart run')
+    parser.add_argument('--jobs', type=int, default=-1, help='number of worker processes for the multi-restart run')
+    parser.add_argument('--targets', type=int, default=200, help='number of segments for the assignment benchmark')
+    parser.add_argument('--sightings', type=int, default=2000, help='number of sightings for the assignment benchmark')
+    parser.add_argument('--dense-scenarios', type=int, default=2, help='number of dense scenarios for the sampling benchmark')
+    parser.add_argument('--dense-observers', type=int, default=100, help='number of observers per segment in dense scenarios')
+    parser.add_argument('--sample-sizes', type=int, nargs='*', default=[100, 200, 400], help='sample sizes to compare to the full analysis')
+    args = parser.parse_args()
+
+    scenarios = [scenario(seed) for seed in range(args.scenarios)]
+    dense = [scenario(seed, args.dense_observers) for seed in range(args.dense_scenarios)]
+
+    print(json.dumps({
+        'gating': measure(scenarios),
+        'no_gating': measure(scenarios, bearing_tolerance=None, speed_range=None),
+        'restarts': measure(scenarios, restarts=args.restarts, n_jobs=args.jobs),
+        'assignment': measure_assignment(args.targets, args.sightings),
+        'dense_sightings_mean': float(numpy.mean([len(sightings) for sightings in dense])),
+        'full': measure(dense, coalesce=True),
+        'sampled': {size: measure(dense, coalesce=True, sample_size=size, random_state=0) for size in args.sample_sizes}
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Memory benchmark for in-memory sightings storage.
+
+Measures bytes per stored sighting for the columnar SightingTable (used by MemoryStorage)
+and for a dictionary of Sighting model objects (previous MemoryStorage layout).
+
+Usage:
+    python -m benchmarks.memory_storage [--count 1000000] [--model-count 20000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from bson import ObjectId
+import numpy
+
+from missilemap import Sighting
+from missilemap.table import SightingTable
+
+
+def _random_values(count: int, seed: int = 0):
+    """
+    Generate random sighting values (timestamp, latitude, longitude, bearing)
+    """
+    rng = numpy.random.default_rng(seed)
+    return zip(
+        rng.integers(0, 86400, count).tolist(),
+        rng.uniform(44.0, 52.0, count).tolist(),
+        rng.uniform(22.0, 40.0, count).tolist(),
+        rng.uniform(-numpy.pi, numpy.pi, count).tolist()
+    )
+
+
+def measure_table(count: int) -> dict:
+    """
+    Measure SightingTable memory & insertion time
+    """
+    values = list(_random_values(count))
+    ids = [ObjectId() for _ in range(count)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    table = SightingTable()
+    for sighting_id, (timestamp, latitude, longitude, bearing) in zip(ids, values):
+        table.add(sighting_id, timestamp, latitude, longitude, bearing)
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    table.compact()  # drop over-allocated rows & the recent ids dictionary
+
+    return {
+        'count': count,
+        'bytes_per_sighting': memory / count,
+        'compacted_bytes_per_sighting': table.nbytes / count,
+        'add_us': 1e6 * elapsed / count
+    }
+
+
+def measure_models(count: int) -> dict:
+    """
+    Measure memory of a dictionary of Sighting objects
+    """
+    values = list(_random_values(count))
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    sightings = {}
+    for timestamp, latitude, longitude, bearing in values:
+        s = Sighting(timestamp=timestamp, latitude=latitude, longitude=longitude, bearing=bearing)
+        sightings[s.id] = s
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        'count': count,
+        'bytes_per_sighting': memory / count,
+        'add_us': 1e6 * elapsed / count
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=1000000, help='number of sightings for the columnar table')
+    parser.add_argument('--model-count', type=int, default=20000, help='number of sightings for the model dictionary')
+    args = parser.parse_args()
+
+    print(json.dumps({
+        'table': measure_table(args.count),
+        'models': measure_models(args.model_count)
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
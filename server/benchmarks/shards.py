@@ -0,0 +1,140 @@
+"""
+Geo-sharded analysis scaling benchmark.
+
+Generates random raids over the whole area (see benchmarks.analysis.random_raids()), saves the sightings to
+a dataset file & runs one analysis round of all shards with 1..N local worker processes sharing a file work queue
+(see missilemap.shards). Every worker loads the sightings into its own storage before the round starts.
+Reports the round wall time, shards/s, speedup & parallel efficiency per number of processes, and the merged
+targets (merge time & fraction of sightings explained by the merged targets).
+
+Usage:
+    python -m benchmarks.shards [--processes 1 2 4 8] [--rows 4] [--cols 4] [--targets 64] [--sightings 1600]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Sequence
+
+import numpy
+
+from benchmarks.analysis import random_raids
+from missilemap.analysis import MAX_DISTANCE, sightings_to_targets
+from missilemap.cluster import FileTargetStore
+from missilemap.dataset import import_sightings, write_sightings
+from missilemap.shards import get_shard_cluster, Shard, shard_grid, ShardMerger, ShardWorker
+from missilemap.storage import MemoryStorage
+
+AREA = (22.0, 44.0, 40.0, 52.0)  # (min longitude, min latitude, max longitude, max latitude) of the simulated raids
+
+
+async def _work(path: str, dataset: str, shards: Sequence[Shard], barrier) -> int:
+    storage = MemoryStorage()
+    await import_sightings(storage, dataset)
+    worker = ShardWorker(storage, *get_shard_cluster('file', shards, path=path), shards, poll_interval=-1)
+    barrier.wait()
+    count = await worker.work()
+    await worker.shutdown()
+    return count
+
+
+def _worker(path: str, dataset: str, shards: Sequence[Shard], barrier, results):
+    """
+    Worker process: analyze shards until the queue is drained
+    """
+    start = time.perf_counter()
+    count = asyncio.run(_work(path, dataset, shards, barrier))
+    results.put((count, time.perf_counter() - start))
+
+
+def run_round(processes: int, dataset: str, shards: Sequence[Shard], path: str) -> dict:
+    """
+    Run one analysis round of all shards with the specified number of worker processes
+
+    :param processes: number of worker processes
+    :param dataset: sightings file
+    :param shards: list of shards
+    :param path: directory of the work queue & shard target stores
+    """
+    queue, _ = get_shard_cluster('file', shards, path=path)
+    asyncio.run(queue.submit([shard.id for shard in shards]))
+
+    barrier = multiprocessing.Barrier(processes + 1)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker, args=(path, dataset, shards, barrier, results)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()  # all workers loaded the sightings
+    start = time.perf_counter()
+    counts = [results.get()[0] for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    return {
+        'processes': processes,
+        'seconds': elapsed,
+        'shards_per_sec': len(shards) / elapsed,
+        'shards_per_process': counts
+    }
+
+
+async def merge(path: str, shards: Sequence[Shard]):
+    """
+    Merge the shard targets published by a round
+    """
+    queue, stores = get_shard_cluster('file', shards, path=path)
+    merger = ShardMerger(queue, stores, shards, FileTargetStore(os.path.join(path, 'merged')), merge_interval=-1)
+    start = time.perf_counter()
+    target_set = await merger.merge()
+    elapsed = time.perf_counter() - start
+    await merger.shutdown()
+    return target_set, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of worker processes to measure')
+    parser.add_argument('--rows', type=int, default=4, help='number of shard rows')
+    parser.add_argument('--cols', type=int, default=4, help='number of shard columns')
+    parser.add_argument('--targets', type=int, default=64, help='number of simulated targets')
+    parser.add_argument('--sightings', type=int, default=1600, help='number of simulated sightings')
+    args = parser.parse_args()
+
+    targets, sightings = random_raids(args.targets, args.sightings)
+    shards = shard_grid(AREA, args.rows, args.cols)
+
+    with tempfile.TemporaryDirectory(prefix='benchmark_shards') as path:
+        dataset = os.path.join(path, 'sightings.npz')
+        write_sightings(dataset, sightings)
+
+        rounds = [
+            run_round(processes, dataset, shards, os.path.join(path, f'round{processes}')) for processes in sorted(args.processes)
+        ]
+        for result in rounds:
+            result['speedup'] = rounds[0]['seconds'] * rounds[0]['processes'] / result['seconds']
+            result['efficiency'] = result['speedup'] / result['processes']
+
+        # merge the results of the last round:
+        target_set, merge_seconds = asyncio.run(merge(os.path.join(path, f'round{rounds[-1]["processes"]}'), shards))
+
+    distances = numpy.array([d for _, d in sightings_to_targets(sightings, target_set.targets, with_distance=True)])
+    print(json.dumps({
+        'shards': len(shards),
+        'sightings': len(sightings),
+        'cpu_count': os.cpu_count(),
+        'rounds': rounds,
+        'merge': {
+            'seconds': merge_seconds,
+            'simulated_targets': len(targets),
+            'merged_targets': len(target_set.targets),
+            'explained': float(numpy.mean(distances < MAX_DISTANCE))
+        }
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
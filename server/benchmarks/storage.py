@@ -0,0 +1,211 @@
+"""
+Storage backend throughput & latency benchmark.
+
+Runs the same workload mix against ISightingStorage backends:
+
+* add: bursts of concurrent add_sighting() calls
+* list: list_sightings() & list_records() at growing storage sizes
+* remove: remove_sighting() of stored sightings
+* clear: clear_sightings() of a full storage
+
+Reports ops/s & latency percentiles (milliseconds) per operation as JSON. The MongoDB backend runs against
+a throwaway local mongod (see test/mongoutils.py), `mongod` must be on the PATH.
+
+Usage:
+    python -m benchmarks.storage [--backends memory mongodb] [--bursts 20] [--burst-size 500] [--concurrency 50]
+                                 [--sizes 1000 10000 100000] [--repeat 5] [--removes 1000]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable, Dict, List, Sequence
+
+from motor.motor_asyncio import AsyncIOMotorClient
+import numpy
+
+from missilemap import Sighting
+from missilemap.storage import get_storage, ISightingStorage
+
+PERCENTILES = (50, 90, 99)    # reported latency percentiles
+MONGODB_START_TIMEOUT = 30.0  # time (seconds) to wait for a local mongod to accept connections
+
+
+def _sightings(count: int, rng: numpy.random.Generator) -> List[Sighting]:
+    """
+    Generate random sightings
+    """
+    return [
+        Sighting(timestamp=timestamp, latitude=latitude, longitude=longitude, bearing=bearing)
+        for timestamp, latitude, longitude, bearing in zip(
+            rng.integers(0, 86400, count).tolist(),
+            rng.uniform(44.0, 52.0, count).tolist(),
+            rng.uniform(22.0, 40.0, count).tolist(),
+            rng.uniform(-numpy.pi, numpy.pi, count).tolist()
+        )
+    ]
+
+
+def _summary(latencies: Sequence[float], elapsed: float) -> dict:
+    """
+    Throughput & latency percentiles of an operation
+
+    :param latencies: latency (seconds) per call
+    :param elapsed: wall time (seconds) of all calls
+    """
+    latencies = numpy.asarray(latencies, dtype=float)
+    return {
+        'ops': len(latencies),
+        'ops_per_sec': len(latencies) / elapsed if elapsed > 0 else None,
+        **{f'p{p}_ms': 1e3 * float(numpy.percentile(latencies, p)) for p in PERCENTILES},
+        'max_ms': 1e3 * float(latencies.max())
+    } if len(latencies) else {'ops': 0}
+
+
+async def _timed(func: Callable, latencies: List[float], *args):
+    """
+    Await a call & record its latency
+    """
+    start = time.perf_counter()
+    result = await func(*args)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def _fill(storage: ISightingStorage, sightings: Sequence[Sighting], concurrency: int, latencies: List[float]) -> float:
+    """
+    Add sightings with up to `concurrency` calls in flight
+
+    :return: wall time (seconds)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _add(sighting: Sighting):
+        async with semaphore:
+            await _timed(storage.add_sighting, latencies, sighting)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[_add(s) for s in sightings])
+    return time.perf_counter() - start
+
+
+async def run_workload(storage: ISightingStorage, bursts: int = 20, burst_size: int = 500, concurrency: int = 50,
+                       sizes: Sequence[int] = (1000, 10000, 100000), repeat: int = 5, removes: int = 1000, seed: int = 0) -> dict:
+    """
+    Run the workload mix against a storage
+
+    :param storage: storage to measure (cleared before & after the run)
+    :param bursts: number of add_sighting() bursts
+    :param burst_size: number of add_sighting() calls per burst
+    :param concurrency: maximum number of concurrent calls within a burst
+    :param sizes: storage sizes (number of sightings) to measure listing at
+    :param repeat: number of list calls per size
+    :param removes: number of remove_sighting() calls
+    :param seed: random seed
+    :return: results per operation (see _summary())
+    """
+    rng = numpy.random.default_rng(seed)
+    await storage.clear_sightings()
+    result = {}
+
+    # concurrent bursts of adds (the burst wall time includes waiting for the slowest call):
+    latencies = []
+    elapsed = 0.0
+    for _ in range(bursts):
+        elapsed += await _fill(storage, _sightings(burst_size, rng), concurrency, latencies)
+    result['add_sighting'] = _summary(latencies, elapsed)
+    await storage.clear_sightings()
+
+    # listing at growing sizes:
+    for name in ('list_sightings', 'list_records'):
+        result[name] = {}
+    stored = []
+    for size in sorted(sizes):
+        added = _sightings(size - len(stored), rng)
+        await _fill(storage, added, concurrency, [])
+        stored.extend(added)
+
+        for name in ('list_sightings', 'list_records'):
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(repeat):
+                await _timed(getattr(storage, name), latencies)
+            result[name][str(size)] = _summary(latencies, time.perf_counter() - start)
+
+    # removes from the largest storage:
+    latencies = []
+    removed = rng.choice(len(stored), size=min(removes, len(stored)), replace=False)
+    start = time.perf_counter()
+    for idx in removed.tolist():
+        await _timed(storage.remove_sighting, latencies, stored[idx])
+    result['remove_sighting'] = _summary(latencies, time.perf_counter() - start)
+
+    latencies = []
+    start = time.perf_counter()
+    await _timed(storage.clear_sightings, latencies)
+    result['clear_sightings'] = {'sightings': len(stored) - len(removed), **_summary(latencies, time.perf_counter() - start)}
+    return result
+
+
+async def _wait_for_mongodb(url: str):
+    """
+    Wait until a freshly started mongod accepts connections
+    """
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=1000)
+    deadline = time.monotonic() + MONGODB_START_TIMEOUT
+    try:
+        while True:
+            try:
+                await client.admin.command('ping')
+                return
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+    finally:
+        client.close()
+
+
+async def measure(backend: str, **kwargs) -> dict:
+    """
+    Run the workload against a storage backend ("memory" or "mongodb")
+    """
+    if backend == 'mongodb':
+        from test.mongoutils import start_mongodb, stop_mongodb
+
+        url = f'mongodb://localhost:{start_mongodb()}'
+        try:
+            await _wait_for_mongodb(url)
+            return await run_workload(get_storage(db_type='mongodb', url=url, database='benchmark'), **kwargs)
+        finally:
+            stop_mongodb()
+
+    return await run_workload(get_storage(db_type=backend), **kwargs)
+
+
+async def _main(args) -> Dict[str, dict]:
+    return {
+        backend: await measure(
+            backend, bursts=args.bursts, burst_size=args.burst_size, concurrency=args.concurrency,
+            sizes=args.sizes, repeat=args.repeat, removes=args.removes
+        )
+        for backend in args.backends
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='+', default=['memory', 'mongodb'], help='storage backends to measure')
+    parser.add_argument('--bursts', type=int, default=20, help='number of add_sighting() bursts')
+    parser.add_argument('--burst-size', type=int, default=500, help='number of add_sighting() calls per burst')
+    parser.add_argument('--concurrency', type=int, default=50, help='maximum number of concurrent calls')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='storage sizes to measure listing at')
+    parser.add_argument('--repeat', type=int, default=5, help='number of list calls per size')
+    parser.add_argument('--removes', type=int, default=1000, help='number of remove_sighting() calls')
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(_main(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Targets payload benchmark.
+
+Compares payload size & encode/decode time of the JSON (as served by GET /targets) and the binary
+(missilemap.wire) formats, uncompressed and gzip-compressed.
+
+Usage:
+    python -m benchmarks.wire [--targets 100 10000] [--repeat 5]
+"""
+import argparse
+import gzip
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from benchmarks.analysis import random_raids
+from missilemap import Target
+from missilemap.wire import decode_targets, encode_targets
+
+
+def _best_time(func, repeat: int) -> float:
+    """
+    Best wall time (seconds) of several runs
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def measure(n_targets: int, repeat: int) -> dict:
+    """
+    Measure payload sizes & encode/decode times for random targets
+    """
+    targets, _ = random_raids(n_targets, 0)
+
+    def _encode_json():
+        return json.dumps(jsonable_encoder(targets, custom_encoder={Target: Target.json_encoder})).encode()
+
+    json_data = _encode_json()
+    binary_data = encode_targets(targets)
+
+    return {
+        'targets': n_targets,
+        'json_bytes': len(json_data),
+        'json_gzip_bytes': len(gzip.compress(json_data)),
+        'binary_bytes': len(binary_data),
+        'binary_gzip_bytes': len(gzip.compress(binary_data)),
+        'json_encode_seconds': _best_time(_encode_json, repeat),
+        'binary_encode_seconds': _best_time(lambda: encode_targets(targets), repeat),
+        'json_decode_seconds': _best_time(lambda: [Target.json_decoder(t) for t in json.loads(json_data)], repeat),
+        'binary_decode_seconds': _best_time(lambda: decode_targets(binary_data), repeat)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--targets', type=int, nargs='+', default=[100, 10000], help='number of targets per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per timing (best is reported)')
+    args = parser.parse_args()
+
+    print(json.dumps([measure(n, args.repeat) for n in args.targets], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 """
 Client-side REST API for accessing the server
 """
-from typing import Sequence
+from typing import Sequence, Tuple
 
 from http import HTTPStatus
 import requests
 import urllib.parse
 
 from missilemap import Sighting, Target
+from missilemap.prediction import Predictions
+from missilemap.user import User
+from missilemap.wire import MEDIA_TYPE, decode_targets
 
 
 class ClientAPI:
@@ -39,16 +42,50 @@ class ClientAPI:
             'id': str(sighting.id)
         }))
 
-    def list_targets(self) -> Sequence[Target]:
+    def register_user(self, user: User) -> User:
+        """
+        Register a user (alerts subscriber)
+
+        :param user: user to register
+        :return: registered user
+        """
+        return User(**self._post('/register', json={
+            **user.dict(exclude={'id'}),
+            'id': str(user.id)
+        }))
+
+    def list_targets(self, binary: bool = False, bbox: Tuple[float, float, float, float] = None,
+                     horizon: float = None, timestamp: float = None) -> Sequence[Target]:
         """
         List current set of known targets
 
+        :param binary: if True, request the compact binary format instead of JSON
+        :param bbox: (optional) viewport (min longitude, min latitude, max longitude, max latitude)
+        :param horizon: (optional) prediction horizon (minutes) for the viewport
+        :param timestamp: (optional) start time of the viewport query (default: server time)
         :return: list of targets
         """
+        params = {}
+        if bbox is not None:
+            params['bbox'] = ','.join(map(str, bbox))
+        if horizon is not None:
+            params['horizon'] = horizon
+        if timestamp is not None:
+            params['timestamp'] = timestamp
+
+        if binary:
+            return decode_targets(self._get_content('/targets', params=params, headers={'Accept': MEDIA_TYPE}))
+
         return [
-            Target.json_decoder(t) for t in self._get('/targets')
+            Target.json_decoder(t) for t in self._get('/targets', params=params)
         ]
 
+    def get_predictions(self) -> Predictions:
+        """
+        Get predicted positions of current targets
+        """
+        return Predictions.json_decoder(self._get('/targets/predictions'))
+
     def list_sightings(self) -> Sequence[Sighting]:
         """
         List all sightings (TESTING mode only)
@@ -61,6 +98,12 @@ class ClientAPI:
         """
         return self._delete('/sightings')
 
+    def get_metrics(self) -> dict:
+        """
+        Get server metrics (admission control counters etc.)
+        """
+        return self._get('/metrics')
+
     def _post(self, endpoint, json=None, params=None) -> dict:
         """
         Perform POST request to specified endpoint
@@ -90,6 +133,21 @@ class ClientAPI:
             raise Exception(f"Bad request status: {resp.status_code}, content: {resp.text}")
         return resp.json()
 
+    def _get_content(self, endpoint, params=None, headers=None) -> bytes:
+        """
+        Perform GET request to specified endpoint
+
+        :param endpoint: relative endpoint path
+        :param params: query parameters
+        :param headers: request headers
+        :return: raw (decompressed) response body, an exception is raised if result code is an error
+        """
+        url = urllib.parse.urljoin(self._base_url, endpoint)
+        resp = self._session.get(url, params=params, headers=headers)
+        if resp.status_code not in (HTTPStatus.OK,):
+            raise Exception(f"Bad request status: {resp.status_code}, content: {resp.text}")
+        return resp.content
+
     def _delete(self, endpoint, params=None) -> dict:
         """
         Perform DELETE request to specified endpoint
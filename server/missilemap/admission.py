@@ -0,0 +1,228 @@
+"""
+Admission control for incoming requests.
+
+Protects the server from floods of sightings:
+
+* Per-client (IP address) token buckets limit the rate of reports from a single client (HTTP 429).
+  Behind reverse proxies the client address is taken from X-Forwarded-For, trusting only the entries
+  appended by configured proxies (client supplied headers can't be used to get a fresh bucket).
+* Global in-flight cap limits the number of concurrently processed requests (HTTP 503).
+* In priority mode, read requests (e.g. /targets) are never shed, but count towards the in-flight cap,
+  so ingest is shed first when the server is busy.
+"""
+import dataclasses
+import ipaddress
+import math
+import time
+from typing import Hashable, Optional, Sequence
+
+import numpy
+
+DEFAULT_RATE = 1.0             # default sustained rate (sightings per second per client)
+DEFAULT_BURST = 30.0           # default burst size (sightings per client)
+DEFAULT_MAX_IN_FLIGHT = 256    # default maximum number of concurrently processed requests
+DEFAULT_MAX_CLIENTS = 100000   # default maximum number of tracked clients
+EVICTION_FRACTION = 8          # when out of slots, evict 1/EVICTION_FRACTION least recently seen clients
+
+
+class TokenBuckets:
+    """
+    Token buckets for a bounded number of clients.
+
+    Bucket state is kept in numpy arrays (token count & last update time per slot) with key -> slot dictionary.
+    When out of slots, buckets that were refilled completely are reclaimed first (they are equivalent to new ones),
+    followed by the least recently seen clients.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: float = DEFAULT_BURST, capacity: int = DEFAULT_MAX_CLIENTS):
+        """
+        :param rate: tokens added per second
+        :param burst: bucket size (max tokens)
+        :param capacity: maximum number of tracked clients
+        """
+        self.rate = rate
+        self.burst = burst
+        self._slots = {}                # key -> slot
+        self._keys = [None] * capacity  # slot -> key
+        self._free = list(range(capacity - 1, -1, -1))
+        self._tokens = numpy.zeros(capacity, dtype=numpy.float64)
+        self._updated = numpy.zeros(capacity, dtype=numpy.float64)
+
+    def __len__(self) -> int:
+        """
+        Number of tracked clients
+        """
+        return len(self._slots)
+
+    def take(self, key: Hashable, now: float = None) -> float:
+        """
+        Take a token from the client's bucket
+
+        :param key: client key
+        :param now: current time (default: time.monotonic())
+        :return: 0 if the token was taken, otherwise time (seconds) until a token becomes available
+        """
+        if now is None:
+            now = time.monotonic()
+
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._new_slot(key, now)
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, self._tokens[slot] + (now - self._updated[slot]) * self.rate)
+
+        self._updated[slot] = now
+        if tokens >= 1.0:
+            self._tokens[slot] = tokens - 1.0
+            return 0.0
+
+        self._tokens[slot] = tokens
+        return (1.0 - tokens) / self.rate
+
+    def _new_slot(self, key: Hashable, now: float) -> int:
+        """
+        Allocate a slot for a new client
+        """
+        if not self._free:
+            self._reclaim(now)
+
+        slot = self._free.pop()
+        self._slots[key] = slot
+        self._keys[slot] = key
+        return slot
+
+    def _reclaim(self, now: float):
+        """
+        Free slots of idle clients (or the least recently seen clients)
+        """
+        idle = numpy.flatnonzero(now - self._updated >= self.burst / self.rate)
+        if not len(idle):
+            count = max(1, len(self._keys) // EVICTION_FRACTION)
+            idle = numpy.argpartition(self._updated, count - 1)[:count]
+
+        for slot in idle.tolist():
+            del self._slots[self._keys[slot]]
+            self._keys[slot] = None
+            self._free.append(slot)
+
+
+@dataclasses.dataclass
+class Rejection:
+    """
+    Describes a rejected request
+    """
+    status_code: int    # HTTP status code (429 or 503)
+    retry_after: int    # seconds until the client may retry
+    reason: str
+
+
+@dataclasses.dataclass
+class AdmissionStats:
+    """
+    Admission control counters
+    """
+    admitted: int = 0       # admitted ingest requests
+    rate_limited: int = 0   # ingest requests shed by per-client rate limit (429)
+    overloaded: int = 0     # requests shed by global in-flight cap (503)
+    in_flight: int = 0      # currently processed requests
+    clients: int = 0        # currently tracked clients
+
+
+class AdmissionController:
+    """
+    Decides whether a request can be processed.
+    Each admitted request must be followed by a call to leave() once processed.
+    """
+
+    def __init__(self, rate: Optional[float] = DEFAULT_RATE, burst: float = DEFAULT_BURST,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, max_clients: int = DEFAULT_MAX_CLIENTS,
+                 priority: bool = True, trusted_proxies: Sequence[str] = ()):
+        """
+        :param rate: per-client sustained rate (requests per second). None disables per-client limit.
+        :param burst: per-client burst size
+        :param max_in_flight: maximum number of concurrently processed requests
+        :param max_clients: maximum number of tracked clients
+        :param priority: if True, read requests are never shed
+        :param trusted_proxies: networks (e.g. "10.0.0.0/8") of reverse proxies whose X-Forwarded-For entries are trusted
+        """
+        self._buckets = TokenBuckets(rate=rate, burst=burst, capacity=max_clients) if rate is not None else None
+        self._max_in_flight = max_in_flight
+        self._priority = priority
+        self._stats = AdmissionStats()
+        self._trusted_proxies = [ipaddress.ip_network(network) for network in trusted_proxies]
+
+    @property
+    def stats(self) -> AdmissionStats:
+        """
+        Current admission counters
+        """
+        self._stats.clients = len(self._buckets) if self._buckets is not None else 0
+        return self._stats
+
+    def client_key(self, peer: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+        """
+        Find the client address for rate limiting.
+        X-Forwarded-For entries are walked from the right (closest hop) while the hop is a trusted proxy,
+        so entries added by the client itself are never used.
+
+        :param peer: address of the directly connected peer
+        :param forwarded_for: X-Forwarded-For header value (if any)
+        :return: client address
+        """
+        hops = [h.strip() for h in forwarded_for.split(',')] if forwarded_for else []
+        address = peer
+        while address is not None and self._is_trusted(address) and hops:
+            address = hops.pop()
+        return address
+
+    def _is_trusted(self, address: str) -> bool:
+        """
+        Check whether an address belongs to a trusted proxy
+        """
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self._trusted_proxies)
+
+    def enter_ingest(self, key: Hashable, now: float = None) -> Optional[Rejection]:
+        """
+        Try to admit an ingest request (new sighting)
+
+        :param key: client key (IP address, see client_key())
+        :param now: current time (default: time.monotonic())
+        :return: None if admitted or Rejection object
+        """
+        if self._stats.in_flight >= self._max_in_flight:
+            self._stats.overloaded += 1
+            return Rejection(status_code=503, retry_after=1, reason='Server is overloaded')
+
+        if self._buckets is not None:
+            delay = self._buckets.take(key, now=now)
+            if delay > 0:
+                self._stats.rate_limited += 1
+                return Rejection(status_code=429, retry_after=math.ceil(delay), reason='Too many sightings')
+
+        self._stats.admitted += 1
+        self._stats.in_flight += 1
+        return None
+
+    def enter_read(self) -> Optional[Rejection]:
+        """
+        Try to admit a read request
+
+        :return: None if admitted or Rejection object
+        """
+        if not self._priority and self._stats.in_flight >= self._max_in_flight:
+            self._stats.overloaded += 1
+            return Rejection(status_code=503, retry_after=1, reason='Server is overloaded')
+
+        self._stats.in_flight += 1
+        return None
+
+    def leave(self):
+        """
+        Called when an admitted request is done
+        """
+        self._stats.in_flight -= 1
@@ -0,0 +1,230 @@
+"""
+Alerts for subscribers on the predicted paths of targets.
+
+Subscribers register a location and are indexed by grid cell. After every analysis run the predicted
+positions of all targets (see prediction.py) are rasterized into grid cells, the cells are extended by
+the alert radius and only subscribers of the affected cells are looked up. The cost of a fan-out depends
+on the number of affected cells & alerted subscribers, not on the total number of subscribers.
+
+Alerts are queued by MissileMap and delivered to an alert sink (IAlertSink) by a background service.
+"""
+from abc import ABC, abstractmethod
+import dataclasses
+import math
+from typing import Dict, List, Sequence, Set, Tuple
+
+from bson import ObjectId
+import numpy
+
+from .prediction import DEFAULT_MAX_EXTRAPOLATION, Predictions
+from .utils import logger, METERS_PER_DEGREE
+
+DEFAULT_ALERT_CELL = 0.05          # subscription grid cell size (degrees)
+DEFAULT_ALERT_RADIUS = 10000.0     # subscribers closer than this (meters) to a predicted path are alerted
+DEFAULT_ALERT_COOLDOWN = 60.0      # minimum time (seconds) between repeated alerts about the same target
+DEFAULT_ETA_TOLERANCE = 60.0       # alerts with eta closer than this (seconds) are considered to be about the same target
+
+
+@dataclasses.dataclass
+class Alert:
+    """
+    Alert for a single subscriber about a single approaching target
+    """
+    user_id: ObjectId  # subscriber
+    version: int       # version of the target set
+    target: int        # target index in the target set
+    eta: float         # predicted time (seconds since epoch) when the target is closest to the subscriber's cell
+
+
+class IAlertSink(ABC):
+    """
+    Alert delivery interface (push notification service etc.)
+    """
+    @abstractmethod
+    async def send(self, alerts: Sequence[Alert]):
+        """
+        Deliver alerts
+        """
+        raise NotImplementedError()
+
+
+class LocalAlertSink(IAlertSink):
+    """
+    Stand-in alert sink: keeps delivered alerts in memory
+    """
+
+    def __init__(self):
+        self.alerts = []  # delivered alerts
+
+    async def send(self, alerts: Sequence[Alert]):
+        self.alerts.extend(alerts)
+        logger.debug(f'delivered {len(alerts)} alerts')
+
+
+class SubscriptionIndex:
+    """
+    Subscribers indexed by grid cell of their location
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_ALERT_CELL):
+        """
+        :param cell_size: grid cell size (degrees)
+        """
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Set[ObjectId]] = {}
+        self._users: Dict[ObjectId, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        """
+        Grid cell of a location
+        """
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def add(self, user_id: ObjectId, latitude: float, longitude: float):
+        """
+        Add a subscriber (or move an existing one to a new location)
+        """
+        self.remove(user_id)
+        cell = self.cell(latitude, longitude)
+        self._cells.setdefault(cell, set()).add(user_id)
+        self._users[user_id] = cell
+
+    def remove(self, user_id: ObjectId) -> bool:
+        """
+        Remove a subscriber
+
+        :return: True if the subscriber was registered
+        """
+        cell = self._users.pop(user_id, None)
+        if cell is None:
+            return False
+
+        users = self._cells[cell]
+        users.discard(user_id)
+        if not users:
+            del self._cells[cell]
+        return True
+
+    def subscribers(self, cell: Tuple[int, int]) -> Set[ObjectId]:
+        """
+        Subscribers in a grid cell
+        """
+        return self._cells.get(cell, set())
+
+
+class AlertCooldown:
+    """
+    Suppresses repeated alerts about the same target.
+
+    Target indices change between analysis generations, so a target is identified by its subscriber &
+    predicted arrival time: an alert is repeated only if the subscriber was not alerted about a target
+    arriving at about the same time during the cooldown. Alerts about other targets are not delayed.
+    """
+
+    def __init__(self, cooldown: float = DEFAULT_ALERT_COOLDOWN, eta_tolerance: float = DEFAULT_ETA_TOLERANCE):
+        """
+        :param cooldown: minimum time (seconds) between repeated alerts about the same target
+        :param eta_tolerance: alerts with eta closer than this (seconds) are about the same target
+        """
+        self._cooldown = cooldown
+        self._eta_tolerance = eta_tolerance
+        self._recent: Dict[ObjectId, List[Tuple[float, float]]] = {}  # (alert time, eta) per recently alerted subscriber
+
+    def filter(self, alerts: Sequence[Alert], now: float) -> List[Alert]:
+        """
+        Drop alerts sent recently & remember the rest
+
+        :param alerts: candidate alerts
+        :param now: current time (seconds since epoch)
+        :return: alerts to send
+        """
+        recent = {}
+        for user_id, sent in self._recent.items():
+            sent = [(t, eta) for t, eta in sent if t > now - self._cooldown]
+            if sent:
+                recent[user_id] = sent
+
+        result = [
+            alert for alert in alerts
+            if all(abs(alert.eta - eta) > self._eta_tolerance for _, eta in recent.get(alert.user_id, ()))
+        ]
+        for alert in result:
+            recent.setdefault(alert.user_id, []).append((now, alert.eta))
+
+        self._recent = recent
+        return result
+
+
+def affected_cells(predictions: Predictions, end_times: Sequence[float],
+                   cell_size: float = DEFAULT_ALERT_CELL,
+                   radius: float = DEFAULT_ALERT_RADIUS,
+                   max_extrapolation: float = DEFAULT_MAX_EXTRAPOLATION) -> numpy.ndarray:
+    """
+    Rasterize predicted paths into grid cells extended by the alert radius
+
+    :param predictions: predicted positions of targets
+    :param end_times: end time of the path per target
+    :param cell_size: grid cell size (degrees)
+    :param radius: alert radius (meters), the cells within the radius are affected as well
+    :param max_extrapolation: predicted positions later than this (seconds) after the end of a path are ignored
+    :return: array of shape (N, 4): (target, latitude cell, longitude cell, time index) per affected cell & target,
+        with the earliest time index the target reaches the cell
+    """
+    positions = predictions.positions
+    times = predictions.times
+    valid = (times[None, :] <= numpy.asarray(end_times, dtype=float)[:, None] + max_extrapolation) & ~numpy.isnan(positions[..., 0])
+    if not valid.any():
+        return numpy.zeros((0, 4), dtype=numpy.int64)
+
+    target_idx, time_idx = numpy.nonzero(valid)
+    cells = numpy.floor(positions[target_idx, time_idx] / cell_size).astype(numpy.int64)
+    rows = _earliest(numpy.column_stack((target_idx, cells, time_idx)))
+
+    # extend by the radius (grid cells are narrower in longitude further from the equator):
+    lat_extent = math.ceil(radius / (cell_size * METERS_PER_DEGREE))
+    max_latitude = min(numpy.abs(positions[target_idx, time_idx, 0]).max() + lat_extent * cell_size, 89.0)
+    lon_extent = math.ceil(radius / (cell_size * METERS_PER_DEGREE * math.cos(math.radians(max_latitude))))
+    offsets = numpy.array([
+        (0, dy, dx, 0) for dy in range(-lat_extent, lat_extent + 1) for dx in range(-lon_extent, lon_extent + 1)
+    ], dtype=numpy.int64)
+
+    return _earliest((rows[:, None, :] + offsets[None, :, :]).reshape(-1, 4))
+
+
+def _earliest(rows: numpy.ndarray) -> numpy.ndarray:
+    """
+    Keep a single (earliest time) row per (target, latitude cell, longitude cell)
+    """
+    rows = rows[numpy.argsort(rows[:, 3], kind='stable')]
+    _, first = numpy.unique(rows[:, :3], axis=0, return_index=True)
+    return rows[first]
+
+
+def fan_out(predictions: Predictions, end_times: Sequence[float], subscriptions: SubscriptionIndex,
+            radius: float = DEFAULT_ALERT_RADIUS,
+            max_extrapolation: float = DEFAULT_MAX_EXTRAPOLATION) -> List[Alert]:
+    """
+    Find subscribers on the predicted paths of targets
+
+    :param predictions: predicted positions of targets
+    :param end_times: end time of the path per target
+    :param subscriptions: subscribers index
+    :param radius: alert radius (meters)
+    :param max_extrapolation: predicted positions later than this (seconds) after the end of a path are ignored
+    :return: alerts (a single alert per subscriber & target, with the earliest eta)
+    """
+    rows = affected_cells(predictions, end_times, subscriptions.cell_size, radius, max_extrapolation)
+    rows = rows[numpy.argsort(rows[:, 3], kind='stable')]
+
+    alerts = {}
+    for target, lat_cell, lon_cell, time_idx in rows.tolist():
+        for user_id in subscriptions.subscribers((lat_cell, lon_cell)):
+            if (user_id, target) not in alerts:
+                alerts[user_id, target] = Alert(
+                    user_id=user_id, version=predictions.version, target=target, eta=predictions.start_time + time_idx * predictions.step
+                )
+
+    return list(alerts.values())
@@ -2,22 +2,36 @@
 Analysis algorithms to support the core application logic
 """
 import math
+import time
+import warnings
 from geopy import Point
 from geopy.distance import distance
+from joblib import delayed, Parallel
 import numpy
-import random
 from sklearn.mixture import GaussianMixture
-from typing import Sequence
+from typing import Sequence, List, Tuple, Union
 
-from .definitions import Sighting, Target, DEFAULT_SPEED
-from .utils import logger
+from .coalesce import coalesce_sightings, stratified_sample
+from .definitions import Sighting, Target, TARGET_SPEED_RANGE
+from .index import TargetIndex
+from .linking import DEFAULT_LINK_GAP, link_segments
+from .utils import closest_point, get_bearing, logger, to_local_xy
 
 MAX_SEGMENTS = 1000
+MAX_DISTANCE = 10000             # maximum distance (meters) between a sighting and the target explaining it
+PROPOSAL_CANDIDATES = 256        # default number of candidate segments for propose_segments()
+PROPOSAL_WINDOW = 32             # candidate segment connects a sighting with one of the next N sightings (in time)
+PROPOSAL_CHUNK = 4 * 1024**2     # max number of (candidate, sighting) pairs scored at once
+BEARING_TOLERANCE = math.pi / 4  # maximum difference between sighting bearing & target heading (radians)
+INDEX_MIN_TARGETS = 16           # minimum number of targets to index for sightings_to_targets()
+DEFAULT_RESTARTS = 4             # default number of restarts for multi_restart_em()
+STITCH_TOLERANCE = 2000          # junction vertices of stitched targets closer than this (meters) to a straight path are dropped
 
 
-def _estimate_segment(sightings: Sequence[Sighting]) -> Target:
+def _estimate_segment(sightings: Sequence[Sighting], weights: Sequence[float] = None) -> Target:
     """
     Get the segment that best explains specified sightings.
+    If weights are specified, solves weighted least squares (a sighting with weight w counts as w identical sightings).
 
     Assumes linear motion in both directions where:
         latitude = dlat * t + lat0
@@ -45,7 +59,12 @@ def _estimate_segment(sightings: Sequence[Sighting]) -> Target:
 
     lat = [s.latitude for s in sightings]
     lon = [s.longitude for s in sightings]
-    b = lat + lon
+    b = numpy.array(lat + lon)
+
+    if weights is not None:
+        w = numpy.sqrt(numpy.tile(numpy.asarray(weights, dtype=float), 2))
+        a = a * w[:, numpy.newaxis]
+        b = b * w
 
     x, res, rank, s = numpy.linalg.lstsq(a, b, rcond=None)
 
@@ -73,6 +92,13 @@ def _estimate_segment(sightings: Sequence[Sighting]) -> Target:
         (lon_range[1] - x[3]) / x[2] if x[2] != 0 else min(timestamps)
     )
 
+    # ill-conditioned fits (e.g. almost no motion in one direction) must not extrapolate beyond the observed time range:
+    t_start = max(t_start, timestamps.min())
+    t_end = min(t_end, timestamps.max())
+    if t_end <= t_start:
+        t_start, t_end = timestamps.min(), timestamps.max()
+    t_start, t_end = float(t_start), float(t_end)
+
     # compute lat/long range from t_start & t_end:
     lat_range_est = (
         (numpy.array([t_start, 1]) * x[:2]).sum(),
@@ -96,30 +122,86 @@ def _estimate_segment(sightings: Sequence[Sighting]) -> Target:
     )
 
 
-def sightings_to_targets(sightings: Sequence[Sighting], targets: Sequence[Target], with_distance=False):
+def _bearing_difference(a, b):
+    """
+    Absolute difference between bearings (radians, array-like) in range [0..pi]
+    """
+    return numpy.abs((numpy.asarray(a) - numpy.asarray(b) + math.pi) % (2 * math.pi) - math.pi)
+
+
+def _plausible(target: Target, speed_range: Tuple[float, float] = TARGET_SPEED_RANGE) -> bool:
+    """
+    Check whether target speed is physically plausible
+
+    :param speed_range: (min, max) speed (m/sec) or None to accept any speed
+    """
+    return speed_range is None or speed_range[0] <= target.speed <= speed_range[1]
+
+
+def _legs(target: Target) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    End time & heading (radians) per leg of a target path
+    """
+    leg_ends = target.start_time + numpy.cumsum(target.distances) / target.speed
+    headings = numpy.array([get_bearing(p1, p2) for p1, p2 in zip(target.path[:-1], target.path[1:])])
+    return leg_ends, headings
+
+
+def sightings_to_targets(sightings: Sequence[Sighting], targets: Sequence[Target], with_distance=False,
+                         bearing_tolerance: float = BEARING_TOLERANCE, indexed=True):
     """
     Provided a list of sightings and a list of targets, choose best target per sighting
 
     :param sightings: list of sightings
     :param targets: list of targets
     :param with_distance: if True, return tuples of (idx, distance) otherwise returns idx only
+    :param bearing_tolerance: maximum difference (radians) between sighting bearing & target heading, None to disable gating
+    :param indexed: if True, use TargetIndex to find candidate targets (when there are at least INDEX_MIN_TARGETS targets)
 
     Returns a list of assigned target indices.
 
-    For each sighting, identify the "closest" target (temporal & spatial)
+    For each sighting, identify the "closest" target (temporal & spatial).
+    Distances are computed for the most plausible targets first:
+
+    1. targets active nearby at the sighting time (see TargetIndex) moving in the reported direction
+    2. the rest of the nearby targets
+    3. the rest of the targets
+
+    The next group is only considered if none of the previous targets is within MAX_DISTANCE
+    (e.g. the bearing is wrong or the sighting is close to a turn), so pruning never leaves a sighting unexplained.
     """
     result = []
 
+    index = TargetIndex(targets, distance=MAX_DISTANCE) if indexed and len(targets) >= INDEX_MIN_TARGETS else None
+    legs = [_legs(target) for target in targets] if bearing_tolerance is not None else None
+    everything = numpy.arange(len(targets))
+
     for sighting in sightings:
         best_idx = -1
         best_dist = math.inf
 
-        for idx, target in enumerate(targets):
-            pos = target.at_time(sighting.timestamp)
-            d = distance(pos, sighting.location).meters
-            if d < best_dist:
-                best_dist = d
-                best_idx = idx
+        nearby = index.candidates(sighting.timestamp, sighting.latitude, sighting.longitude) if index is not None else everything
+        groups = [nearby]
+        if legs is not None:
+            matching = numpy.array([
+                _bearing_difference(sighting.bearing, headings[min(leg_ends.searchsorted(sighting.timestamp), len(headings) - 1)])
+                <= bearing_tolerance
+                for leg_ends, headings in (legs[idx] for idx in nearby.tolist())
+            ], dtype=bool)
+            groups = [nearby[matching], nearby[~matching]]
+        if index is not None:
+            groups.append(numpy.setdiff1d(everything, nearby, assume_unique=True))
+
+        for group in groups:
+            for idx in group.tolist():
+                pos = targets[idx].at_time(sighting.timestamp)
+                d = distance(pos, sighting.location).meters
+                if d < best_dist:
+                    best_dist = d
+                    best_idx = idx
+
+            if best_dist < MAX_DISTANCE:
+                break
 
         if with_distance:
             result.append((best_idx, best_dist))
@@ -129,28 +211,129 @@ def sightings_to_targets(sightings: Sequence[Sighting], targets: Sequence[Target
     return result
 
 
-def _random_target(sightings: Sequence[Sighting]) -> Target:
+def propose_segments(sightings: Sequence[Sighting], count: int,
+                     weights: Sequence[float] = None,
+                     exclude: Sequence[bool] = None,
+                     n_candidates: int = PROPOSAL_CANDIDATES,
+                     inlier_distance: float = MAX_DISTANCE,
+                     bearing_tolerance: float = BEARING_TOLERANCE,
+                     speed_range: Tuple[float, float] = TARGET_SPEED_RANGE,
+                     random_state=None) -> List[Target]:
     """
-    Generate a random segment by connecting two sightings together
+    Propose segments using RANSAC-style search.
+
+    Candidate segments connect pairs of sightings that are close in time (constant speed motion between the two).
+    Candidates with implausible speed are dropped before scoring.
+    All candidates are scored at once against all sightings by the (weighted) number of inliers:
+    sightings within inlier_distance from the candidate position at the sighting time & with bearing matching the candidate heading.
+    Proposals are selected greedily: the best candidate first, then the best candidate for the remaining sightings etc.
+    Every proposal is re-estimated from its inliers.
 
     :param sightings: list of sightings
-    :return: Target object with single segment path
+    :param count: maximum number of proposals
+    :param weights: (optional) weight per sighting
+    :param exclude: (optional) boolean mask of sightings to ignore (e.g. explained by known targets)
+    :param n_candidates: number of random candidate segments
+    :param inlier_distance: maximum distance (meters) between an inlier and the candidate
+    :param bearing_tolerance: maximum difference (radians) between inlier bearing & candidate heading, None to disable
+    :param speed_range: (min, max) plausible speed (m/sec), None to disable
+    :param random_state: seed or numpy random Generator
+    :return: list of up to count proposed segments (best first)
     """
-    start, end = None, None
-    while start == end:
-        start, end = random.choices(sightings, k=2)
+    rng = numpy.random.default_rng(random_state)
 
-    if start.timestamp > end.timestamp:
-        start, end = end, start
+    active = numpy.flatnonzero(~numpy.asarray(exclude, dtype=bool)) if exclude is not None else numpy.arange(len(sightings))
+    if len(active) < 2 or count <= 0:
+        return []
 
-    return Target(
-        start_time=start.timestamp,
-        speed=DEFAULT_SPEED,
-        path=[start.location, end.location]
-    )
+    sightings = [sightings[i] for i in active]
+    weights = numpy.asarray(weights, dtype=float)[active] if weights is not None else numpy.ones(len(active))
+
+    timestamps = numpy.array([s.timestamp for s in sightings], dtype=float)
+    bearings = numpy.array([s.bearing for s in sightings], dtype=float)
+    x, y = to_local_xy([s.latitude for s in sightings], [s.longitude for s in sightings])
+
+    # candidate pairs: the second sighting is one of the next PROPOSAL_WINDOW sightings in time
+    order = numpy.argsort(timestamps, kind='stable')
+    first = rng.integers(0, len(order) - 1, n_candidates)
+    second = numpy.minimum(first + rng.integers(1, PROPOSAL_WINDOW + 1, n_candidates), len(order) - 1)
+    i, j = order[first], order[second]
+
+    dt = timestamps[j] - timestamps[i]
+    valid = dt > 0
+    i, j, dt = i[valid], j[valid], dt[valid]
+    vx = (x[j] - x[i]) / dt
+    vy = (y[j] - y[i]) / dt
+    speed = numpy.hypot(vx, vy)
+    valid = speed > 0 if speed_range is None else (speed >= speed_range[0]) & (speed <= speed_range[1])
+    i, vx, vy = i[valid], vx[valid], vy[valid]
+    if not len(i):
+        return []
+    headings = numpy.arctan2(vx, vy)  # x - east, y - north
+
+    # inlier matrix (candidates x sightings), computed in chunks to limit temporary memory:
+    inliers = numpy.empty((len(i), len(sightings)), dtype=bool)
+    max_d2 = inlier_distance * inlier_distance
+    chunk = max(1, PROPOSAL_CHUNK // len(sightings))
+    for c in range(0, len(i), chunk):
+        ci = i[c:c + chunk, numpy.newaxis]
+        t = timestamps[numpy.newaxis, :] - timestamps[ci]
+        dx = x[ci] + vx[c:c + chunk, numpy.newaxis] * t - x[numpy.newaxis, :]
+        dy = y[ci] + vy[c:c + chunk, numpy.newaxis] * t - y[numpy.newaxis, :]
+        inliers[c:c + chunk] = dx * dx + dy * dy <= max_d2
+        if bearing_tolerance is not None:
+            inliers[c:c + chunk] &= _bearing_difference(bearings[numpy.newaxis, :], headings[c:c + chunk, numpy.newaxis]) <= bearing_tolerance
+
+    proposals = []
+    remaining = numpy.ones(len(sightings), dtype=bool)
+    for _ in range(count):
+        scores = inliers[:, remaining] @ weights[remaining]
+        best = int(numpy.argmax(scores))
+        members = numpy.flatnonzero(inliers[best] & remaining)
+        if len(numpy.unique(timestamps[members])) < 2:
+            break
+
+        segment = _estimate_segment([sightings[k] for k in members], weights[members])
+        if _plausible(segment, speed_range):
+            proposals.append(segment)
+        remaining &= ~inliers[best]
+
+    return proposals
+
+
+def _estimate_segments(sightings: numpy.ndarray, target_idx: numpy.ndarray, groups, weights: numpy.ndarray = None,
+                       speed_range: Tuple[float, float] = TARGET_SPEED_RANGE, previous: Sequence[Target] = None) -> List[Target]:
+    """
+    Estimate a segment per group of sightings.
+    Groups with sightings at less than 2 distinct times are dropped.
+    Segments with implausible speed are replaced by the previous segment of the group (if any) or dropped.
+
+    :param sightings: array of sightings
+    :param target_idx: group index per sighting
+    :param groups: group indices to estimate
+    :param weights: (optional) weight per sighting
+    :param speed_range: (min, max) plausible speed (m/sec) or None
+    :param previous: (optional) previous segment per group
+    """
+    targets = []
+    for group in groups:
+        members = target_idx == group
+        if len(set(s.timestamp for s in sightings[members])) < 2:
+            continue
+
+        segment = _estimate_segment(sightings[members], weights[members] if weights is not None else None)
+        if _plausible(segment, speed_range):
+            targets.append(segment)
+        elif previous is not None and 0 <= group < len(previous):
+            targets.append(previous[group])
+    return targets
 
 
-def expectation_maximization(sightings: Sequence[Sighting], n_segments: int, iterations=100) -> Sequence[Target]:
+def expectation_maximization(sightings: Sequence[Sighting], n_segments: int, iterations=100, weights: Sequence[float] = None,
+                             init: Union[str, Sequence[Target]] = 'ransac', random_state=None,
+                             bearing_tolerance: float = BEARING_TOLERANCE,
+                             speed_range: Tuple[float, float] = TARGET_SPEED_RANGE,
+                             deadline: float = None, with_converged=False):
     """
     Runs expectation maximization algorithm to partition sightings into segments.
 
@@ -159,64 +342,468 @@ def expectation_maximization(sightings: Sequence[Sighting], n_segments: int, ite
     * Assign sightings to groups of linear segments
     * Estimate segments from assigned sightings
 
+    Segments that lose all sightings or have implausible speed are re-seeded with propose_segments()
+    from sightings that are not explained.
+
+    :param weights: (optional) weight per sighting (e.g. number of coalesced sightings), used when estimating segments
+    :param init: initialization method: "gmm" (gaussian mixture clustering), "ransac" (see propose_segments())
+        or a list of initial segments (e.g. from a previous run), topped up with proposed segments if there are fewer than n_segments
+    :param random_state: (optional) seed or numpy random Generator for reproducible results
+    :param bearing_tolerance: bearing gating for assignment (see sightings_to_targets()), None to disable
+    :param speed_range: (min, max) plausible segment speed (m/sec), None to disable
+    :param deadline: (optional) time.monotonic() value to stop at. The best segments found so far are returned.
+    :param with_converged: if True, return a tuple (targets, converged) where converged is False
+        if the algorithm was stopped by the deadline or the iteration limit
+    :return: list of segments (the best ones seen, by total distance between sightings & their segments)
     """
     if len(sightings) < 2:
-        return []
-    sightings = numpy.array(sightings)
-
-    m = GaussianMixture(n_components=n_segments)
-    target_idx = m.fit_predict(numpy.array([
-        [s.timestamp, s.latitude, s.longitude] for s in sightings
-    ])).flatten()
+        return ([], True) if with_converged else []
+    sightings = numpy.fromiter(sightings, dtype=object, count=len(sightings))  # 1-D even for tuple records
+    weights = numpy.asarray(weights, dtype=float) if weights is not None else None
+    rng = numpy.random.default_rng(random_state)
 
-    # # generate N random segments
-    targets = [_estimate_segment([s for i, s in zip(target_idx, sightings) if i == segment]) for segment in range(n_segments)]
+    if not isinstance(init, str):
+        targets = list(init)
+        if len(targets) < n_segments:
+            targets += propose_segments(sightings, n_segments - len(targets), weights=weights, bearing_tolerance=bearing_tolerance,
+                                        speed_range=speed_range, random_state=rng)
+        target_idx = numpy.full(len(sightings), -1)
+    elif init == 'gmm':
+        m = GaussianMixture(n_components=n_segments, random_state=int(rng.integers(2 ** 31 - 1)))
+        target_idx = m.fit_predict(numpy.array([
+            [s.timestamp, s.latitude, s.longitude] for s in sightings
+        ])).flatten()
+
+        targets = _estimate_segments(sightings, target_idx, range(n_segments), weights, speed_range)
+    elif init == 'ransac':
+        targets = propose_segments(sightings, n_segments, weights=weights, bearing_tolerance=bearing_tolerance, speed_range=speed_range,
+                                   random_state=rng)
+        target_idx = numpy.full(len(sightings), -1)
+    else:
+        raise ValueError(f'Unknown initialization method: {init}')
 
     # run expectation maximization algorithm:
+    best_targets, best_residual = targets, math.inf
+    converged = False
     for _ in range(iterations):
         prev_idx = target_idx
-        target_idx = numpy.array(sightings_to_targets(sightings, targets))
+        assignment = sightings_to_targets(sightings, targets, with_distance=True, bearing_tolerance=bearing_tolerance)
+        target_idx = numpy.array([a[0] for a in assignment])
+
+        residual = sum(min(a[1], MAX_DISTANCE) for a in assignment)
+        if residual < best_residual:
+            best_targets, best_residual = targets, residual
+
         if numpy.all(prev_idx == target_idx):
             # stop if no change in assignment
+            converged = True
+            break
+
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info(f'expectation maximization stopped by deadline ({n_segments} segments)')
             break
 
-        # now group by target and
-        targets = [
-            _estimate_segment(sightings[target_idx == i]) for i in set(target_idx)
-        ]
+        # now group by target and re-estimate:
+        targets = _estimate_segments(sightings, target_idx, set(target_idx), weights, speed_range, previous=targets)
 
         if len(targets) < n_segments:
-            # Add more segments.
-            # FIXME: improve this part by approximating outliers
-            for _ in range(len(targets), n_segments):
-                targets.append(_random_target(sightings))
+            # add more segments explaining the outliers:
+            explained = numpy.array([a[1] < MAX_DISTANCE for a in assignment])
+            targets += propose_segments(
+                sightings, n_segments - len(targets), weights=weights,
+                exclude=explained if (~explained).sum() >= 2 else None,
+                bearing_tolerance=bearing_tolerance, speed_range=speed_range,
+                random_state=rng
+            )
 
-    return targets
+    targets = targets if converged else best_targets
+    return (targets, converged) if with_converged else targets
+
+
+def _score(sightings: Sequence[Sighting], targets: Sequence[Target], bearing_tolerance: float = BEARING_TOLERANCE) -> Tuple[int, float]:
+    """
+    Score segments by (number of unexplained sightings, total distance between sightings & their segments), lower is better
+    """
+    return _assignment_score(sightings, targets, bearing_tolerance)[:2]
+
+
+def _restart(sightings: Sequence[Sighting], n_segments: int, seed, kwargs: dict):
+    """
+    Run a single EM restart (in a worker process)
+
+    :return: tuple (score, targets, converged)
+    """
+    targets, converged = expectation_maximization(sightings, n_segments, random_state=seed, with_converged=True, **kwargs)
+    return _score(sightings, targets, kwargs.get('bearing_tolerance', BEARING_TOLERANCE)), targets, converged
 
 
-def analyze_sightings(sightings: Sequence[Sighting]) -> Sequence[Target]:
+def multi_restart_em(sightings: Sequence[Sighting], n_segments: int, restarts: int = DEFAULT_RESTARTS, n_jobs: int = None,
+                     random_state=None, with_converged=False, **kwargs):
+    """
+    Run independently seeded expectation_maximization() fits in parallel & pick the best one.
+
+    Fits are compared by the number of unexplained sightings, then by the total distance between sightings
+    & their segments. Remaining fits are cancelled as soon as a converged fit explains all sightings.
+
+    :param sightings: list of sightings
+    :param n_segments: number of segments
+    :param restarts: number of fits
+    :param n_jobs: number of worker processes (joblib semantics: None - 1, -1 - all cores)
+    :param random_state: (optional) seed for reproducible results. Every fit gets an independent seed derived from it.
+    :param with_converged: if True, return a tuple (targets, converged) for the best fit
+    :param kwargs: the rest of expectation_maximization() arguments (weights, deadline, etc.)
+    """
+    seeds = numpy.random.SeedSequence(random_state).spawn(restarts)
+
+    best = None
+    results = Parallel(n_jobs=n_jobs, return_as='generator_unordered')(
+        delayed(_restart)(sightings, n_segments, seed, kwargs) for seed in seeds
+    )
+    try:
+        for score, targets, converged in results:
+            if best is None or score < best[0]:
+                best = (score, targets, converged)
+
+            if converged and not score[0]:
+                # clear winner: no other fit can explain more sightings
+                break
+    finally:
+        with warnings.catch_warnings():
+            # joblib warns about cancelled fits
+            warnings.simplefilter('ignore', UserWarning)
+            results.close()
+
+    _, targets, converged = best
+    return (targets, converged) if with_converged else targets
+
+
+def analyze_sightings(sightings: Sequence[Sighting], with_assignment=False, weights: Sequence[float] = None, coalesce=False,
+                      bearing_tolerance: float = BEARING_TOLERANCE, speed_range: Tuple[float, float] = TARGET_SPEED_RANGE,
+                      deadline: float = None, with_converged=False, restarts: int = 1, n_jobs: int = None,
+                      initial: Sequence[Target] = None, sample_size: int = None, batches: int = 1, random_state=None):
     """
     Analyze specified set of sightings and generate a set of Target objects
 
     :param sightings: set of sightings to analyze
+    :param with_assignment: if True, return a tuple of (targets, assignment) where assignment is a list of target indices per sighting
+    :param weights: (optional) weight per sighting (see coalesce_sightings())
+    :param coalesce: if True, merge near-duplicate sightings before the analysis (see coalesce_sightings())
+    :param bearing_tolerance: bearing gating for assignment (see sightings_to_targets()), None to disable
+    :param speed_range: (min, max) plausible target speed (m/sec), None to disable
+    :param deadline: (optional) time.monotonic() value to stop at. The best solution found so far is returned.
+    :param with_converged: if True, append a converged flag to the result (False if the analysis was cut short by the deadline)
+    :param restarts: number of EM fits per number of segments (see multi_restart_em())
+    :param n_jobs: number of worker processes for the EM fits
+    :param initial: (optional) targets of a previous analysis that did not converge. The analysis continues from them:
+        their legs are the starting segments & the result is never worse than they are.
+    :param sample_size: (optional) scalable mode for very large sets: targets are fitted on a weighted sample of about
+        sample_size sightings (see stratified_sample()), then all sightings are assigned in a single pass.
+        Smaller samples are faster & less accurate.
+    :param batches: number of samples in the scalable mode: the first one is analyzed from scratch,
+        the following ones (mini-batches) refine the targets fitted on the previous ones
+    :param random_state: (optional) seed or numpy random Generator for reproducible results (EM fits & sampling)
     :return: set of Target objects that correspond to the provided targets
+        (or a tuple (targets, [assignment], [converged]) depending on with_assignment & with_converged)
 
     The function attempts to find a number of individual segments that explain the sightings with some tolerance to outliers.
 
     """
+    if coalesce and weights is None:
+        representatives, weights, groups = coalesce_sightings(sightings)
+        targets, assignment, converged = analyze_sightings(representatives, with_assignment=True, weights=weights,
+                                                           bearing_tolerance=bearing_tolerance, speed_range=speed_range,
+                                                           deadline=deadline, with_converged=True, restarts=restarts, n_jobs=n_jobs,
+                                                           initial=initial, sample_size=sample_size, batches=batches,
+                                                           random_state=random_state)
+        assignment = numpy.asarray(assignment, dtype=numpy.int64)[groups].tolist()
+        return _analysis_result(targets, assignment, converged, with_assignment, with_converged)
+
     if len(sightings) < 2:
-        return []
+        return _analysis_result([], [-1] * len(sightings), True, with_assignment, with_converged)
 
-    MAX_DISTANCE = 10000
+    if sample_size is not None and len(sightings) > sample_size:
+        targets, assignment, converged = _analyze_samples(sightings, weights, sample_size, batches, random_state, initial=initial,
+                                                          bearing_tolerance=bearing_tolerance, speed_range=speed_range,
+                                                          deadline=deadline, restarts=restarts, n_jobs=n_jobs)
+        return _analysis_result(targets, assignment, converged, with_assignment, with_converged)
 
-    # analyze individual segments
-    targets = []
-    for n_seg in range(1, MAX_SEGMENTS):
-        targets = expectation_maximization(sightings, n_segments=n_seg)
-        assignment = sightings_to_targets(sightings=sightings, targets=targets, with_distance=True)
-        if all([a[1] < MAX_DISTANCE for a in assignment]):
+    targets, assignment, converged = _fit_segments(sightings, _legs_to_segments(initial) if initial else [], weights=weights,
+                                                   bearing_tolerance=bearing_tolerance, speed_range=speed_range, deadline=deadline,
+                                                   restarts=restarts, n_jobs=n_jobs, random_state=random_state)
+
+    # join individual segments into multi-segment targets:
+    targets, mapping = link_segments(targets, sightings, assignment, max_distance=MAX_DISTANCE)
+    assignment = [int(mapping[a]) if a >= 0 else -1 for a in assignment]
+
+    return _analysis_result(targets, assignment, converged, with_assignment, with_converged)
+
+
+def _fit_segments(sightings: Sequence[Sighting], segments: Sequence[Target], weights: Sequence[float] = None,
+                  bearing_tolerance: float = BEARING_TOLERANCE, speed_range: Tuple[float, float] = TARGET_SPEED_RANGE,
+                  deadline: float = None, restarts: int = 1, n_jobs: int = None, random_state=None) -> Tuple[List[Target], List[int], bool]:
+    """
+    Find individual segments explaining the sightings (growing the number of segments until all sightings are explained)
+
+    :param segments: starting segments (e.g. legs of previous targets), the result is never worse than they are
+    :param random_state: (optional) seed or numpy random Generator, every number of segments gets a seed derived from it
+    :return: tuple (segments, segment index per sighting, converged)
+    """
+    rng = numpy.random.default_rng(random_state)
+
+    # keep the best solution (fewest unexplained sightings, then the smallest residual):
+    best = None
+    converged = False
+    if segments:
+        # legs without sightings (e.g. turns between linked segments) are dropped:
+        assigned = numpy.array(sightings_to_targets(sightings, segments, bearing_tolerance=bearing_tolerance), dtype=numpy.int64)
+        counts = numpy.bincount(assigned[assigned >= 0], minlength=len(segments))
+        segments = [segment for segment, count in zip(segments, counts.tolist()) if count >= 2]
+        best = _assignment_score(sightings, segments, bearing_tolerance) if segments else None
+
+    for n_seg in range(max(len(segments), 1), MAX_SEGMENTS):
+        em_args = dict(weights=weights, bearing_tolerance=bearing_tolerance, speed_range=speed_range, deadline=deadline, with_converged=True,
+                       init=segments if segments and n_seg == len(segments) else 'ransac', random_state=int(rng.integers(2 ** 32)))
+        if restarts > 1:
+            targets, em_converged = multi_restart_em(sightings, n_seg, restarts=restarts, n_jobs=n_jobs, **em_args)
+        else:
+            targets, em_converged = expectation_maximization(sightings, n_seg, **em_args)
+
+        unexplained, residual, _, _ = candidate = _assignment_score(sightings, targets, bearing_tolerance)
+        if best is None or (unexplained, residual) < best[:2]:
+            best = candidate
+
+        if not unexplained or len(targets) < n_seg:
+            # all sightings are explained or no more plausible segments (the rest of the sightings are outliers)
+            converged = em_converged
+            break
+
+        if deadline is not None and time.monotonic() >= deadline:
+            logger.info(f'analysis stopped by deadline ({n_seg} segments, {unexplained} unexplained sightings)')
             break
 
-    # TODO: join individual segments
+    _, _, targets, assignment = best
+    return targets, [a[0] for a in assignment], converged
 
-    return targets
+
+def _analyze_samples(sightings: Sequence[Sighting], weights: Sequence[float], sample_size: int, batches: int, random_state,
+                     initial: Sequence[Target] = None, bearing_tolerance: float = BEARING_TOLERANCE, **kwargs):
+    """
+    Analyze stratified samples of sightings (see analyze_sightings() sample_size & batches)
+
+    :return: tuple (targets, assignment of all sightings, converged)
+    """
+    rng = numpy.random.default_rng(random_state)
+    segments = _legs_to_segments(initial) if initial else []
+    for _ in range(max(batches, 1)):
+        # segments fitted on the previous batch are the starting segments for the next one:
+        indices, sample_weights = stratified_sample(sightings, sample_size, weights=weights, random_state=rng)
+        batch = [sightings[i] for i in indices.tolist()]
+        segments, batch_assignment, converged = _fit_segments(batch, segments, weights=sample_weights,
+                                                              bearing_tolerance=bearing_tolerance, random_state=rng, **kwargs)
+    targets, _ = link_segments(segments, batch, batch_assignment, max_distance=MAX_DISTANCE)
+
+    # a single assignment pass over all sightings, targets that explain less than 2 sightings are dropped:
+    assignment = numpy.array(sightings_to_targets(sightings, targets, bearing_tolerance=bearing_tolerance), dtype=numpy.int64)
+    counts = numpy.bincount(assignment[assignment >= 0], minlength=len(targets))
+    kept = numpy.flatnonzero(counts >= 2)
+    mapping = numpy.full(len(targets) + 1, -1)  # the last item maps -1 (not assigned)
+    mapping[kept] = numpy.arange(len(kept))
+    return [targets[i] for i in kept.tolist()], mapping[assignment].tolist(), converged
+
+
+def _assignment_score(sightings: Sequence[Sighting], targets: Sequence[Target], bearing_tolerance: float):
+    """
+    Assign sightings to segments
+
+    :return: tuple (unexplained sightings, residual, targets, assignment)
+    """
+    assignment = sightings_to_targets(sightings=sightings, targets=targets, with_distance=True, bearing_tolerance=bearing_tolerance)
+    unexplained = sum(a[1] >= MAX_DISTANCE for a in assignment)
+    residual = sum(min(a[1], MAX_DISTANCE) for a in assignment)
+    return unexplained, residual, targets, assignment
+
+
+def _legs_to_segments(targets: Sequence[Target]) -> List[Target]:
+    """
+    Split (linked) targets into single-leg segments
+    """
+    segments = []
+    for target in targets:
+        start_time = target.start_time
+        for p1, p2, d in zip(target.path[:-1], target.path[1:], target.distances):
+            if d > 0:
+                segments.append(Target(start_time=start_time, speed=target.speed, path=[p1, p2]))
+            start_time += d / target.speed
+    return segments
+
+
+def _analysis_result(targets: List[Target], assignment: List[int], converged: bool, with_assignment: bool, with_converged: bool):
+    """
+    Build analyze_sightings() result depending on requested outputs
+    """
+    result = (targets,) + ((assignment,) if with_assignment else ()) + ((converged,) if with_converged else ())
+    return result if len(result) > 1 else targets
+
+
+def update_analysis(sightings: Sequence[Sighting], targets: Sequence[Target], assignment: Sequence[int],
+                    coalesce=False, deadline: float = None, with_converged=False, restarts: int = 1, n_jobs: int = None,
+                    sample_size: int = None, random_state=None):
+    """
+    Incrementally update results of analyze_sightings() with newly added sightings.
+
+    :param sightings: all sightings. The first len(assignment) sightings were already analyzed, the rest are new.
+    :param targets: previously identified targets
+    :param assignment: target index per previously analyzed sighting
+    :param coalesce: if True, merge near-duplicate sightings when re-estimating targets
+    :param deadline: (optional) time.monotonic() value to stop the full analysis at (see analyze_sightings())
+    :param with_converged: if True, return a tuple (targets, assignment, converged)
+    :param restarts: number of EM fits per number of segments for the full analysis (see multi_restart_em())
+    :param n_jobs: number of worker processes for the EM fits
+    :param sample_size: (optional) sample size for the full analysis of very large sets (see analyze_sightings())
+    :param random_state: (optional) seed for a reproducible full analysis (see analyze_sightings())
+    :return: tuple (targets, assignment) for all sightings
+
+    If the new sightings are explained by existing targets, only the targets that received new sightings are re-estimated.
+    Otherwise, falls back to full analysis.
+    """
+    new_sightings = sightings[len(assignment):]
+    if not len(new_sightings):
+        return _analysis_result(list(targets), list(assignment), True, True, with_converged)
+
+    new_assignment = sightings_to_targets(sightings=new_sightings, targets=targets, with_distance=True)
+    if not len(targets) or any([a[1] >= MAX_DISTANCE for a in new_assignment]):
+        return analyze_sightings(sightings, with_assignment=True, coalesce=coalesce, deadline=deadline, with_converged=with_converged,
+                                 restarts=restarts, n_jobs=n_jobs, sample_size=sample_size, random_state=random_state)
+
+    targets = list(targets)
+    assignment = list(assignment) + [a[0] for a in new_assignment]
+    for idx in set(a[0] for a in new_assignment):
+        if len(targets[idx].path) > 2:
+            # linked multi-segment target still explains the new sightings: keep it (re-linked by the next full analysis)
+            continue
+
+        segment_sightings = [s for s, i in zip(sightings, assignment) if i == idx]
+        weights = None
+        if coalesce:
+            segment_sightings, weights, _ = coalesce_sightings(segment_sightings)
+        if len(segment_sightings) >= 2:
+            targets[idx] = _estimate_segment(segment_sightings, weights)
+
+    return _analysis_result(targets, assignment, True, True, with_converged)
+
+
+def clip_target(target: Target, start_time: float, end_time: float) -> Target:
+    """
+    Part of a target between the specified times (within the target time span)
+    """
+    start_time, end_time = max(start_time, target.start_time), min(end_time, target.end_time)
+    if start_time == target.start_time and end_time == target.end_time:
+        return target
+
+    path = [target.at_time(start_time)]
+    arrival = target.start_time
+    for point, d in zip(target.path[1:], target.distances):
+        arrival += d / target.speed
+        if arrival >= end_time:
+            break
+        if arrival > start_time:
+            path.append(point)
+    path.append(target.at_time(end_time))
+    return Target(start_time=start_time, speed=target.speed, path=path)
+
+
+def _vertex_times(target: Target) -> numpy.ndarray:
+    """
+    Arrival time at every path point of a target
+    """
+    return target.start_time + numpy.concatenate(([0.0], numpy.cumsum(target.distances))) / target.speed
+
+
+def _straighten(target: Target, candidates: set, tolerance: float = STITCH_TOLERANCE) -> Target:
+    """
+    Drop candidate path points that are within tolerance (meters) from the straight path between their neighbors.
+    The target keeps its start & end time.
+
+    :param target: target
+    :param candidates: ids of the path points that might be dropped
+    :param tolerance: maximum distance (meters) between a dropped point & the straight path
+    """
+    path = [target.path[0]]
+    for point, next_point in zip(target.path[1:-1], target.path[2:]):
+        if id(point) in candidates:
+            prev_point = path[-1]
+            x, y = to_local_xy([prev_point.latitude, next_point.latitude], [prev_point.longitude, next_point.longitude],
+                               origin=(point.latitude, point.longitude))
+            alpha = min(max(closest_point((x[0], y[0]), (x[1], y[1]), (0.0, 0.0)), 0.0), 1.0)
+            if math.hypot(x[0] + alpha * (x[1] - x[0]), y[0] + alpha * (y[1] - y[0])) < tolerance:
+                continue
+        path.append(point)
+    path.append(target.path[-1])
+
+    if len(path) == len(target.path) or target.end_time <= target.start_time:
+        return target
+    total_distance = sum(distance(p1, p2).meters for p1, p2 in zip(path[:-1], path[1:]))
+    return Target(start_time=target.start_time, path=path, speed=total_distance / (target.end_time - target.start_time))
+
+
+def analyze_window(sightings: Sequence[Sighting], targets: Sequence[Target], window_start: float,
+                   with_assignment=False, with_converged=False, max_gap: float = DEFAULT_LINK_GAP, **kwargs):
+    """
+    Analyze sightings of a trailing time window, keeping the targets of a previous analysis frozen before the window.
+
+    Targets that ended before the window are kept as is. The legs of the targets crossing the window start are
+    re-fitted together with the window: the analysis starts at the start of the earliest crossing leg (but at most
+    max_gap before the window), targets are cut there & the later sightings are analyzed from scratch
+    (see analyze_sightings()). The new targets are then stitched to the cut ones by time & position continuity
+    (see link_segments()), so tracks crossing the window start are not fragmented, and the straight junctions
+    are smoothed out, so long tracks do not gain vertices with every window. The cost depends on the number of
+    sightings in the window, not on the length of the history.
+
+    :param sightings: sightings to analyze (sightings more than max_gap before window_start are ignored)
+    :param targets: targets of the previous analysis
+    :param window_start: start time (timestamp) of the analysis window
+    :param with_assignment: if True, return target indices per sighting (-1 for sightings before the analyzed part)
+    :param with_converged: if True, append a converged flag to the result
+    :param max_gap: maximum time (seconds) between a frozen target & a new one stitched to it
+    :param kwargs: analyze_sightings() arguments (e.g. random_state for reproducible results)
+    :return: frozen & new targets (or a tuple (targets, [assignment], [converged]), see analyze_sightings())
+    """
+    # a leg crossing the window start is not cut in the middle (the new fit would not match its direction):
+    analysis_start = window_start
+    for target in targets:
+        if target.start_time < window_start < target.end_time:
+            times = _vertex_times(target)
+            analysis_start = min(analysis_start, max(times[times <= window_start][-1], window_start - max_gap))
+
+    frozen = []    # targets far before the window: kept as is
+    boundary = []  # targets that new targets might continue
+    for target in targets:
+        if target.end_time < analysis_start - max_gap:
+            frozen.append(target)
+        elif target.start_time < analysis_start:
+            boundary.append(clip_target(target, target.start_time, analysis_start))
+
+    in_window = [i for i, s in enumerate(sightings) if s.timestamp >= analysis_start]
+    window = [sightings[i] for i in in_window]
+    new_targets, window_assignment, converged = analyze_sightings(window, with_assignment=True, with_converged=True, **kwargs)
+
+    # stitch new targets to the boundary ones (only sightings in the window are checked, frozen parts are kept):
+    offset = len(boundary)
+    window_assignment = [a + offset if a >= 0 else -1 for a in window_assignment]
+    linked, mapping = link_segments(boundary + list(new_targets), window, window_assignment, max_distance=MAX_DISTANCE, max_gap=max_gap)
+
+    # path points of the segments are kept, points added at the junctions are dropped where the track is straight:
+    kept = {id(p) for target in boundary for p in target.path[:-1]} | {id(p) for target in new_targets for p in target.path[1:]}
+    for idx in set(mapping[:offset].tolist()) & set(mapping[offset:].tolist()):
+        candidates = {id(p) for p in linked[idx].path} - kept
+        straight = _straighten(linked[idx], candidates)
+        members = [s for s, a in zip(window, window_assignment) if a >= 0 and mapping[a] == idx]
+        if straight is not linked[idx] and all(d < MAX_DISTANCE for _, d in sightings_to_targets(members, [straight], with_distance=True)):
+            linked[idx] = straight
+
+    assignment = [-1] * len(sightings)
+    for i, a in zip(in_window, window_assignment):
+        if a >= 0:
+            assignment[i] = len(frozen) + int(mapping[a])
+
+    return _analysis_result(frozen + linked, assignment, converged, with_assignment, with_converged)
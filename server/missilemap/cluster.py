@@ -0,0 +1,285 @@
+"""
+Multi-worker support.
+
+When the server runs with several worker processes, only one of them (the analysis leader) runs the analysis.
+The leader is elected through a lease and publishes every analysis result (TargetSet) to a shared location.
+The rest of the workers (followers) only serve the published results.
+"""
+from abc import ABC, abstractmethod
+import datetime
+import json
+import os
+import tempfile
+from typing import Optional
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from .definitions import TargetSet
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_LEASE_TTL = 30.0           # time (seconds) after which a lease that was not renewed expires
+LEASE_COLLECTION = 'leases'        # MongoDB collection for leases
+TARGETS_COLLECTION = 'target_sets'  # MongoDB collection for published target sets
+ANALYSIS_LEASE = 'analysis'        # name of the analysis leader lease
+TARGETS_FILE = 'targets.json'      # file name for published target sets
+
+
+class ILease(ABC):
+    """
+    Leadership lease interface (asynchronous).
+    At most one holder of the lease exists at any given time.
+    """
+    @property
+    @abstractmethod
+    def is_held(self) -> bool:
+        """
+        True if the lease is currently held by this object
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def acquire(self) -> bool:
+        """
+        Try to acquire (or renew an already held) lease without blocking.
+
+        :return: True if the lease is held after the call
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def release(self):
+        """
+        Release the lease if held
+        """
+        raise NotImplementedError()
+
+
+class ITargetStore(ABC):
+    """
+    Shared store for published target sets (asynchronous)
+    """
+    @abstractmethod
+    async def publish(self, target_set: TargetSet):
+        """
+        Publish a new target set, replacing previously published one
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def latest(self, since: int = -1) -> Optional[TargetSet]:
+        """
+        Get the latest published target set.
+
+        :param since: only return the target set if its version is greater than the specified one
+        :return: TargetSet object or None if nothing newer was published
+        """
+        raise NotImplementedError()
+
+
+class FileLease(ILease):
+    """
+    Lease based on an exclusive lock on a local file.
+    The lock is released by the OS when the holding process exits, so a crashed leader is replaced immediately.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: lock file path (created if missing)
+        """
+        self._path = path
+        self._fd = None
+
+    @property
+    def is_held(self) -> bool:
+        return self._fd is not None
+
+    async def acquire(self) -> bool:
+        """
+        Try to lock the file (non-blocking)
+        """
+        if self._fd is not None:
+            return True
+
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self._fd = fd
+        return True
+
+    async def release(self):
+        """
+        Unlock the file
+        """
+        if self._fd is None:
+            return
+
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        os.close(self._fd)
+        self._fd = None
+
+
+class MongoDBLease(ILease):
+    """
+    Lease stored as a document in MongoDB. Must be renewed (acquire() called) more often than ttl.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, name: str = ANALYSIS_LEASE, ttl: float = DEFAULT_LEASE_TTL):
+        """
+        :param db: motor database object
+        :param name: lease name
+        :param ttl: lease expiration time (seconds)
+        """
+        self._collection = db[LEASE_COLLECTION]
+        self._name = name
+        self._ttl = ttl
+        self._owner = uuid.uuid4().hex
+        self._expires = None
+
+    @property
+    def is_held(self) -> bool:
+        return self._expires is not None and self._expires > datetime.datetime.utcnow()
+
+    async def acquire(self) -> bool:
+        """
+        Take over the lease if it is free or expired, or extend it if it is already held
+        """
+        now = datetime.datetime.utcnow()
+        expires = now + datetime.timedelta(seconds=self._ttl)
+        try:
+            await self._collection.find_one_and_update(
+                {'_id': self._name, '$or': [{'owner': self._owner}, {'expires': {'$lt': now}}]},
+                {'$set': {'owner': self._owner, 'expires': expires}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # the lease document exists and is held by someone else
+            self._expires = None
+            return False
+
+        self._expires = expires
+        return True
+
+    async def release(self):
+        """
+        Remove the lease document if owned by this object
+        """
+        if self._expires is None:
+            return
+
+        self._expires = None
+        await self._collection.delete_one({'_id': self._name, 'owner': self._owner})
+
+
+class FileTargetStore(ITargetStore):
+    """
+    Stores published target set as a JSON file in a shared directory.
+    The file is replaced atomically, so readers never see a partially written set.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: directory path (created if missing)
+        """
+        os.makedirs(path, exist_ok=True)
+        self._dir = path
+        self._path = os.path.join(path, TARGETS_FILE)
+        self._mtime = None  # modification time of the last file read (skip re-reading unchanged file)
+
+    async def publish(self, target_set: TargetSet):
+        """
+        Write target set into a temporary file & move it in place
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir, prefix='targets', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as stream:
+                json.dump(target_set.to_json(), stream)
+            os.replace(tmp_path, self._path)
+        except:  # noqa
+            os.remove(tmp_path)
+            raise
+
+    async def latest(self, since: int = -1) -> Optional[TargetSet]:
+        """
+        Read published target set if the file was modified since the last read
+        """
+        try:
+            mtime = os.stat(self._path).st_mtime_ns
+            if mtime == self._mtime and since >= 0:
+                return None
+
+            with open(self._path, 'rb') as stream:
+                target_set = TargetSet.json_decoder(json.load(stream))
+        except FileNotFoundError:
+            return None
+
+        self._mtime = mtime
+        return target_set if target_set.version > since else None
+
+
+class MongoDBTargetStore(ITargetStore):
+    """
+    Stores published target set as a single MongoDB document
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, name: str = ANALYSIS_LEASE):
+        """
+        :param db: motor database object
+        :param name: document name
+        """
+        self._collection = db[TARGETS_COLLECTION]
+        self._name = name
+
+    async def publish(self, target_set: TargetSet):
+        """
+        Replace the target set document
+        """
+        await self._collection.replace_one({'_id': self._name}, target_set.to_json(), upsert=True)
+
+    async def latest(self, since: int = -1) -> Optional[TargetSet]:
+        """
+        Fetch the target set document if it has a newer version
+        """
+        doc = await self._collection.find_one({'_id': self._name, 'version': {'$gt': since}})
+        return TargetSet.json_decoder(doc) if doc is not None else None
+
+
+def get_cluster(cluster_type: str = None, path=None, url='mongodb://localhost:21017', database='missilemap'):
+    """
+    Get lease & target store objects for multi-worker operation.
+
+    :param cluster_type: One of: None (single worker), "file", "mongodb"
+    :param path: shared directory path (for "file" type)
+    :param url: MongoDB URL (for "mongodb" type)
+    :param database: database name to use (for "mongodb" type)
+
+    :return: (ILease, ITargetStore) tuple. (None, None) for single worker.
+    """
+    if cluster_type is None:
+        return None, None
+    elif cluster_type == 'file':
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), 'missilemap')
+        store = FileTargetStore(path)
+        return FileLease(os.path.join(path, ANALYSIS_LEASE + '.lock')), store
+    elif cluster_type == 'mongodb':
+        db = AsyncIOMotorClient(url)[database]
+        return MongoDBLease(db), MongoDBTargetStore(db)
+    else:
+        raise ValueError(f'Unknown cluster type: {cluster_type}')
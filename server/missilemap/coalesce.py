@@ -0,0 +1,157 @@
+"""
+Coalescing of near-duplicate sightings.
+
+In dense areas many people report the same target from nearly the same location within seconds.
+Such sightings are hashed into space-time cells (split by bearing sector) and merged into a single
+representative sighting with weight equal to the number of merged sightings.
+
+Very large sets are further reduced by stratified sampling (see stratified_sample()): a weighted sample
+with sightings of every space-time cell, so sparse tracks are kept while dense areas are thinned out.
+"""
+import math
+from typing import List, Sequence, Tuple
+
+import numpy
+
+from .definitions import Sighting
+from .table import SightingRecord
+from .utils import METERS_PER_DEGREE
+
+DEFAULT_CELL_SIZE = 500.0  # default cell size (meters)
+DEFAULT_CELL_TIME = 10.0   # default cell duration (seconds)
+BEARING_SECTORS = 8        # number of bearing sectors: only sightings with similar bearing are merged
+SAMPLE_CELL_SIZE = 5000.0  # default cell size (meters) for stratified sampling
+SAMPLE_CELL_TIME = 60.0    # default cell duration (seconds) for stratified sampling
+
+
+def space_time_cells(timestamps, latitudes, longitudes, cell_size: float = DEFAULT_CELL_SIZE, cell_time: float = DEFAULT_CELL_TIME) -> numpy.ndarray:
+    """
+    Compute integer space-time cell coordinates
+
+    :param timestamps: array of timestamps (seconds)
+    :param latitudes: array of latitudes (degrees)
+    :param longitudes: array of longitudes (degrees)
+    :param cell_size: cell size (meters)
+    :param cell_time: cell duration (seconds)
+    :return: int64 array of shape (N, 3): (time, latitude, longitude) cell indices
+    """
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    lat_cell = numpy.floor(latitudes * METERS_PER_DEGREE / cell_size)
+
+    # longitude cells are scaled by the latitude of the cell row (so cells are approximately square):
+    scale = numpy.cos(numpy.radians((lat_cell + 0.5) * cell_size / METERS_PER_DEGREE))
+    lon_cell = numpy.floor(numpy.asarray(longitudes, dtype=float) * scale * METERS_PER_DEGREE / cell_size)
+
+    time_cell = numpy.floor(numpy.asarray(timestamps, dtype=float) / cell_time)
+
+    return numpy.column_stack((time_cell, lat_cell, lon_cell)).astype(numpy.int64)
+
+
+def _sighting_cells(sightings: Sequence[Sighting], cell_size: float, cell_time: float) -> numpy.ndarray:
+    """
+    Space-time cell & bearing sector per sighting (int64 array of shape (N, 4))
+    """
+    timestamps = numpy.array([s.timestamp for s in sightings], dtype=float)
+    latitudes = numpy.array([s.latitude for s in sightings], dtype=float)
+    longitudes = numpy.array([s.longitude for s in sightings], dtype=float)
+    bearings = numpy.array([s.bearing for s in sightings], dtype=float)
+
+    sectors = numpy.floor((bearings + math.pi) / (2 * math.pi) * BEARING_SECTORS).astype(numpy.int64) % BEARING_SECTORS
+    return numpy.column_stack((space_time_cells(timestamps, latitudes, longitudes, cell_size, cell_time), sectors))
+
+
+def coalesce_sightings(sightings: Sequence[Sighting],
+                       cell_size: float = DEFAULT_CELL_SIZE,
+                       cell_time: float = DEFAULT_CELL_TIME) -> Tuple[List[Sighting], numpy.ndarray, numpy.ndarray]:
+    """
+    Merge near-duplicate sightings into weighted representatives.
+
+    :param sightings: list of sightings
+    :param cell_size: cell size (meters)
+    :param cell_time: cell duration (seconds)
+    :return: tuple (representatives, weights, groups) where:
+        representatives - list of representative sightings (mean timestamp & location, circular mean bearing).
+                          Merged representatives are SightingRecord tuples.
+                          The id of a representative is the id of the first sighting in the group.
+        weights - number of sightings merged into every representative
+        groups - representative index per input sighting
+    """
+    if not len(sightings):
+        return [], numpy.zeros(0), numpy.zeros(0, dtype=numpy.int64)
+
+    timestamps = numpy.array([s.timestamp for s in sightings], dtype=float)
+    latitudes = numpy.array([s.latitude for s in sightings], dtype=float)
+    longitudes = numpy.array([s.longitude for s in sightings], dtype=float)
+    bearings = numpy.array([s.bearing for s in sightings], dtype=float)
+    keys = _sighting_cells(sightings, cell_size, cell_time)
+
+    _, first, groups, weights = numpy.unique(keys, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    groups = groups.ravel()
+
+    # keep representatives in the order of their first sighting:
+    order = numpy.argsort(first, kind='stable')
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    groups = rank[groups]
+    weights = weights[order].astype(float)
+    first = first[order]
+
+    def _mean(values):
+        return numpy.bincount(groups, weights=values) / weights
+
+    mean_timestamp = _mean(timestamps)
+    mean_latitude = _mean(latitudes)
+    mean_longitude = _mean(longitudes)
+    mean_bearing = numpy.arctan2(_mean(numpy.sin(bearings)), _mean(numpy.cos(bearings)))
+
+    representatives = [
+        sightings[i] if w == 1 else SightingRecord(id=sightings[i].id, timestamp=round(t), latitude=lat, longitude=lon, bearing=b)
+        for i, w, t, lat, lon, b in zip(
+            first.tolist(), weights.tolist(), mean_timestamp.tolist(), mean_latitude.tolist(), mean_longitude.tolist(), mean_bearing.tolist()
+        )
+    ]
+
+    return representatives, weights, groups
+
+
+def stratified_sample(sightings: Sequence[Sighting], size: int, weights: Sequence[float] = None,
+                      cell_size: float = SAMPLE_CELL_SIZE, cell_time: float = SAMPLE_CELL_TIME,
+                      random_state=None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Draw a weighted sample (coreset) of sightings stratified by space-time cells & bearing sectors.
+
+    Every cell gets a share of the sample proportional to its number of sightings (randomly rounded, so cells
+    with a share below one sighting are sampled with that probability). A sampled sighting stands for the sightings
+    of its cell: the weights of sampled cells are scaled up to the cell weight divided by the sampling probability
+    of the cell, so weighted sums over the sample estimate the sums over all sightings.
+
+    :param sightings: list of sightings
+    :param size: expected sample size
+    :param weights: (optional) weight per sighting (e.g. from coalesce_sightings())
+    :param cell_size: cell size (meters)
+    :param cell_time: cell duration (seconds)
+    :param random_state: (optional) seed or numpy random Generator for reproducible results
+    :return: tuple (indices, weights): sorted indices of the sampled sightings & weight per sampled sighting
+    """
+    n = len(sightings)
+    weights = numpy.asarray(weights, dtype=float) if weights is not None else numpy.ones(n)
+    if n <= size:
+        return numpy.arange(n), weights
+
+    _, cells, counts = numpy.unique(_sighting_cells(sightings, cell_size, cell_time), axis=0, return_inverse=True, return_counts=True)
+    cells = cells.ravel()
+    rng = numpy.random.default_rng(random_state)
+    shares = counts * size / n
+    quotas = numpy.floor(shares).astype(numpy.int64)
+    quotas += rng.random(len(counts)) < shares - quotas
+
+    # random order within every cell, the first `quota` sightings of a cell are sampled:
+    order = numpy.lexsort((rng.random(n), cells))
+    starts = numpy.cumsum(counts) - counts
+    rank = numpy.empty(n, dtype=numpy.int64)
+    rank[order] = numpy.arange(n) - starts[cells[order]]
+    indices = numpy.flatnonzero(rank < quotas[cells])
+
+    cell_weights = numpy.bincount(cells, weights=weights) / numpy.minimum(shares, 1.0)
+    sampled_weights = numpy.bincount(cells[indices], weights=weights[indices], minlength=len(counts))
+    return indices, weights[indices] * cell_weights[cells[indices]] / sampled_weights[cells[indices]]
@@ -0,0 +1,198 @@
+"""
+Columnar files of sightings & targets for offline analysis.
+
+Captures & scenarios are saved as columns (the same columns as SightingTable) instead of model objects:
+
+* .npz - uncompressed NumPy archive. Columns are memory-mapped on read (no copy, no parsing).
+* .parquet - Parquet through pandas (requires pyarrow), memory-mapped on read. Ids are stored as hex strings
+  & target paths one row per path point, so the files are readable by other tools.
+
+Sightings files have columns id (12 id bytes), timestamp, latitude, longitude & bearing.
+Targets files have columns start_time, speed & path_length per target and latitude & longitude per path point.
+"""
+import os
+import zipfile
+from typing import Dict, List, Sequence, Union
+
+from geopy import Point
+import numpy
+import pandas
+
+from .definitions import Sighting, Target
+from .storage import ISightingStorage
+from .table import COLUMNS, ID_SIZE, SightingRecord, SightingTable
+
+NPZ_SUFFIX = '.npz'          # NumPy archive files
+PARQUET_SUFFIX = '.parquet'  # Parquet files
+
+Path = Union[str, os.PathLike]
+
+
+def _format(path: Path) -> str:
+    """
+    File format by the file name suffix
+    """
+    suffix = os.path.splitext(os.fspath(path))[1].lower()
+    if suffix not in (NPZ_SUFFIX, PARQUET_SUFFIX):
+        raise ValueError(f'Unsupported dataset file: {path} (expected {NPZ_SUFFIX} or {PARQUET_SUFFIX})')
+    return suffix
+
+
+def write_sightings(path: Path, sightings: Union[SightingTable, Sequence[Sighting]]):
+    """
+    Save sightings to a columnar file
+
+    :param path: file name (.npz or .parquet)
+    :param sightings: sighting table or list of sightings (Sighting objects or SightingRecord tuples)
+    """
+    if isinstance(sightings, SightingTable):
+        columns = sightings.columns()
+    else:
+        columns = {
+            'id': numpy.frombuffer(b''.join(s.id.binary for s in sightings), dtype=numpy.uint8).reshape(-1, ID_SIZE),
+            **{name: numpy.fromiter((getattr(s, name) for s in sightings), dtype=dtype, count=len(sightings)) for name, dtype in COLUMNS}
+        }
+
+    if _format(path) == NPZ_SUFFIX:
+        numpy.savez(path, **columns)
+    else:
+        ids = numpy.frombuffer(columns['id'].tobytes().hex().encode(), dtype=f'S{2 * ID_SIZE}').astype(str)
+        pandas.DataFrame({'id': ids, **{name: columns[name] for name, _ in COLUMNS}}).to_parquet(path, index=False)
+
+
+def read_sightings(path: Path) -> Dict[str, numpy.ndarray]:
+    """
+    Read sighting columns from a file (memory-mapped)
+
+    :param path: file name (.npz or .parquet)
+    :return: {'id': uint8 array (N, 12), 'timestamp': ..., 'latitude': ..., 'longitude': ..., 'bearing': ...} (see SightingTable.columns())
+    """
+    if _format(path) == NPZ_SUFFIX:
+        return _read_npz(path)
+
+    frame = pandas.read_parquet(path, memory_map=True)
+    ids = numpy.frombuffer(bytes.fromhex(''.join(frame['id'].tolist())), dtype=numpy.uint8).reshape(-1, ID_SIZE)
+    return {'id': ids, **{name: frame[name].to_numpy(dtype=dtype) for name, dtype in COLUMNS}}
+
+
+def load_table(path: Path) -> SightingTable:
+    """
+    Load sightings from a file into a sighting table
+    """
+    return SightingTable.from_columns(read_sightings(path))
+
+
+def load_sightings(path: Path) -> List[SightingRecord]:
+    """
+    Load sightings from a file as records for the analysis functions
+    """
+    return load_table(path).to_records()
+
+
+async def import_sightings(storage: ISightingStorage, path: Path) -> int:
+    """
+    Add sightings from a file to a storage (sightings already stored are skipped)
+
+    :return: number of sightings in the file
+    """
+    sightings = load_table(path).to_sightings()
+    for sighting in sightings:
+        await storage.add_sighting(sighting)
+    return len(sightings)
+
+
+async def export_sightings(storage: ISightingStorage, path: Path) -> int:
+    """
+    Save all sightings of a storage to a file
+
+    :return: number of saved sightings
+    """
+    await storage.sync()
+    records = await storage.list_records()
+    write_sightings(path, records)
+    return len(records)
+
+
+def write_targets(path: Path, targets: Sequence[Target]):
+    """
+    Save targets to a columnar file
+
+    :param path: file name (.npz or .parquet)
+    :param targets: list of targets
+    """
+    path_lengths = numpy.array([len(t.path) for t in targets], dtype=numpy.int64)
+    points = numpy.array([(p.latitude, p.longitude) for t in targets for p in t.path], dtype=float).reshape(-1, 2)
+    start_times = numpy.array([t.start_time for t in targets], dtype=float)
+    speeds = numpy.array([t.speed for t in targets], dtype=float)
+
+    if _format(path) == NPZ_SUFFIX:
+        numpy.savez(path, start_time=start_times, speed=speeds, path_length=path_lengths, latitude=points[:, 0], longitude=points[:, 1])
+    else:
+        # one row per path point:
+        pandas.DataFrame({
+            'target': numpy.repeat(numpy.arange(len(targets)), path_lengths),
+            'start_time': numpy.repeat(start_times, path_lengths),
+            'speed': numpy.repeat(speeds, path_lengths),
+            'latitude': points[:, 0],
+            'longitude': points[:, 1]
+        }).to_parquet(path, index=False)
+
+
+def read_targets(path: Path) -> List[Target]:
+    """
+    Load targets from a columnar file
+
+    :param path: file name (.npz or .parquet)
+    :return: list of targets
+    """
+    if _format(path) == NPZ_SUFFIX:
+        columns = _read_npz(path)
+        start_times, speeds, path_lengths = columns['start_time'], columns['speed'], columns['path_length']
+        latitudes, longitudes = columns['latitude'], columns['longitude']
+    else:
+        frame = pandas.read_parquet(path, memory_map=True)
+        target_idx = frame['target'].to_numpy(dtype=numpy.int64)
+        firsts = numpy.flatnonzero(numpy.diff(target_idx, prepend=-1))
+        start_times = frame['start_time'].to_numpy(dtype=float)[firsts]
+        speeds = frame['speed'].to_numpy(dtype=float)[firsts]
+        path_lengths = numpy.diff(numpy.append(firsts, len(target_idx)))
+        latitudes, longitudes = frame['latitude'].to_numpy(dtype=float), frame['longitude'].to_numpy(dtype=float)
+
+    points = [Point(latitude=lat, longitude=lon) for lat, lon in zip(latitudes.tolist(), longitudes.tolist())]
+    ends = numpy.cumsum(path_lengths).tolist()
+    return [
+        Target(start_time=start_time, speed=speed, path=points[end - length:end])
+        for start_time, speed, length, end in zip(start_times.tolist(), speeds.tolist(), path_lengths.tolist(), ends)
+    ]
+
+
+def _read_npz(path: Path) -> Dict[str, numpy.ndarray]:
+    """
+    Memory-map arrays of an uncompressed .npz archive (numpy.load() does not memory-map archive members)
+    """
+    result = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as stream:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'Compressed archive member can not be memory-mapped: {info.filename}')
+
+            # skip the local file header (30 bytes + file name + extra field) & the .npy header:
+            stream.seek(info.header_offset + 26)
+            name_length, extra_length = numpy.frombuffer(stream.read(4), dtype='<u2').tolist()
+            stream.seek(info.header_offset + 30 + name_length + extra_length)
+            version = numpy.lib.format.read_magic(stream)
+            if version == (1, 0):
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(stream)
+            else:
+                shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(stream)
+
+            name = info.filename[:-len('.npy')] if info.filename.endswith('.npy') else info.filename
+            if dtype.hasobject:
+                raise ValueError(f'Object arrays are not supported: {name}')
+            if not numpy.prod(shape, dtype=numpy.int64):
+                result[name] = numpy.zeros(shape, dtype=dtype)
+            else:
+                result[name] = numpy.memmap(stream, dtype=dtype, mode='r', offset=stream.tell(), shape=shape,
+                                            order='F' if fortran_order else 'C')
+
+    return result
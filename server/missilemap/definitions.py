@@ -15,6 +15,9 @@ Timestamp = int
 # default target speed: 800km/h
 DEFAULT_SPEED = 800000/3600
 
+# physically plausible target speed range (min, max): 700-1000km/h
+TARGET_SPEED_RANGE = (700000/3600, 1000000/3600)
+
 
 @dataclasses.dataclass(init=False)
 class Target:
@@ -77,7 +80,8 @@ class Target:
 
         if timestamp <= self.start_time:
             if extrapolate:
-                return interpolate(self.path[0], self.path[1], (timestamp - self.start_time) / (self.end_time - self.start_time))
+                # continue the first leg backwards with the target speed:
+                return interpolate(self.path[0], self.path[1], self.speed * (timestamp - self.start_time) / self.distances[0])
                 # meters = self.speed * (self.start_time - timestamp)
                 # return distance(meters=meters).destination(self.path[1], bearing=get_bearing(self.path[0], self.path[1]))
             else:
@@ -85,7 +89,8 @@ class Target:
 
         if timestamp >= self.end_time:
             if extrapolate:
-                return interpolate(self.path[-2], self.path[-1], (timestamp - self.start_time) / (self.end_time - self.start_time))
+                # continue the last leg with the target speed:
+                return interpolate(self.path[-2], self.path[-1], 1.0 + self.speed * (timestamp - self.end_time) / self.distances[-1])
                 # meters = self.speed * (timestamp - self.end_time)
                 # return distance(meters=meters).destination(self.path[-1], bearing=get_bearing(self.path[-2], self.path[-1]))
             else:
@@ -127,7 +132,7 @@ class Target:
         Converts JSON to Target
         """
         return Target(
-            start_time=Timestamp(json_obj['start_time']),
+            start_time=json_obj['start_time'],
             speed=float(json_obj['speed']),
             path=[Point(latitude=p['latitude'], longitude=p['longitude']) for p in json_obj['path']]
         )
@@ -139,6 +144,45 @@ class Target:
         return Target.json_encoder(self)
 
 
+@dataclasses.dataclass
+class TargetSet:
+    """
+    Versioned set of targets produced by a single analysis run.
+    Versions are increasing, so consumers can cheaply detect a newer set.
+    """
+    version: int = 0                                    # analysis generation (0 - nothing analyzed yet)
+    timestamp: float = 0.0                              # time (seconds since epoch) when the set was produced
+    targets: Sequence[Target] = dataclasses.field(default_factory=tuple)
+
+    @staticmethod
+    def json_encoder(target_set) -> dict:
+        """
+        Converts TargetSet to json
+        """
+        return {
+            'version': target_set.version,
+            'timestamp': target_set.timestamp,
+            'targets': [Target.json_encoder(t) for t in target_set.targets]
+        }
+
+    @staticmethod
+    def json_decoder(json_obj: dict):
+        """
+        Converts JSON to TargetSet
+        """
+        return TargetSet(
+            version=int(json_obj['version']),
+            timestamp=float(json_obj['timestamp']),
+            targets=tuple(Target.json_decoder(t) for t in json_obj['targets'])
+        )
+
+    def to_json(self) -> dict:
+        """
+        Convert object to JSON (dict)
+        """
+        return TargetSet.json_encoder(self)
+
+
 class Sighting(BaseModel):
     """
     Defines a single sighting
@@ -0,0 +1,273 @@
+"""
+Indexes over targets for fast candidate lookup.
+
+* IntervalTree - static centered interval tree over target active time ranges.
+* TargetIndex - interval tree + coarse spatial grid of the areas swept by target paths.
+  Returns the few targets that could be close to a given place & time instead of all targets,
+  or the targets flying through a bounding box during a time range.
+"""
+import math
+from collections import defaultdict
+from typing import Optional, Sequence
+
+import numpy
+
+from .definitions import Target
+from .utils import METERS_PER_DEGREE
+
+DEFAULT_INDEX_DISTANCE = 10000   # default search distance (meters) around target paths
+DEFAULT_TIME_PADDING = 300.0     # default time (seconds) targets remain candidates before start & after end time
+DEFAULT_GRID_CELL = 0.5          # default spatial grid cell size (degrees)
+
+
+class _Node:
+    """
+    Interval tree node: intervals containing the center, sorted by start & by end
+    """
+    __slots__ = ('center', 'starts', 'by_start', 'ends', 'by_end', 'left', 'right')
+
+    def __init__(self, center: float, starts: numpy.ndarray, ends: numpy.ndarray, indices: numpy.ndarray):
+        self.center = center
+
+        order = numpy.argsort(starts, kind='stable')
+        self.starts = starts[order]
+        self.by_start = indices[order]
+
+        order = numpy.argsort(ends, kind='stable')
+        self.ends = ends[order]
+        self.by_end = indices[order]
+
+        self.left = None
+        self.right = None
+
+
+class IntervalTree:
+    """
+    Static interval tree (centered).
+    Point & range queries return indices of overlapping intervals in O(log n + k).
+    """
+
+    def __init__(self, starts: Sequence[float], ends: Sequence[float]):
+        """
+        :param starts: interval start per item
+        :param ends: interval end per item (closed intervals: start <= end)
+        """
+        starts = numpy.asarray(starts, dtype=float)
+        ends = numpy.asarray(ends, dtype=float)
+        self._size = len(starts)
+        self._root = self._build(starts, ends, numpy.arange(len(starts)))
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def _build(cls, starts: numpy.ndarray, ends: numpy.ndarray, indices: numpy.ndarray) -> Optional[_Node]:
+        """
+        Build subtree for specified intervals
+        """
+        if not len(indices):
+            return None
+
+        center = float(numpy.median(numpy.concatenate((starts, ends))))
+        left = ends < center
+        right = starts > center
+        here = ~(left | right)
+
+        node = _Node(center, starts[here], ends[here], indices[here])
+        node.left = cls._build(starts[left], ends[left], indices[left])
+        node.right = cls._build(starts[right], ends[right], indices[right])
+        return node
+
+    def query(self, point: float) -> numpy.ndarray:
+        """
+        Find intervals containing a point
+
+        :return: array of item indices
+        """
+        return self.overlap(point, point)
+
+    def overlap(self, start: float, end: float) -> numpy.ndarray:
+        """
+        Find intervals overlapping [start, end]
+
+        :return: array of item indices
+        """
+        result = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+
+            if end < node.center:
+                # only intervals starting before the end overlap:
+                result.append(node.by_start[:node.starts.searchsorted(end, side='right')])
+                stack.append(node.left)
+            elif start > node.center:
+                # only intervals ending after the start overlap:
+                result.append(node.by_end[node.ends.searchsorted(start, side='left'):])
+                stack.append(node.right)
+            else:
+                # all intervals contain the center, which is inside [start, end]:
+                result.append(node.by_start)
+                stack.append(node.left)
+                stack.append(node.right)
+
+        return numpy.concatenate(result) if result else numpy.zeros(0, dtype=numpy.int64)
+
+
+class TargetIndex:
+    """
+    Index of targets by active time & swept area.
+
+    A target is a candidate for a place & time if:
+    * the time is within [start_time - time_padding, end_time + extrapolation + time_padding] (interval tree)
+    * the place is within a grid cell covered by a bounding box of one of the path legs (including the last leg
+      extrapolated for `extrapolation` seconds), extended by distance + speed * time_padding (coarse spatial grid)
+
+    Targets that are not candidates are guaranteed to be further than `distance` from the place at the time,
+    except for positions extrapolated beyond the padded time range.
+    """
+
+    def __init__(self, targets: Sequence[Target],
+                 distance: float = DEFAULT_INDEX_DISTANCE,
+                 time_padding: float = DEFAULT_TIME_PADDING,
+                 cell_size: float = DEFAULT_GRID_CELL,
+                 extrapolation: float = 0.0):
+        """
+        :param targets: list of targets (with 2+ path points)
+        :param distance: search distance (meters) around target paths
+        :param time_padding: time (seconds) targets remain candidates before their start & after their end
+        :param cell_size: grid cell size (degrees)
+        :param extrapolation: time (seconds) targets keep flying along their last leg after their end (see intersecting())
+        """
+        self.targets = targets
+        self.extrapolation = extrapolation
+        self._cell_size = cell_size
+
+        self._tree = IntervalTree(
+            [t.start_time - time_padding for t in targets],
+            [t.end_time + extrapolation + time_padding for t in targets]
+        )
+
+        grid = defaultdict(list)
+        for idx, target in enumerate(targets):
+            padding = distance + target.speed * time_padding
+            path = list(target.path) + ([target.at_time(target.end_time + extrapolation)] if extrapolation > 0 else [])
+            for p1, p2 in zip(path[:-1], path[1:]):
+                lat_range = min(p1.latitude, p2.latitude), max(p1.latitude, p2.latitude)
+                lon_range = min(p1.longitude, p2.longitude), max(p1.longitude, p2.longitude)
+                for cell in self._cells(lat_range, lon_range, padding):
+                    grid[cell].append(idx)
+
+        self._grid = {cell: numpy.unique(indices) for cell, indices in grid.items()}
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def _cells(self, lat_range, lon_range, padding: float = 0.0):
+        """
+        Iterate over grid cells covering a bounding box extended by padding (meters)
+        """
+        lat_padding = padding / METERS_PER_DEGREE
+        cos_lat = max(math.cos(math.radians(max(abs(lat_range[0]), abs(lat_range[1])) + lat_padding)), 1e-6)
+        lon_padding = min(padding / (METERS_PER_DEGREE * cos_lat), 180.0)
+
+        lat_cells = range(
+            math.floor((lat_range[0] - lat_padding) / self._cell_size),
+            math.floor((lat_range[1] + lat_padding) / self._cell_size) + 1
+        )
+        lon_cells = range(
+            math.floor((lon_range[0] - lon_padding) / self._cell_size),
+            math.floor((lon_range[1] + lon_padding) / self._cell_size) + 1
+        )
+        for lat_cell in lat_cells:
+            for lon_cell in lon_cells:
+                yield lat_cell, lon_cell
+
+    def candidates(self, timestamp: float, latitude: float, longitude: float) -> numpy.ndarray:
+        """
+        Find candidate targets for a place & time
+
+        :return: sorted array of target indices
+        """
+        nearby = self._grid.get((math.floor(latitude / self._cell_size), math.floor(longitude / self._cell_size)))
+        if nearby is None:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        return numpy.intersect1d(nearby, self._tree.query(timestamp), assume_unique=True)
+
+    def query(self, start_time: float, end_time: float, lat_range, lon_range) -> numpy.ndarray:
+        """
+        Find candidate targets for a time range & a bounding box
+
+        :param start_time: time range start
+        :param end_time: time range end
+        :param lat_range: (min, max) latitude
+        :param lon_range: (min, max) longitude
+        :return: sorted array of target indices
+        """
+        cells = [self._grid[cell] for cell in self._cells(lat_range, lon_range) if cell in self._grid]
+        if not cells:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        return numpy.intersect1d(numpy.unique(numpy.concatenate(cells)), self._tree.overlap(start_time, end_time), assume_unique=True)
+
+    def intersecting(self, start_time: float, end_time: float, lat_range, lon_range) -> numpy.ndarray:
+        """
+        Find targets whose path flown during a time range intersects a bounding box.
+        After the end of their path targets keep flying along their last leg for `extrapolation` seconds.
+        Candidates are found through the index, then checked exactly.
+
+        :param start_time: time range start
+        :param end_time: time range end
+        :param lat_range: (min, max) latitude
+        :param lon_range: (min, max) longitude
+        :return: sorted array of target indices
+        """
+        candidates = self.query(start_time, end_time, lat_range, lon_range)
+        return numpy.array([
+            idx for idx in candidates.tolist()
+            if _flown_path_intersects(self.targets[idx], start_time, end_time, lat_range, lon_range, self.extrapolation)
+        ], dtype=numpy.int64)
+
+
+def _flown_path_intersects(target: Target, start_time: float, end_time: float, lat_range, lon_range, extrapolation: float = 0.0) -> bool:
+    """
+    Check whether the part of the target path flown during [start_time, end_time] intersects a bounding box
+
+    :param extrapolation: time (seconds) the target keeps flying along its last leg after the end of its path
+    """
+    start_time = max(start_time, target.start_time)
+    end_time = min(end_time, target.end_time + extrapolation)
+    if start_time > end_time or len(target.path) < 2:
+        return False
+
+    # path points reached during the time range:
+    times = target.start_time + numpy.cumsum((0.0,) + target.distances) / target.speed
+    inner = [p for p, t in zip(target.path, times.tolist()) if start_time < t < end_time]
+    points = [target.at_time(start_time)] + inner + [target.at_time(end_time)]
+
+    return any(
+        _segment_intersects(p1.latitude, p1.longitude, p2.latitude, p2.longitude, lat_range, lon_range)
+        for p1, p2 in zip(points[:-1], points[1:])
+    )
+
+
+def _segment_intersects(lat1: float, lon1: float, lat2: float, lon2: float, lat_range, lon_range) -> bool:
+    """
+    Check whether a straight segment (in degrees) intersects a bounding box (Liang-Barsky clipping)
+    """
+    t0, t1 = 0.0, 1.0
+    for start, delta, (low, high) in ((lat1, lat2 - lat1, lat_range), (lon1, lon2 - lon1, lon_range)):
+        if delta == 0:
+            if not low <= start <= high:
+                return False
+            continue
+
+        a, b = (low - start) / delta, (high - start) / delta
+        t0, t1 = max(t0, min(a, b)), min(t1, max(a, b))
+        if t0 > t1:
+            return False
+
+    return True
@@ -0,0 +1,236 @@
+"""
+Linking of individual segments into multi-segment targets.
+
+Expectation maximization explains sightings with straight segments, so a turning target is reported
+as several unrelated segments. Linking joins the end of one segment with the start of another when both
+are consistent in time, position, heading and speed. The result is a polyline Target per chain of segments.
+
+Candidate successors are looked up in a space-time grid of segment start points (see space_time_cells()),
+so linking cost is close to linear in the number of segments.
+"""
+import math
+from collections import defaultdict
+from typing import List, Optional, Sequence, Tuple
+
+from geopy import Point
+from geopy.distance import distance
+import numpy
+
+from .coalesce import space_time_cells
+from .definitions import Sighting, Target
+from .utils import from_local_xy, get_bearing, interpolate, normalize_bearing, normalize_point, to_local_xy
+
+DEFAULT_LINK_DISTANCE = 10000     # maximum distance (meters) between the predicted & the actual start of the next segment
+DEFAULT_LINK_GAP = 900.0          # maximum time (seconds) between the end of a segment and the start of the next one
+DEFAULT_SPEED_TOLERANCE = 0.25    # maximum relative speed difference between linked segments
+DEFAULT_MAX_TURN = math.pi / 2    # maximum heading change (radians) between linked segments
+LINK_CELL_SPEED = 1000000 / 3600  # speed (m/sec) used to size grid cells: a segment end moves at most this far during the gap
+
+
+def _heading(target: Target, last: bool) -> float:
+    """
+    Heading (radians) of the first or the last leg of a target
+    """
+    p1, p2 = (target.path[-2], target.path[-1]) if last else (target.path[0], target.path[1])
+    return get_bearing(p1, p2)
+
+
+def _corner(prev: Target, next: Target) -> Optional[Point]:
+    """
+    Find the turn point between two segments: intersection of the last leg of prev (extended forward)
+    with the first leg of next (extended backward)
+
+    :return: turn point or None if the legs do not intersect ahead of prev & behind next
+    """
+    origin = (prev.end_location.latitude, prev.end_location.longitude)
+    x, y = to_local_xy(
+        [prev.path[-2].latitude, next.start_location.latitude, next.path[1].latitude],
+        [prev.path[-2].longitude, next.start_location.longitude, next.path[1].longitude],
+        origin=origin
+    )
+    d1 = numpy.array([-x[0], -y[0]])              # direction of prev (the end of prev is the origin)
+    d2 = numpy.array([x[2] - x[1], y[2] - y[1]])  # direction of next
+
+    # solve: s * d1 = next.start - u * d2
+    a = numpy.column_stack((d1, d2))
+    if abs(numpy.linalg.det(a)) < 1e-9 * numpy.linalg.norm(d1) * numpy.linalg.norm(d2):
+        return None
+    s, u = numpy.linalg.solve(a, numpy.array([x[1], y[1]]))
+    if s <= 0 or u <= 0:
+        return None
+
+    latitude, longitude = from_local_xy(s * d1[0], s * d1[1], origin=origin)
+    return normalize_point(float(latitude), float(longitude))
+
+
+def _bridge(prev: Target, next: Target) -> List[Point]:
+    """
+    Path from the end of prev to the start of next (through the turn point if there is one)
+    """
+    corner = _corner(prev, next)
+    return [prev.end_location, next.start_location] if corner is None else [prev.end_location, corner, next.start_location]
+
+
+def _link_cost(prev: Target, next: Target, max_distance: float, max_gap: float, speed_tolerance: float, max_turn: float) -> float:
+    """
+    Cost of linking the end of prev with the start of next
+
+    :return: cost (lower is better) or math.inf if segments can not be linked
+    """
+    gap = next.start_time - prev.end_time
+    if not -max_gap <= gap <= max_gap or next.start_time <= prev.start_time:
+        return math.inf
+
+    speed = 0.5 * (prev.speed + next.speed)
+    if abs(prev.speed - next.speed) > speed_tolerance * speed:
+        return math.inf
+
+    heading = _heading(prev, last=True)
+    next_heading = _heading(next, last=False)
+    if abs(normalize_bearing(next_heading - heading)) > max_turn:
+        return math.inf
+
+    if gap <= 0:
+        # overlapping segments: each segment extrapolated to the other's end point must arrive close to it
+        error = max(
+            distance(prev.at_time(next.start_time), next.start_location).meters,
+            distance(next.at_time(prev.end_time), prev.end_location).meters
+        )
+        return error / max_distance if error <= max_distance else math.inf
+
+    # the target flies from the end of prev to the start of next (through the turn point) during the gap with about the same speed:
+    bridge = _bridge(prev, next)
+    length = sum(distance(p1, p2).meters for p1, p2 in zip(bridge[:-1], bridge[1:]))
+    error = abs(length - speed * gap)
+    if error > max_distance + speed_tolerance * speed * gap:
+        return math.inf
+
+    if len(bridge) == 2 and length > max_distance:
+        bridge_heading = get_bearing(prev.end_location, next.start_location)
+        if abs(normalize_bearing(bridge_heading - heading)) > max_turn or abs(normalize_bearing(next_heading - bridge_heading)) > max_turn:
+            return math.inf
+
+    return error / max_distance
+
+
+def _merge(chain: Sequence[Target]) -> Target:
+    """
+    Merge a chain of segments into a single polyline target
+    """
+    if len(chain) == 1:
+        return chain[0]
+
+    path = list(chain[0].path)
+    for prev, next in zip(chain[:-1], chain[1:]):
+        if next.start_time <= prev.end_time:
+            # overlapping segments are joined in the middle between the end of prev & the start of next:
+            path[-1] = interpolate(prev.end_location, next.start_location, 0.5)
+            path.extend(next.path[1:])
+        else:
+            # through the turn point between the end of prev & the start of next:
+            path.extend(_bridge(prev, next)[1:-1])
+            path.extend(next.path)
+
+    start_time = chain[0].start_time
+    total_distance = sum(distance(p1, p2).meters for p1, p2 in zip(path[:-1], path[1:]))
+    return Target(start_time=start_time, path=path, speed=total_distance / (chain[-1].end_time - start_time))
+
+
+def _explains(target: Target, sightings: Sequence[Sighting], max_distance: float) -> bool:
+    """
+    Check whether all sightings are within max_distance from the target
+    """
+    return all(distance(target.at_time(s.timestamp), s.location).meters < max_distance for s in sightings)
+
+
+def link_segments(targets: Sequence[Target],
+                  sightings: Sequence[Sighting] = None,
+                  assignment: Sequence[int] = None,
+                  max_distance: float = DEFAULT_LINK_DISTANCE,
+                  max_gap: float = DEFAULT_LINK_GAP,
+                  speed_tolerance: float = DEFAULT_SPEED_TOLERANCE,
+                  max_turn: float = DEFAULT_MAX_TURN) -> Tuple[List[Target], numpy.ndarray]:
+    """
+    Join segments into multi-segment targets.
+
+    Candidate links are scored by the distance between extrapolated & actual end points and accepted greedily
+    (cheapest first), so every segment has at most one predecessor & one successor.
+    If sightings & assignment are specified, a chain is only merged if the merged target still explains
+    all sightings assigned to its segments (otherwise its segments are kept as is).
+
+    :param targets: list of segments (targets with 2+ path points)
+    :param sightings: (optional) list of sightings
+    :param assignment: (optional) segment index per sighting
+    :param max_distance: maximum distance (meters) between the predicted & the actual end points
+    :param max_gap: maximum time gap (or overlap) between linked segments (seconds)
+    :param speed_tolerance: maximum relative speed difference
+    :param max_turn: maximum heading change (radians)
+    :return: tuple (linked targets, index of the linked target per input segment)
+    """
+    n = len(targets)
+    mapping = numpy.arange(n)
+    if n < 2:
+        return list(targets), mapping
+
+    # grid of segment start points:
+    cell_size = max_distance + LINK_CELL_SPEED * max_gap
+    starts = space_time_cells(
+        [t.start_time for t in targets], [t.start_location.latitude for t in targets], [t.start_location.longitude for t in targets],
+        cell_size=cell_size, cell_time=max_gap
+    )
+    grid = defaultdict(list)
+    for idx, cell in enumerate(map(tuple, starts.tolist())):
+        grid[cell].append(idx)
+
+    ends = space_time_cells(
+        [t.end_time for t in targets], [t.end_location.latitude for t in targets], [t.end_location.longitude for t in targets],
+        cell_size=cell_size, cell_time=max_gap
+    )
+
+    # candidate links from the neighboring cells of every segment end:
+    offsets = [(dt, dy, dx) for dt in (-1, 0, 1) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+    links = []
+    for prev, (ct, cy, cx) in enumerate(ends.tolist()):
+        for dt, dy, dx in offsets:
+            for next in grid.get((ct + dt, cy + dy, cx + dx), ()):
+                if next != prev:
+                    cost = _link_cost(targets[prev], targets[next], max_distance, max_gap, speed_tolerance, max_turn)
+                    if cost < math.inf:
+                        links.append((cost, prev, next))
+
+    # greedy matching (next segments always start later, so chains can't form cycles):
+    successor = [-1] * n
+    predecessor = [-1] * n
+    for _, prev, next in sorted(links):
+        if successor[prev] < 0 and predecessor[next] < 0:
+            successor[prev] = next
+            predecessor[next] = prev
+
+    chains = []
+    for idx in range(n):
+        if predecessor[idx] < 0:
+            chain = [idx]
+            while successor[chain[-1]] >= 0:
+                chain.append(successor[chain[-1]])
+            chains.append(chain)
+
+    members = defaultdict(list)
+    if sightings is not None:
+        for s, idx in zip(sightings, assignment):
+            if idx >= 0:
+                members[idx].append(s)
+
+    linked = []
+    for chain in chains:
+        target = _merge([targets[idx] for idx in chain])
+        if len(chain) > 1 and sightings is not None and not _explains(target, [s for idx in chain for s in members[idx]], max_distance):
+            # keep individual segments:
+            for idx in chain:
+                mapping[idx] = len(linked)
+                linked.append(targets[idx])
+            continue
+
+        mapping[chain] = len(linked)
+        linked.append(target)
+
+    return linked, mapping
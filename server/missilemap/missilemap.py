@@ -2,24 +2,43 @@
 Core logic implementation for missile map application
 """
 import asyncio
-from typing import Sequence, List
+import math
+import time
+from typing import Dict, Optional, Sequence, List, Tuple
 
-from .definitions import Sighting, Target
-from .analysis import analyze_sightings
+from .alerts import Alert, AlertCooldown, IAlertSink, LocalAlertSink, SubscriptionIndex, fan_out
+from .definitions import Sighting, Target, TargetSet, TARGET_SPEED_RANGE
+from .analysis import analyze_sightings, analyze_window, update_analysis
+from .cluster import ILease, ITargetStore
+from .index import TargetIndex
+from .linking import DEFAULT_LINK_GAP
+from .prediction import DEFAULT_PREDICTION_HORIZON, Predictions, predict
+from .ring import SightingRing
+from .scheduler import (
+    DEFAULT_BACKOFF, DEFAULT_DEBOUNCE, DEFAULT_MAX_BACKOFF, DEFAULT_MAX_LATENCY, DebouncedTrigger, FIXED_DELAY, FIXED_RATE, Service, ServiceStats
+)
+from .snapshot import AnalysisState, load_snapshot, save_snapshot
 from .storage import ISightingStorage
+from .table import SightingRecord
+from .user import User
+from .utils import logger
 
-DEFAULT_CLEANUP_INTERVAL = 3.0   # time between cleanup intervals
-DEFAULT_ANALYSIS_INTERVAL = 1.0  # minimum time (seconds) between analysis rounds
+DEFAULT_CLEANUP_INTERVAL = 3.0    # time between cleanup intervals
+DEFAULT_ANALYSIS_INTERVAL = 1.0   # minimum time (seconds) between analysis rounds
+DEFAULT_SNAPSHOT_INTERVAL = 10.0  # time (seconds) between analysis state snapshots
+DEFAULT_HORIZON_SECONDS = 600.0   # default prediction horizon (seconds) for bounding box queries
+DEFAULT_ALERT_INTERVAL = 0.5      # time (seconds) between alert deliveries
+WINDOW_STEP = 0.25                # the analysis window slides in steps (fraction of the window length)
 
 
 class AsyncServer:
     """
-    Base class for asynchronous server implementation with support for services
+    Base class for asynchronous server implementation with support for services (see scheduler.py)
     """
     def __init__(self):
         # async services support
         self._shutting_down = asyncio.Event()  # set when shutdown process is initiated
-        self._services = []  # list of tasks representing current services
+        self._services: Dict[asyncio.Task, Service] = {}  # tasks of running services
 
     async def shutdown(self):
         """
@@ -27,40 +46,45 @@ class AsyncServer:
         """
         self._shutting_down.set()
         while len(self._services):
-            await self._services.pop()
+            await asyncio.wait(list(self._services))
 
-    def run_service(self, func, period=None, name=None):
+    def run_service(self, func, period=None, name=None, mode: str = FIXED_RATE, jitter: float = 0.0, restart: bool = True,
+                    backoff: float = DEFAULT_BACKOFF, max_backoff: float = DEFAULT_MAX_BACKOFF, trigger: DebouncedTrigger = None) -> Service:
         """
         Runs specified co-routine as a service
 
         :param func: async routine
         :param period: (optional) if specified, will execute specified routine with specified period (seconds)
-        :param name: (optional) task name
+        :param name: (optional) service name (default: function name), unique among the running services
+        :param mode: FIXED_RATE (runs start at fixed times, missed ticks are coalesced) or
+            FIXED_DELAY (runs start a period after the previous run finished)
+        :param jitter: random delay of every run, fraction of the period (0..1)
+        :param restart: if True, a failed run is restarted after a backoff
+        :param backoff: initial restart delay (seconds), doubled after every consecutive failure
+        :param max_backoff: maximum restart delay (seconds)
+        :param trigger: (optional) run the routine on events signalled through the trigger instead of periodically
 
-        :return:
+        :return: the service object (see Service.stats)
         """
-        if period is not None:
-            task = asyncio.get_running_loop().create_task(self._run_periodic(func, period), name=name)
-        else:
-            task = asyncio.get_running_loop().create_task(func(), name=name)
+        service = Service(func, self._shutting_down, period=period, name=name, mode=mode, jitter=jitter, restart=restart,
+                          backoff=backoff, max_backoff=max_backoff, trigger=trigger)
+        # stats are reported by service name (see service_stats()):
+        if any(running.name == service.name for running in self._services.values()):
+            raise ValueError(f'Service {service.name} is already running')
 
-        self._services.append(task)
-        # TODO: filter out completed tasks from self._services
+        task = asyncio.get_running_loop().create_task(service.run(), name=service.name)
+        self._services[task] = service
+        # completed services are forgotten:
+        task.add_done_callback(lambda t: self._services.pop(t, None))
+        return service
 
-    async def _run_periodic(self, func, period):
+    def service_stats(self) -> Dict[str, ServiceStats]:
         """
-        Runs specified co-routine with specified period
+        Get stats of running services
 
-        :param func: function to run
-        :param period: period (seconds)
+        :return: {service name: stats}
         """
-        while not self._shutting_down.is_set():
-            try:
-                await asyncio.wait_for(self._shutting_down.wait(), timeout=period)
-            except asyncio.TimeoutError:
-                await func()
-            else:
-                break
+        return {service.name: service.stats for service in self._services.values()}
 
 
 class MissileMap(AsyncServer):
@@ -69,8 +93,11 @@ class MissileMap(AsyncServer):
     Uses dependency injection for main components such as sightings storage.
 
     The implementation is asynchronous: services run in a loop until shutdown is called.
+
+    With multiple workers, each worker creates its own MissileMap object with a shared lease & target store:
+    the lease holder runs the analysis & publishes results, the rest of the workers serve the published results.
     """
-    TARGET_SPEED_RANGE = (700000/3600, 1000000/3600)  # target speed range (min, max)
+    TARGET_SPEED_RANGE = TARGET_SPEED_RANGE  # target speed range (min, max)
 
     @property
     def storage(self) -> ISightingStorage:
@@ -79,24 +106,114 @@ class MissileMap(AsyncServer):
         """
         return self._storage
 
+    @property
+    def is_leader(self) -> bool:
+        """
+        True if this object runs the analysis (single worker or the lease holder)
+        """
+        return not self._serve_only and (self._lease is None or self._lease.is_held)
+
     def __init__(self, storage: ISightingStorage,
                  analysis_interval: float = DEFAULT_ANALYSIS_INTERVAL,
-                 cleanup_interval: float = DEFAULT_CLEANUP_INTERVAL):
+                 cleanup_interval: float = DEFAULT_CLEANUP_INTERVAL,
+                 lease: ILease = None,
+                 target_store: ITargetStore = None,
+                 snapshot_path: str = None,
+                 snapshot_interval: float = DEFAULT_SNAPSHOT_INTERVAL,
+                 coalesce: bool = True,
+                 restarts: int = 1,
+                 n_jobs: int = None,
+                 alert_sink: IAlertSink = None,
+                 alert_interval: float = DEFAULT_ALERT_INTERVAL,
+                 analysis_debounce: float = DEFAULT_DEBOUNCE,
+                 analysis_max_latency: float = DEFAULT_MAX_LATENCY,
+                 ring: SightingRing = None,
+                 analysis_window: float = None,
+                 analysis_sample_size: int = None,
+                 serve_only: bool = False):
         """
         Initializes MissileMap object
 
         :param storage: storage for sightings
+        :param analysis_interval: if > 0, minimum time (seconds) between analysis rounds.
+            Also used as the time budget of a single analysis round (the best solution found in time is published).
+            A single worker runs the analysis when sightings are added (see DebouncedTrigger), with multiple workers
+            (lease) the analysis runs periodically, as other workers add sightings.
         :param cleanup_interval: if > 0, specified time (seconds) between sightings cleanup intervals
+        :param lease: (optional) analysis leader lease shared between workers
+        :param target_store: (optional) store for publishing analysis results to other workers (required with lease)
+        :param snapshot_path: (optional) analysis state snapshot file. If exists, the state is restored on startup.
+        :param snapshot_interval: if > 0, specified time (seconds) between analysis state snapshots
+        :param coalesce: if True, near-duplicate sightings are merged before the analysis
+        :param restarts: number of parallel EM fits per analysis step (see multi_restart_em())
+        :param n_jobs: number of worker processes for the EM fits (-1 - all cores)
+        :param alert_sink: (optional) alert delivery for registered users (default: LocalAlertSink)
+        :param alert_interval: if > 0, specified time (seconds) between alert deliveries
+        :param analysis_debounce: quiet time (seconds) after the last added sighting before the analysis (single worker)
+        :param analysis_max_latency: maximum time (seconds) from an added sighting to the analysis (single worker)
+        :param ring: (optional) shared-memory ring buffer of added sightings (single worker only): the analysis reads
+            sightings from the ring instead of the storage. The ring is loaded from the storage on the first analysis
+            (and whenever it overflows), it stays open on shutdown (owned by the caller).
+        :param analysis_window: (optional) length (seconds) of the trailing analysis window. Only sightings within
+            the window are analyzed, older targets are kept frozen (see analyze_window()). Default: all sightings.
+        :param analysis_sample_size: (optional) targets are fitted on a weighted sample of about this many sightings
+            when there are more (see analyze_sightings()). Smaller samples are faster & less accurate. Default: no sampling.
+        :param serve_only: if True, no analysis runs here: targets published to target_store by another process
+            (e.g. ShardMerger, see missilemap.shards) are picked up every analysis_interval & served
         """
         super().__init__()
+        if lease is not None and target_store is None:
+            raise ValueError('target_store must be specified together with lease')
+        if serve_only and target_store is None:
+            raise ValueError('target_store must be specified with serve_only')
+        if lease is not None and ring is not None:
+            raise ValueError('ring can not be used with lease (sightings added by other workers are not in the ring)')
+
         self._storage = storage
-        self._targets = []
+        self._lease = lease
+        self._serve_only = serve_only
+        self._target_store = target_store
+        self._snapshot_path = snapshot_path
+        self._coalesce = coalesce
+        self._restarts = restarts
+        self._n_jobs = n_jobs
+        self._ring = ring
+        self._ring_loaded = False       # True if the ring holds all stored sightings
+        self._analysis_window = analysis_window
+        self._analysis_sample_size = analysis_sample_size
+        self._analysis_budget = analysis_interval if analysis_interval > 0 else None
+        self._converged = True          # False if the last analysis was cut short by the time budget
+        self._snapshot_version = 0      # version of the last saved snapshot
+        self._analyzed_checksum = None  # storage checksum at the time of the last analysis
+        self._subscriptions = SubscriptionIndex()
+        self._alert_sink = alert_sink if alert_sink is not None else LocalAlertSink()
+        self._alert_queue = asyncio.Queue()  # batches of alerts waiting for delivery
+        self._alert_cooldown = AlertCooldown()
+        self._set_state(AnalysisState())
+
+        if snapshot_path is not None:
+            state = load_snapshot(snapshot_path)
+            if state is not None:
+                self._set_state(state)
+                self._snapshot_version = state.target_set.version
 
-        # create a service that will run periodic analysis
-        if analysis_interval > 0:
-            self.run_service(self._analysis_service, period=analysis_interval)
+        # create a service that will run the analysis when sightings are added (or periodically in a cluster)
+        self._analysis_trigger = None
+        if analysis_interval > 0 and serve_only:
+            self.run_service(self._sync_targets, period=analysis_interval, mode=FIXED_DELAY)
+        elif analysis_interval > 0 and lease is None:
+            self._analysis_trigger = DebouncedTrigger(debounce=analysis_debounce, min_spacing=analysis_interval,
+                                                      max_latency=analysis_max_latency)
+            self._analysis_trigger.notify(events=0)  # analyze sightings stored before the start
+            self.run_service(self._analysis_service, trigger=self._analysis_trigger)
+        elif analysis_interval > 0:
+            self.run_service(self._analysis_service, period=analysis_interval, mode=FIXED_DELAY)
         if cleanup_interval > 0:
             self.run_service(self._cleanup_service, period=cleanup_interval)
+        if snapshot_path is not None and snapshot_interval > 0:
+            self.run_service(self._snapshot_service, period=snapshot_interval)
+        if alert_interval > 0:
+            self.run_service(self._alert_service, period=alert_interval)
 
     async def add_sighting(self, sighting: Sighting) -> Sighting:
         """
@@ -105,7 +222,12 @@ class MissileMap(AsyncServer):
         :param sighting:
         :return: the sighting object
         """
-        return await self._storage.add_sighting(sighting)
+        stored = await self._storage.add_sighting(sighting)
+        if stored is sighting and self._ring is not None:
+            # a new sighting (not a retried one)
+            self._ring.append(sighting)
+        self._trigger_analysis()
+        return stored
 
     async def list_sightings(self) -> Sequence[Sighting]:
         """
@@ -117,30 +239,262 @@ class MissileMap(AsyncServer):
         """
         Clear all sightings
         """
-        return await self._storage.clear_sightings()
+        result = await self._storage.clear_sightings()
+        if self._ring is not None:
+            self._ring.clear()
+        self._trigger_analysis()
+        return result
 
-    async def list_targets(self) -> List[Target]:
+    async def list_targets(self, bbox: Optional[Tuple[float, float, float, float]] = None,
+                           horizon: float = DEFAULT_HORIZON_SECONDS,
+                           timestamp: float = None) -> List[Target]:
         """
         Get current list of identified targets
+
+        :param bbox: (optional) bounding box (min longitude, min latitude, max longitude, max latitude).
+            If specified, only targets flying through the box between timestamp and timestamp + horizon are returned
+            (targets keep flying along their last leg for DEFAULT_PREDICTION_HORIZON seconds after the end of their path).
+        :param horizon: prediction horizon (seconds) for the bounding box query
+        :param timestamp: start of the bounding box query time range (default: now)
+        """
+        if bbox is None:
+            return list(self._state.target_set.targets)
+
+        if timestamp is None:
+            timestamp = time.time()
+        index = self._target_index
+        min_lon, min_lat, max_lon, max_lat = bbox
+        return [index.targets[idx] for idx in index.intersecting(timestamp, timestamp + horizon, (min_lat, max_lat), (min_lon, max_lon)).tolist()]
+
+    async def get_target_set(self) -> TargetSet:
+        """
+        Get current versioned set of identified targets
         """
-        return self._targets
+        return self._state.target_set
 
-    async def register_user(self, User):
+    async def get_predictions(self) -> Predictions:
         """
-        Perform user registration
+        Get predicted positions of the current target set (computed once per analysis generation)
+        """
+        return self._predictions
+
+    async def register_user(self, user: User) -> User:
+        """
+        Perform user registration: the user is alerted about targets approaching the user's location.
+        Registering an already registered user updates the location.
+
+        NOTE: registrations are kept in memory of this worker, every worker alerts its own users.
 
-        :param User:
-        :return:
+        :param user: user with a location
+        :return: the user object
         """
-        raise NotImplementedError()
+        self._subscriptions.add(user.id, user.latitude, user.longitude)
+        return user
+
+    async def unregister_user(self, user_id) -> bool:
+        """
+        Remove user registration
+
+        :return: True if the user was registered
+        """
+        return self._subscriptions.remove(user_id)
+
+    async def shutdown(self):
+        """
+        Shutdown running services and give up analysis leadership
+        """
+        await super().shutdown()
+        if self._snapshot_path is not None:
+            await self._snapshot_service()
+        if self._lease is not None:
+            await self._lease.release()
 
     async def _analysis_service(self):
         """
-        Runs periodic analysis on the set of sightings.
+        Runs analysis on the set of sightings (when sightings were added or periodically in a cluster).
+        Followers only pick up the target set published by the leader.
+
+        Sightings that were already analyzed are tracked, so only new sightings are processed incrementally.
+        Full analysis runs when new sightings can't be explained by known targets or sightings were removed.
+
+        The analysis is bounded by the analysis interval: the best solution found in time is published
+        and the full analysis is repeated in the next round.
 
         FIXME: use separate process to run the computation
         """
-        self._targets = analyze_sightings(await self.list_sightings())
+        if self._lease is not None:
+            was_leader = self._lease.is_held
+            if not await self._lease.acquire():
+                await self._sync_targets()
+                return
+
+            if not was_leader:
+                # continue version numbering from the previous leader
+                await self._sync_targets()
+
+        # skip listing sightings if nothing has changed since the last analysis:
+        if self._ring_loaded:
+            checksum = ('ring', self._ring.generation)
+        else:
+            await self._storage.sync()
+            checksum = self._storage.checksum
+        if checksum == self._analyzed_checksum:
+            return
+
+        sightings = await self._list_records()
+        window_start = None
+        if self._analysis_window is not None and sightings and self._state.target_set.version > 0:
+            # analyze the trailing window only (the first analysis covers all sightings):
+            window_start = self._window_start(sightings)
+            # legs crossing the window start are re-fitted with up to DEFAULT_LINK_GAP of earlier sightings (see analyze_window()):
+            sightings = [s for s in sightings if s.timestamp >= window_start - DEFAULT_LINK_GAP]
+
+        # split sightings into already analyzed (in the original order) & new ones:
+        positions = {sighting_id: i for i, sighting_id in enumerate(self._state.sighting_ids)}
+        analyzed = [None] * len(positions)
+        added = []
+        for s in sightings:
+            pos = positions.get(s.id)
+            if pos is None:
+                added.append(s)
+            else:
+                analyzed[pos] = s
+
+        deadline = time.monotonic() + self._analysis_budget if self._analysis_budget is not None else None
+        if any(s is None for s in analyzed) or not self._converged:
+            # some sightings were removed (or left the window) or the previous analysis ran out of time (continue from its targets)
+            analysis_args = dict(with_assignment=True, coalesce=self._coalesce, deadline=deadline, with_converged=True,
+                                 restarts=self._restarts, n_jobs=self._n_jobs, sample_size=self._analysis_sample_size,
+                                 initial=None if self._converged else self._state.target_set.targets)
+            if window_start is not None:
+                targets, assignment, converged = analyze_window(sightings, self._state.target_set.targets, window_start, **analysis_args)
+            else:
+                targets, assignment, converged = analyze_sightings(sightings, **analysis_args)
+        elif not added:
+            self._analyzed_checksum = checksum
+            return
+        else:
+            sightings = analyzed + added
+            targets, assignment, converged = update_analysis(sightings, self._state.target_set.targets, self._state.assignment,
+                                                             coalesce=self._coalesce, deadline=deadline, with_converged=True,
+                                                             restarts=self._restarts, n_jobs=self._n_jobs,
+                                                             sample_size=self._analysis_sample_size)
+
+        if not converged:
+            logger.warning(f'analysis of {len(sightings)} sightings did not converge within {self._analysis_budget} seconds')
+
+        state = AnalysisState(
+            target_set=TargetSet(
+                version=self._state.target_set.version + 1,
+                timestamp=time.time(),
+                targets=tuple(targets)
+            ),
+            sighting_ids=[s.id for s in sightings],
+            assignment=assignment
+        )
+
+        if self._target_store is not None:
+            # the lease might have been lost while running the analysis
+            if self._lease is not None and not await self._lease.acquire():
+                return
+            await self._target_store.publish(state.target_set)
+
+        self._set_state(state)
+        self._converged = converged
+        self._analyzed_checksum = checksum if converged else None
+        if not converged:
+            # continue in the next round
+            self._trigger_analysis(events=0)
+
+    async def _list_records(self) -> Sequence[SightingRecord]:
+        """
+        List sightings for the analysis: from the ring if there is one, otherwise from the storage
+        """
+        if self._ring is None:
+            return await self._storage.list_records()
+
+        if self._ring_loaded:
+            snapshot = self._ring.snapshot()
+            records = snapshot.to_records()
+            if not snapshot.truncated and snapshot.is_valid():
+                return records
+            logger.warning(f'sighting ring overflow (capacity {self._ring.capacity}): listing sightings from the storage')
+
+        # (re)load the ring from the storage, keeping sightings added while listing:
+        head = self._ring.snapshot().end
+        records = list(await self._storage.list_records())
+        stored = set(r.id for r in records)
+        records += [r for r in self._ring.snapshot(since=head).to_records() if r.id not in stored]
+        self._ring.clear()
+        self._ring.extend(records)
+        self._ring_loaded = len(records) <= self._ring.capacity
+        return records
+
+    def _window_start(self, sightings: Sequence[Sighting]) -> float:
+        """
+        Start time of the analysis window. The window slides in steps (see WINDOW_STEP), so sightings added
+        between steps are analyzed incrementally.
+        """
+        step = self._analysis_window * WINDOW_STEP
+        end = max((s.timestamp for s in sightings), default=0.0)
+        return math.floor((end - self._analysis_window) / step) * step
+
+    def _trigger_analysis(self, events: int = 1):
+        """
+        Signal the event-driven analysis service (if used) that sightings have changed
+        """
+        if self._analysis_trigger is not None:
+            self._analysis_trigger.notify(events=events)
+
+    async def _sync_targets(self):
+        """
+        Pick up a newer target set from the target store (if published)
+        """
+        target_set = await self._target_store.latest(since=self._state.target_set.version)
+        if target_set is not None:
+            self._set_state(AnalysisState(target_set=target_set))
+            self._analyzed_checksum = None
+
+    def _set_state(self, state: AnalysisState):
+        """
+        Replace the analysis state, rebuild the target index used by bounding box queries & predict target positions
+        """
+        self._target_index = TargetIndex(state.target_set.targets, distance=0.0, time_padding=0.0, extrapolation=DEFAULT_PREDICTION_HORIZON)
+        self._predictions = predict(state.target_set)
+        self._state = state
+        if len(self._subscriptions) and state.target_set.targets:
+            self._queue_alerts()
+
+    def _queue_alerts(self):
+        """
+        Queue alerts for users on the predicted paths of the current targets.
+        Repeated alerts about the same target are suppressed during the cooldown (see AlertCooldown).
+        """
+        end_times = [t.end_time for t in self._state.target_set.targets]
+        alerts = self._alert_cooldown.filter(fan_out(self._predictions, end_times, self._subscriptions), now=self._predictions.start_time)
+
+        if alerts:
+            self._alert_queue.put_nowait(alerts)
+
+    async def _alert_service(self):
+        """
+        Deliver queued alerts
+        """
+        while not self._alert_queue.empty():
+            alerts: List[Alert] = self._alert_queue.get_nowait()
+            await self._alert_sink.send(alerts)
+
+    async def _snapshot_service(self):
+        """
+        Saves analysis state snapshot if it has changed since the last snapshot (leader only)
+        """
+        state = self._state
+        if not self.is_leader or state.target_set.version == self._snapshot_version:
+            return
+
+        # compressing a large state takes a while, run it outside the event loop:
+        await asyncio.get_running_loop().run_in_executor(None, save_snapshot, self._snapshot_path, state)
+        self._snapshot_version = state.target_set.version
 
     async def _cleanup_service(self):
         """
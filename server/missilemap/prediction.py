@@ -0,0 +1,133 @@
+"""
+Predicted target positions on a fixed future time grid.
+
+Predictions are computed once per analysis generation for all targets at once (vectorized over targets
+& grid times), so serving them costs nothing per client. Targets keep flying along their last leg
+with their speed after the end of their path (and along the first leg before the start) for at most
+max_extrapolation seconds, positions beyond that are unknown (NaN, null in JSON).
+"""
+import dataclasses
+from typing import Sequence
+
+import numpy
+
+from .definitions import Target, TargetSet
+
+DEFAULT_PREDICTION_STEP = 10.0      # default time (seconds) between grid points
+DEFAULT_PREDICTION_HORIZON = 600.0  # default time (seconds) covered by the grid
+DEFAULT_MAX_EXTRAPOLATION = 300.0   # default time (seconds) a target is extrapolated beyond its path
+
+
+def predict_positions(targets: Sequence[Target], times, max_extrapolation: float = DEFAULT_MAX_EXTRAPOLATION) -> numpy.ndarray:
+    """
+    Compute target positions at specified times
+
+    :param targets: list of targets (with 2+ path points)
+    :param times: array of timestamps
+    :param max_extrapolation: maximum time (seconds) before the start & after the end of a path a position is predicted for
+    :return: float64 array of shape (targets, times, 2): (latitude, longitude) per target & time, NaN beyond max_extrapolation
+    """
+    times = numpy.asarray(times, dtype=float)
+    n_targets = len(targets)
+    if not n_targets:
+        return numpy.zeros((0, len(times), 2))
+
+    # legs of all targets, concatenated:
+    leg_counts = numpy.array([len(t.path) - 1 for t in targets], dtype=numpy.int64)
+    points = numpy.array([(p.latitude, p.longitude) for t in targets for p in t.path], dtype=float)
+    last_points = numpy.cumsum(leg_counts + 1) - 1
+    leg_starts = numpy.delete(points, last_points, axis=0)
+    leg_ends = numpy.delete(points, last_points - leg_counts, axis=0)
+
+    speeds = numpy.array([t.speed for t in targets], dtype=float)
+    leg_targets = numpy.repeat(numpy.arange(n_targets), leg_counts)
+    durations = numpy.array([d for t in targets for d in t.distances], dtype=float) / speeds[leg_targets]
+
+    # leg start time relative to the target start time:
+    cumulative = numpy.cumsum(durations)
+    first_legs = numpy.cumsum(leg_counts) - leg_counts
+    offsets = cumulative - durations
+    offsets -= numpy.repeat(offsets[first_legs], leg_counts)
+    total = numpy.bincount(leg_targets, weights=durations, minlength=n_targets)
+
+    # find the leg per target & time: keys of later targets are shifted beyond any time of earlier targets
+    relative = times[None, :] - numpy.array([t.start_time for t in targets], dtype=float)[:, None]
+    shift = total.max() + 1.0
+    keys = leg_targets * shift + offsets
+    queries = numpy.arange(n_targets)[:, None] * shift + numpy.clip(relative, 0.0, total[:, None])
+    legs = numpy.searchsorted(keys, queries, side='right') - 1
+
+    # before the start & after the end the first & the last legs are extrapolated:
+    leg_durations = durations[legs]
+    alpha = numpy.divide(relative - offsets[legs], leg_durations, out=numpy.zeros_like(relative), where=leg_durations > 0)
+    positions = leg_starts[legs] + alpha[..., None] * (leg_ends[legs] - leg_starts[legs])
+    positions[(relative < -max_extrapolation) | (relative > total[:, None] + max_extrapolation)] = numpy.nan
+    return positions
+
+
+@dataclasses.dataclass
+class Predictions:
+    """
+    Predicted positions of a target set on a time grid: start_time, start_time + step, ...
+    """
+    version: int = 0                   # version of the target set
+    start_time: float = 0.0            # time of the first grid point (seconds since epoch)
+    step: float = DEFAULT_PREDICTION_STEP
+    positions: numpy.ndarray = dataclasses.field(default_factory=lambda: numpy.zeros((0, 0, 2)))  # (targets, times, 2), NaN if unknown
+
+    @property
+    def times(self) -> numpy.ndarray:
+        """
+        Grid timestamps
+        """
+        return self.start_time + self.step * numpy.arange(self.positions.shape[1])
+
+    @staticmethod
+    def json_encoder(predictions) -> dict:
+        """
+        Converts Predictions to json
+        """
+        return {
+            'version': predictions.version,
+            'start_time': predictions.start_time,
+            'step': predictions.step,
+            'positions': numpy.where(numpy.isnan(predictions.positions), None, predictions.positions).tolist()
+        }
+
+    @staticmethod
+    def json_decoder(json_obj: dict):
+        """
+        Converts JSON to Predictions
+        """
+        positions = json_obj['positions']
+        return Predictions(
+            version=int(json_obj['version']),
+            start_time=float(json_obj['start_time']),
+            step=float(json_obj['step']),
+            positions=numpy.array(positions, dtype=float).reshape(len(positions), -1, 2) if positions else numpy.zeros((0, 0, 2))
+        )
+
+    def to_json(self) -> dict:
+        """
+        Convert object to JSON (dict)
+        """
+        return Predictions.json_encoder(self)
+
+
+def predict(target_set: TargetSet, step: float = DEFAULT_PREDICTION_STEP, horizon: float = DEFAULT_PREDICTION_HORIZON,
+            max_extrapolation: float = DEFAULT_MAX_EXTRAPOLATION) -> Predictions:
+    """
+    Compute predicted positions of a target set starting at the time the set was produced
+
+    :param target_set: target set
+    :param step: time (seconds) between grid points
+    :param horizon: time (seconds) covered by the grid
+    :param max_extrapolation: maximum time (seconds) a target is extrapolated beyond its path (see predict_positions())
+    """
+    times = target_set.timestamp + step * numpy.arange(int(horizon // step) + 1)
+    return Predictions(
+        version=target_set.version,
+        start_time=target_set.timestamp,
+        step=step,
+        positions=predict_positions(target_set.targets, times, max_extrapolation=max_extrapolation)
+    )
@@ -0,0 +1,215 @@
+"""
+Shared-memory ring buffer of sighting records.
+
+The event loop process appends fixed-layout records (see RECORD_DTYPE) to a multiprocessing.shared_memory
+block, analysis worker processes attach to it by name & see the records as NumPy arrays without copying
+or pickling anything. The ring keeps the last `capacity` sightings (older ones are overwritten).
+
+Layout: header of HEADER_FIELDS uint64 counters followed by `capacity` records.
+
+    head         - number of records ever appended (the next record goes to slot head % capacity)
+    start        - sequence number of the oldest valid record (advanced by clear())
+    generation   - seqlock counter: odd while the header is updated, incremented twice per update
+
+Readers take a snapshot of the header (retrying while the generation is odd or changes), the snapshot covers
+records [max(start, head - capacity), head). Taking a snapshot costs the same regardless of the number of records.
+A writer that died in the middle of an update leaves the generation odd: readers give up after a timeout.
+Records of a snapshot stay intact until the writer overwrites the oldest of them, RingSnapshot.is_valid()
+checks that after the snapshot was used (optimistic read).
+"""
+from multiprocessing import shared_memory
+import time
+from typing import List, Sequence, Tuple
+
+from bson import ObjectId
+import numpy
+
+from .table import COLUMNS, ID_SIZE, SightingRecord
+
+RECORD_DTYPE = numpy.dtype([
+    ('seq', '<u8'),  # sequence number of the record (identifies the sighting stored in the slot)
+    ('id', 'u1', (ID_SIZE,)),
+    *[(name, numpy.dtype(dtype).newbyteorder('<')) for name, dtype in COLUMNS]
+], align=True)
+HEADER_FIELDS = 4                # number of uint64 header fields
+HEAD = 0                         # header field: number of appended records
+START = 1                        # header field: sequence number of the oldest valid record
+GENERATION = 2                   # header field: seqlock counter
+CAPACITY = 3                     # header field: number of record slots
+HEADER_SIZE = 64                 # header size (bytes), keeps the records cache line aligned
+DEFAULT_RING_CAPACITY = 1 << 20  # default number of record slots
+SNAPSHOT_TIMEOUT = 1.0           # maximum time (seconds) to wait for a consistent header
+
+
+class RingSnapshot:
+    """
+    Consistent view of the records of a ring at a point in time (zero-copy)
+    """
+
+    def __init__(self, ring: 'SightingRing', generation: int, first: int, end: int, truncated: bool = False):
+        self._ring = ring
+        self.generation = generation  # ring generation at the time of the snapshot
+        self.first = first            # sequence number of the first record
+        self.end = end                # sequence number after the last record
+        self.truncated = truncated    # True if older records (requested or since the last clear) were already overwritten
+
+    def __len__(self) -> int:
+        return self.end - self.first
+
+    @property
+    def parts(self) -> Tuple[numpy.ndarray, ...]:
+        """
+        Records as views of the shared memory: one structured array, or two if the records wrap around the ring end
+        """
+        capacity = self._ring.capacity
+        records = self._ring.records
+        first, end = self.first % capacity, self.end % capacity
+        if not len(self):
+            return records[:0],
+        if first < end or end == 0:
+            return records[first:end if end else capacity],
+        return records[first:], records[:end]
+
+    def column(self, name: str) -> numpy.ndarray:
+        """
+        Column of all records (a view unless the records wrap around the ring end)
+        """
+        parts = [part[name] for part in self.parts]
+        return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+
+    def is_valid(self) -> bool:
+        """
+        Check that none of the snapshot records were overwritten or cleared since the snapshot was taken
+        """
+        header = self._ring.header
+        return int(header[HEAD]) - self._ring.capacity <= self.first and int(header[START]) <= self.first
+
+    def to_records(self) -> List[SightingRecord]:
+        """
+        Create SightingRecord tuples for the analysis (copies the records)
+        """
+        ids = numpy.ascontiguousarray(self.column('id')).tobytes()
+        return list(map(
+            SightingRecord,
+            [ObjectId(ids[i:i + ID_SIZE]) for i in range(0, len(ids), ID_SIZE)],
+            *[self.column(name).tolist() for name, _ in COLUMNS]
+        ))
+
+
+class SightingRing:
+    """
+    Ring buffer of sighting records in shared memory (single writer, any number of readers)
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory, owner: bool):
+        """
+        Use create() or attach()
+        """
+        self._memory = memory
+        self._owner = owner
+        self.header = numpy.ndarray((HEADER_FIELDS,), dtype='<u8', buffer=memory.buf)
+        self.capacity = int(self.header[CAPACITY])
+        self.records = numpy.ndarray((self.capacity,), dtype=RECORD_DTYPE, buffer=memory.buf, offset=HEADER_SIZE)
+
+    @classmethod
+    def create(cls, capacity: int = DEFAULT_RING_CAPACITY, name: str = None) -> 'SightingRing':
+        """
+        Allocate a new ring (the creating process is the writer & releases the memory on close())
+
+        :param capacity: number of record slots
+        :param name: (optional) shared memory name (default: random)
+        """
+        memory = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * RECORD_DTYPE.itemsize)
+        numpy.ndarray((HEADER_FIELDS,), dtype='<u8', buffer=memory.buf)[:] = (0, 0, 0, capacity)
+        return cls(memory, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'SightingRing':
+        """
+        Map an existing ring (e.g. in an analysis worker process).
+        NOTE: workers should be started by the writer process through multiprocessing (sharing its resource tracker),
+        otherwise the memory is released when the first attached process exits.
+
+        :param name: shared memory name of the ring (see name)
+        """
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self) -> str:
+        """
+        Shared memory name to attach to
+        """
+        return self._memory.name
+
+    @property
+    def generation(self) -> int:
+        """
+        Changes whenever records are appended or cleared
+        """
+        return int(self.header[GENERATION])
+
+    def append(self, sighting):
+        """
+        Append a sighting (any object with Sighting attributes), overwriting the oldest record if the ring is full
+        """
+        self.extend([sighting])
+
+    def extend(self, sightings: Sequence):
+        """
+        Append sightings (any objects with Sighting attributes)
+        """
+        if not len(sightings):
+            return
+        sightings = sightings[-self.capacity:]
+        head = int(self.header[HEAD])
+        rows = numpy.zeros(len(sightings), dtype=RECORD_DTYPE)
+        rows['seq'] = numpy.arange(head, head + len(sightings))
+        rows['id'] = numpy.frombuffer(b''.join(s.id.binary for s in sightings), dtype=numpy.uint8).reshape(-1, ID_SIZE)
+        for name, _ in COLUMNS:
+            rows[name] = [getattr(s, name) for s in sightings]
+
+        # head moves before the records are overwritten, so RingSnapshot.is_valid() never misses an overwrite
+        self.header[GENERATION] += 1
+        self.header[HEAD] = head + len(sightings)
+        self.records[(head + numpy.arange(len(sightings))) % self.capacity] = rows
+        self.header[GENERATION] += 1
+
+    def clear(self):
+        """
+        Drop all records
+        """
+        self.header[GENERATION] += 1
+        self.header[START] = self.header[HEAD]
+        self.header[GENERATION] += 1
+
+    def snapshot(self, since: int = 0, timeout: float = SNAPSHOT_TIMEOUT) -> RingSnapshot:
+        """
+        Take a consistent snapshot of the current records
+
+        :param since: (optional) sequence number of the first record of interest (e.g. RingSnapshot.end of a previous snapshot)
+        :param timeout: maximum time (seconds) to wait while the writer updates the header
+        :raise TimeoutError: the header stays inconsistent (e.g. the writer died in the middle of an update)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            generation = int(self.header[GENERATION])
+            if generation % 2 == 0:
+                head, start = int(self.header[HEAD]), int(self.header[START])
+                if int(self.header[GENERATION]) == generation:
+                    first = min(max(start, since), head)
+                    return RingSnapshot(self, generation, max(first, head - self.capacity), head, truncated=head - self.capacity > first)
+
+            # the writer is updating the header:
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f'sighting ring {self.name} is locked by the writer (generation {generation})')
+            time.sleep(0)
+
+    def close(self):
+        """
+        Unmap the ring (and release the shared memory if created by this process).
+        Snapshots of the ring must not be used (or referenced) any more.
+        """
+        self.header = self.records = None
+        self._memory.close()
+        if self._owner:
+            self._memory.unlink()
@@ -0,0 +1,287 @@
+"""
+Service scheduling for AsyncServer.
+
+Every service runs in its own task, so runs of a service never overlap (single-flight).
+Periodic services are scheduled either
+
+* at a fixed rate: runs start at start + k * period regardless of run durations (no drift).
+  Ticks missed by a run longer than the period are coalesced into a single next run.
+* with a fixed delay: the next run starts a period after the previous run finished.
+
+or triggered by events (DebouncedTrigger): a run starts after a short quiet window following the last event,
+with a minimum spacing between runs & a bound on the time events wait for a run. No events - no runs.
+
+A random jitter (fraction of the period) spreads runs of many services/workers. A failing run is logged
+and the service is restarted after an exponential backoff instead of silently dying.
+Per-service stats (durations, lag behind the schedule, overruns, failures) are available at runtime.
+"""
+import asyncio
+import dataclasses
+import math
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+from .utils import logger
+
+FIXED_RATE = 'fixed_rate'    # runs start at fixed times: start + k * period
+FIXED_DELAY = 'fixed_delay'  # runs start a period after the previous run finished
+DEFAULT_BACKOFF = 1.0        # initial delay (seconds) before restarting a failed service
+DEFAULT_MAX_BACKOFF = 60.0   # maximum delay (seconds) before restarting a failed service
+DEFAULT_DEBOUNCE = 0.1       # default quiet time (seconds) after the last event before a triggered run
+DEFAULT_MAX_LATENCY = 1.0    # default maximum time (seconds) from an event to the start of a triggered run
+DEFAULT_RATE_WINDOW = 10.0   # time constant (seconds) of the event rate estimate
+
+
+@dataclasses.dataclass
+class ServiceStats:
+    """
+    Service run counters & timings (seconds)
+    """
+    runs: int = 0                     # completed runs (including failed ones)
+    failures: int = 0                 # runs that raised an exception
+    overruns: int = 0                 # runs longer than the period
+    missed: int = 0                   # ticks skipped because of overruns (fixed rate)
+    running: bool = False             # a run is in progress
+    last_duration: float = 0.0        # duration of the last run
+    max_duration: float = 0.0         # longest run
+    total_duration: float = 0.0       # total time spent in runs
+    last_lag: float = 0.0             # delay of the last run start behind its scheduled (jittered) time
+    max_lag: float = 0.0              # maximum delay of a run start behind its scheduled (jittered) time
+    last_error: Optional[str] = None  # last exception raised by a run
+
+
+class DebouncedTrigger:
+    """
+    Event-driven trigger of service runs.
+
+    A run is due once events stopped arriving for the debounce window, but no later than max_latency after
+    the first event waiting for a run, and not earlier than min_spacing after the previous run finished.
+    The debounce window shrinks with the event rate: isolated bursts are batched into a single run,
+    while during sustained input runs follow each other at min_spacing instead of waiting for a quiet period.
+    """
+
+    def __init__(self, debounce: float = DEFAULT_DEBOUNCE, min_spacing: float = 0.0, max_latency: float = DEFAULT_MAX_LATENCY,
+                 rate_window: float = DEFAULT_RATE_WINDOW):
+        """
+        :param debounce: quiet time (seconds) after the last event before a run (at low event rates)
+        :param min_spacing: minimum time (seconds) between the end of a run & the start of the next one
+        :param max_latency: maximum time (seconds) from the first pending event to the run (unless limited by min_spacing)
+        :param rate_window: time constant (seconds) of the event rate estimate
+        """
+        self.debounce = debounce
+        self.min_spacing = min_spacing
+        self.max_latency = max_latency
+        self.rate_window = rate_window
+        self._event = asyncio.Event()  # set when an event arrives
+        self._first = None             # time of the first pending event (None if nothing is pending)
+        self._last = None              # time of the last pending event
+        self._last_run = -math.inf     # time the last run finished
+        self._rate = 0.0               # decayed event count / rate_window
+        self._rate_time = 0.0          # time of the rate estimate
+
+    def rate(self, now: float = None) -> float:
+        """
+        Estimated event rate (events per second)
+        """
+        now = asyncio.get_running_loop().time() if now is None else now
+        return self._rate * math.exp(-max(now - self._rate_time, 0.0) / self.rate_window)
+
+    def window(self, now: float = None) -> float:
+        """
+        Current debounce window (seconds), shrinks at high event rates
+        """
+        return self.debounce / (1.0 + self.rate(now) * self.debounce)
+
+    def notify(self, events: int = 1):
+        """
+        Signal new events (events=0 requests a run without counting an event, e.g. to continue unfinished work)
+        """
+        now = asyncio.get_running_loop().time()
+        self._rate = self.rate(now) + events / self.rate_window
+        self._rate_time = now
+        if self._first is None:
+            self._first = now
+        self._last = now
+        self._event.set()
+
+    def due(self) -> Optional[float]:
+        """
+        Time the next run is due (None if no events are pending)
+        """
+        if self._first is None:
+            return None
+        return max(min(self._last + self.window(self._last), self._first + self.max_latency), self._last_run + self.min_spacing)
+
+    async def wait(self, shutting_down: asyncio.Event) -> Optional[float]:
+        """
+        Wait until a run is due & take the pending events
+
+        :param shutting_down: event that cancels the wait
+        :return: time of the first event of the run, None if shutting down
+        """
+        loop = asyncio.get_running_loop()
+        while not shutting_down.is_set():
+            due = self.due()
+            if due is None:
+                # nothing to do: wait for an event
+                self._event.clear()
+                waiters = [loop.create_task(self._event.wait()), loop.create_task(shutting_down.wait())]
+                try:
+                    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    for waiter in waiters:
+                        waiter.cancel()
+            elif due > loop.time():
+                try:
+                    await asyncio.wait_for(shutting_down.wait(), timeout=due - loop.time())
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                first = self._first
+                self._first = self._last = None
+                return first
+        return None
+
+    def done(self):
+        """
+        Signal the end of a run (the next run is due no sooner than min_spacing from now)
+        """
+        self._last_run = asyncio.get_running_loop().time()
+
+
+class Service:
+    """
+    A service: coroutine function run once, periodically or on trigger events in its own task
+    """
+
+    def __init__(self, func: Callable[[], Awaitable], shutting_down: asyncio.Event, period: float = None, name: str = None,
+                 mode: str = FIXED_RATE, jitter: float = 0.0, restart: bool = True,
+                 backoff: float = DEFAULT_BACKOFF, max_backoff: float = DEFAULT_MAX_BACKOFF, trigger: DebouncedTrigger = None):
+        """
+        :param func: async routine
+        :param shutting_down: event set when the service must stop
+        :param period: (optional) time (seconds) between runs, None to run once (or on trigger events)
+        :param name: (optional) service name (default: function name)
+        :param mode: FIXED_RATE or FIXED_DELAY
+        :param jitter: random delay of every run, fraction of the period (0..1)
+        :param restart: if True, a run that raised an exception is retried after a backoff (one-shot services)
+            & the next periodic run is delayed by the backoff
+        :param backoff: initial restart delay (seconds), doubled after every consecutive failure
+        :param max_backoff: maximum restart delay (seconds)
+        :param trigger: (optional) runs are started by the trigger events instead of the period
+            (lag is measured from the first event of the run)
+        """
+        if period is not None and trigger is not None:
+            raise ValueError('period & trigger are mutually exclusive')
+        if mode not in (FIXED_RATE, FIXED_DELAY):
+            raise ValueError(f'Unknown schedule mode: {mode}')
+        if period is not None and period <= 0:
+            raise ValueError('period must be positive')
+
+        self.func = func
+        self.name = name if name is not None else getattr(func, '__name__', repr(func))
+        self.period = period
+        self.mode = mode
+        self.jitter = jitter
+        self.restart = restart
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.trigger = trigger
+        self.stats = ServiceStats()
+        self._shutting_down = shutting_down
+        self._failures = 0  # consecutive failures
+
+    async def run(self):
+        """
+        Run the service until it completes (one-shot) or until shutdown (periodic)
+        """
+        loop = asyncio.get_running_loop()
+        scheduled = loop.time() + (self.period if self.period is not None else 0.0)
+
+        while not self._shutting_down.is_set():
+            if self.trigger is not None:
+                scheduled = due = await self.trigger.wait(self._shutting_down)
+                if scheduled is None:
+                    break
+            else:
+                # the jitter is part of the schedule: lag & missed ticks are measured from the jittered time
+                due = scheduled
+                if self.period is not None and self.jitter > 0:
+                    due += random.uniform(0.0, self.jitter * self.period)
+                delay = due - loop.time()
+                if delay > 0 and await self._sleep(delay):
+                    break
+
+            started = loop.time()
+            self.stats.last_lag = max(started - due, 0.0)
+            self.stats.max_lag = max(self.stats.max_lag, self.stats.last_lag)
+            succeeded = await self._run_once()
+            finished = loop.time()
+
+            if self.trigger is not None:
+                self.trigger.done()
+                if not succeeded and self.restart:
+                    if await self._sleep(self._backoff()):
+                        break
+                    self.trigger.notify(events=0)
+            elif self.period is None:
+                if succeeded or not self.restart:
+                    break
+                scheduled = finished + self._backoff()
+            elif not succeeded and self.restart:
+                scheduled = finished + self._backoff()
+            elif self.mode == FIXED_DELAY:
+                scheduled = finished + self.period
+            else:
+                # fixed rate: the next tick in the future, missed ticks are coalesced
+                missed = max(math.ceil((finished - due) / self.period) - 1, 0)
+                self.stats.missed += missed
+                scheduled += (missed + 1) * self.period
+
+    async def _run_once(self) -> bool:
+        """
+        Run the function once & update stats
+
+        :return: True if the run succeeded
+        """
+        self.stats.running = True
+        start = time.perf_counter()
+        try:
+            await self.func()
+        except Exception as e:
+            self.stats.failures += 1
+            self.stats.last_error = repr(e)
+            self._failures += 1
+            logger.exception(f'service {self.name} failed')
+            return False
+        else:
+            self._failures = 0
+            return True
+        finally:
+            duration = time.perf_counter() - start
+            self.stats.running = False
+            self.stats.runs += 1
+            self.stats.last_duration = duration
+            self.stats.max_duration = max(self.stats.max_duration, duration)
+            self.stats.total_duration += duration
+            if self.period is not None and duration > self.period:
+                self.stats.overruns += 1
+
+    def _backoff(self) -> float:
+        """
+        Restart delay after consecutive failures
+        """
+        return min(self.backoff * 2 ** (self._failures - 1), self.max_backoff)
+
+    async def _sleep(self, delay: float) -> bool:
+        """
+        Sleep unless shutting down
+
+        :return: True if shutdown was initiated
+        """
+        try:
+            await asyncio.wait_for(self._shutting_down.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            return False
+        return True
@@ -0,0 +1,473 @@
+"""
+Geo-sharded distributed analysis.
+
+The covered area is split into a grid of geographic shards. Every shard is analyzed independently on the sightings
+within the shard extended by an overlap margin, so targets crossing a shard border are seen by both shards.
+
+* Analysis workers (ShardWorker, any number of processes/nodes) claim shards from a shared work queue,
+  analyze the shard sightings (see analyze_sightings()) & publish the shard targets to a per-shard target store.
+  A claim expires after a ttl, so shards of a crashed worker are picked up by the others.
+* The merger (ShardMerger, a single process holding the analysis lease) submits analysis rounds of all shards,
+  merges the published shard targets & publishes the result through the cluster target store,
+  where MissileMap workers pick it up. The workers run in serve-only mode (MissileMap serve_only):
+  they never analyze sightings or take the lease themselves, so the merger is the only publisher.
+
+Merging deduplicates targets seen by neighboring shards: every shard owns the parts of its targets flying
+within the shard (without the margin), the owned parts are stitched across shard borders (see link_segments()).
+
+The work queue is either a JSON file in a shared directory (single host, tests) or a MongoDB collection.
+"""
+from abc import ABC, abstractmethod
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import json
+import math
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+import numpy
+from pymongo import ReturnDocument, UpdateOne
+
+from .analysis import analyze_sightings, clip_target, MAX_DISTANCE
+from .cluster import FileTargetStore, ILease, ITargetStore, MongoDBTargetStore
+from .definitions import Sighting, Target, TargetSet
+from .linking import link_segments
+from .missilemap import AsyncServer
+from .scheduler import FIXED_DELAY
+from .storage import ISightingStorage
+from .utils import logger, METERS_PER_DEGREE
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_SHARD_MARGIN = 50000            # default overlap margin (meters) around shards (~4 minutes of flight)
+DEFAULT_CLAIM_TTL = 60.0                # time (seconds) after which a claimed shard that was not completed is claimed again
+DEFAULT_POLL_INTERVAL = 1.0             # time (seconds) between work queue polls of an idle worker
+DEFAULT_MERGE_INTERVAL = 1.0            # time (seconds) between merger rounds
+LOCK_RETRY_INTERVAL = 0.01              # time (seconds) between attempts to lock the file work queue
+OWNERSHIP_STEP = 10.0                   # time step (seconds) of the target positions checked against shard boxes
+SHARD_QUEUE_COLLECTION = 'shard_queue'  # MongoDB collection for the shard work queue
+SHARD_QUEUE_FILE = 'shards.json'        # file name of the shard work queue
+SHARD_PREFIX = 'shard-'                 # prefix of per-shard target store names
+
+PENDING = 'pending'  # shard state: waiting for a worker
+CLAIMED = 'claimed'  # shard state: analyzed by a worker
+DONE = 'done'        # shard state: analyzed in the current round
+
+
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """
+    Geographic shard: bounding box (min longitude, min latitude, max longitude, max latitude) & overlap margin
+    """
+    id: str
+    bbox: Tuple[float, float, float, float]
+    margin: float = DEFAULT_SHARD_MARGIN  # meters
+
+    @property
+    def extended_bbox(self) -> Tuple[float, float, float, float]:
+        """
+        Bounding box extended by the overlap margin
+        """
+        min_lon, min_lat, max_lon, max_lat = self.bbox
+        d_lat = self.margin / METERS_PER_DEGREE
+        d_lon = d_lat / max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)) + d_lat)), 1e-6)
+        return min_lon - d_lon, min_lat - d_lat, max_lon + d_lon, max_lat + d_lat
+
+    def select(self, sightings: Sequence[Sighting]) -> List[Sighting]:
+        """
+        Sightings within the extended bounding box
+        """
+        if not len(sightings):
+            return []
+        min_lon, min_lat, max_lon, max_lat = self.extended_bbox
+        latitudes = numpy.fromiter((s.latitude for s in sightings), dtype=float, count=len(sightings))
+        longitudes = numpy.fromiter((s.longitude for s in sightings), dtype=float, count=len(sightings))
+        inside = (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+        return [sightings[i] for i in numpy.flatnonzero(inside).tolist()]
+
+
+def shard_grid(bbox: Tuple[float, float, float, float], rows: int, cols: int, margin: float = DEFAULT_SHARD_MARGIN) -> List[Shard]:
+    """
+    Split an area into a grid of shards
+
+    :param bbox: (min longitude, min latitude, max longitude, max latitude) of the area
+    :param rows: number of shards along the latitude
+    :param cols: number of shards along the longitude
+    :param margin: overlap margin (meters)
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    lats = numpy.linspace(min_lat, max_lat, rows + 1).tolist()
+    lons = numpy.linspace(min_lon, max_lon, cols + 1).tolist()
+    return [
+        Shard(id=f'{row}-{col}', bbox=(lons[col], lats[row], lons[col + 1], lats[row + 1]), margin=margin)
+        for row in range(rows) for col in range(cols)
+    ]
+
+
+class IShardQueue(ABC):
+    """
+    Shared work queue of shards to analyze (asynchronous)
+    """
+    @abstractmethod
+    async def submit(self, shard_ids: Sequence[str]):
+        """
+        Start a new analysis round: mark shards as pending
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def claim(self) -> Optional[str]:
+        """
+        Claim a pending shard (or a shard whose claim expired)
+
+        :return: shard id, None if there is nothing to do
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def complete(self, shard_id: str) -> bool:
+        """
+        Mark a claimed shard as analyzed
+
+        :return: False if the claim expired & the shard was claimed by another worker
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def pending(self) -> int:
+        """
+        Number of shards not analyzed in the current round (pending or claimed)
+        """
+        raise NotImplementedError()
+
+
+class FileShardQueue(IShardQueue):
+    """
+    Work queue stored as a JSON file in a shared directory, updated under an exclusive file lock
+    (workers on a single host)
+    """
+
+    def __init__(self, path: str, ttl: float = DEFAULT_CLAIM_TTL):
+        """
+        :param path: directory path (created if missing)
+        :param ttl: claim expiration time (seconds)
+        """
+        os.makedirs(path, exist_ok=True)
+        self._dir = path
+        self._path = os.path.join(path, SHARD_QUEUE_FILE)
+        self._ttl = ttl
+        self._owner = uuid.uuid4().hex
+
+    @contextlib.asynccontextmanager
+    async def _locked(self):
+        """
+        Lock the queue & yield its state {shard id: {'state': ..., 'owner': ..., 'expires': ...}}, saved on exit.
+        The lock is polled (non-blocking), so waiting for other processes does not block the event loop.
+        """
+        fd = os.open(self._path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while True:
+                try:
+                    if fcntl is not None:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    else:
+                        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+            try:
+                with open(self._path, 'rb') as stream:
+                    shards = json.load(stream)
+            except FileNotFoundError:
+                shards = {}
+
+            yield shards
+
+            tmp_fd, tmp_path = tempfile.mkstemp(dir=self._dir, prefix='shards', suffix='.tmp')
+            try:
+                with os.fdopen(tmp_fd, 'w') as stream:
+                    json.dump(shards, stream)
+                os.replace(tmp_path, self._path)
+            except:  # noqa
+                os.remove(tmp_path)
+                raise
+        finally:
+            os.close(fd)  # releases the lock
+
+    async def submit(self, shard_ids: Sequence[str]):
+        async with self._locked() as shards:
+            for shard_id in shard_ids:
+                shards[shard_id] = {'state': PENDING, 'owner': None, 'expires': None}
+
+    async def claim(self) -> Optional[str]:
+        now = time.time()
+        async with self._locked() as shards:
+            for shard_id, shard in shards.items():
+                if shard['state'] == PENDING or (shard['state'] == CLAIMED and shard['expires'] < now):
+                    shard.update(state=CLAIMED, owner=self._owner, expires=now + self._ttl)
+                    return shard_id
+        return None
+
+    async def complete(self, shard_id: str) -> bool:
+        async with self._locked() as shards:
+            shard = shards.get(shard_id)
+            if shard is None or shard['state'] != CLAIMED or shard['owner'] != self._owner:
+                return False
+            shard['state'] = DONE
+            return True
+
+    async def pending(self) -> int:
+        async with self._locked() as shards:
+            return sum(shard['state'] != DONE for shard in shards.values())
+
+
+class MongoDBShardQueue(IShardQueue):
+    """
+    Work queue stored as a document per shard in MongoDB
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase, ttl: float = DEFAULT_CLAIM_TTL):
+        """
+        :param db: motor database object
+        :param ttl: claim expiration time (seconds)
+        """
+        self._collection = db[SHARD_QUEUE_COLLECTION]
+        self._ttl = ttl
+        self._owner = uuid.uuid4().hex
+
+    async def submit(self, shard_ids: Sequence[str]):
+        if len(shard_ids):
+            await self._collection.bulk_write([
+                UpdateOne({'_id': shard_id}, {'$set': {'state': PENDING, 'owner': None, 'expires': None}}, upsert=True)
+                for shard_id in shard_ids
+            ])
+
+    async def claim(self) -> Optional[str]:
+        now = datetime.datetime.utcnow()
+        doc = await self._collection.find_one_and_update(
+            {'$or': [{'state': PENDING}, {'state': CLAIMED, 'expires': {'$lt': now}}]},
+            {'$set': {'state': CLAIMED, 'owner': self._owner, 'expires': now + datetime.timedelta(seconds=self._ttl)}},
+            return_document=ReturnDocument.AFTER
+        )
+        return doc['_id'] if doc is not None else None
+
+    async def complete(self, shard_id: str) -> bool:
+        result = await self._collection.update_one({'_id': shard_id, 'state': CLAIMED, 'owner': self._owner}, {'$set': {'state': DONE}})
+        return result.modified_count == 1
+
+    async def pending(self) -> int:
+        return await self._collection.count_documents({'state': {'$ne': DONE}})
+
+
+def get_shard_cluster(cluster_type: str, shards: Sequence[Shard], path=None, url='mongodb://localhost:21017', database='missilemap',
+                      ttl: float = DEFAULT_CLAIM_TTL) -> Tuple[IShardQueue, Dict[str, ITargetStore]]:
+    """
+    Get the work queue & per-shard target stores for sharded analysis.
+
+    :param cluster_type: One of: "file", "mongodb"
+    :param shards: list of shards
+    :param path: shared directory path (for "file" type)
+    :param url: MongoDB URL (for "mongodb" type)
+    :param database: database name to use (for "mongodb" type)
+    :param ttl: claim expiration time (seconds)
+
+    :return: (IShardQueue, {shard id: ITargetStore}) tuple
+    """
+    if cluster_type == 'file':
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), 'missilemap')
+        stores = {shard.id: FileTargetStore(os.path.join(path, SHARD_PREFIX + shard.id)) for shard in shards}
+        return FileShardQueue(path, ttl=ttl), stores
+    elif cluster_type == 'mongodb':
+        db = AsyncIOMotorClient(url)[database]
+        return MongoDBShardQueue(db, ttl=ttl), {shard.id: MongoDBTargetStore(db, name=SHARD_PREFIX + shard.id) for shard in shards}
+    else:
+        raise ValueError(f'Unknown cluster type: {cluster_type}')
+
+
+def _owned_parts(target: Target, shard: Shard) -> List[Target]:
+    """
+    Parts of a target flying within the shard bounding box (without the overlap margin)
+    """
+    min_lon, min_lat, max_lon, max_lat = shard.bbox
+    count = max(math.ceil((target.end_time - target.start_time) / OWNERSHIP_STEP), 1) + 1
+    times = numpy.linspace(target.start_time, target.end_time, count)
+    points = [target.at_time(t) for t in times.tolist()]
+    latitudes = numpy.array([p.latitude for p in points])
+    longitudes = numpy.array([p.longitude for p in points])
+    inside = (latitudes >= min_lat) & (latitudes <= max_lat) & (longitudes >= min_lon) & (longitudes <= max_lon)
+
+    # runs of samples inside the box, extended by half a step (parts of neighboring shards overlap slightly):
+    edges = numpy.diff(inside.astype(numpy.int8), prepend=0, append=0)
+    step = times[1] - times[0]
+    return [
+        clip_target(target, times[first] - step / 2, times[last] + step / 2)
+        for first, last in zip(numpy.flatnonzero(edges > 0).tolist(), (numpy.flatnonzero(edges < 0) - 1).tolist())
+    ]
+
+
+def merge_shard_targets(shards: Sequence[Shard], shard_targets: Sequence[Sequence[Target]], max_distance: float = MAX_DISTANCE) -> List[Target]:
+    """
+    Merge targets of overlapping shards.
+
+    Every shard owns the parts of its targets flying within the shard (targets seen in the overlap margins
+    of neighboring shards are duplicated), the owned parts are stitched across shard borders.
+
+    :param shards: list of shards
+    :param shard_targets: list of targets per shard
+    :param max_distance: maximum distance (meters) between the end of a part & the start of the next one
+    :return: merged targets
+    """
+    parts = [part for shard, targets in zip(shards, shard_targets) for target in targets for part in _owned_parts(target, shard)]
+    linked, _ = link_segments(parts, max_distance=max_distance)
+    return linked
+
+
+class ShardWorker(AsyncServer):
+    """
+    Analysis worker: claims shards from the work queue, analyzes their sightings & publishes the shard targets
+    """
+
+    def __init__(self, storage: ISightingStorage, queue: IShardQueue, stores: Dict[str, ITargetStore], shards: Sequence[Shard],
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, **kwargs):
+        """
+        :param storage: sightings storage (shared by all workers)
+        :param queue: shard work queue
+        :param stores: target store per shard id
+        :param shards: list of shards
+        :param poll_interval: if > 0, time (seconds) between work queue polls while idle
+        :param kwargs: analyze_sightings() arguments (e.g. coalesce, restarts, n_jobs)
+        """
+        super().__init__()
+        self._storage = storage
+        self._queue = queue
+        self._stores = stores
+        self._shards = {shard.id: shard for shard in shards}
+        self._analysis_args = kwargs
+        self._checksums = {}  # storage checksum per shard at the time of the last analysis by this worker
+        self.analyzed = 0     # number of analyzed shards
+
+        if poll_interval > 0:
+            self.run_service(self.work, period=poll_interval, mode=FIXED_DELAY)
+
+    async def work(self) -> int:
+        """
+        Analyze shards until the queue is drained
+
+        :return: number of analyzed shards
+        """
+        count = 0
+        while not self._shutting_down.is_set():
+            shard_id = await self._queue.claim()
+            if shard_id is None:
+                break
+            await self.analyze(shard_id)
+            if not await self._queue.complete(shard_id):
+                logger.warning(f'shard {shard_id} claim expired before the analysis completed')
+            count += 1
+        return count
+
+    async def analyze(self, shard_id: str):
+        """
+        Analyze a shard & publish its targets (skipped if sightings did not change since this worker analyzed the shard)
+        """
+        await self._storage.sync()
+        checksum = self._storage.checksum
+        if self._checksums.get(shard_id) == checksum:
+            return
+        sightings = self._shards[shard_id].select(await self._storage.list_records())
+        targets = analyze_sightings(sightings, **self._analysis_args)
+
+        store = self._stores[shard_id]
+        latest = await store.latest()
+        version = latest.version + 1 if latest is not None else 1
+        await store.publish(TargetSet(version=version, timestamp=time.time(), targets=tuple(targets)))
+        self._checksums[shard_id] = checksum
+        self.analyzed += 1
+
+
+class ShardMerger(AsyncServer):
+    """
+    Merger: runs analysis rounds of all shards & publishes the merged targets. MissileMap workers sharing
+    the target store must run in serve-only mode (see MissileMap serve_only), the lease only keeps
+    a second merger from publishing
+    """
+
+    def __init__(self, queue: IShardQueue, stores: Dict[str, ITargetStore], shards: Sequence[Shard], target_store: ITargetStore,
+                 lease: ILease = None, merge_interval: float = DEFAULT_MERGE_INTERVAL):
+        """
+        :param queue: shard work queue
+        :param stores: target store per shard id
+        :param shards: list of shards
+        :param target_store: store for publishing merged targets (see get_cluster())
+        :param lease: (optional) analysis leader lease shared with other mergers
+        :param merge_interval: if > 0, time (seconds) between merger rounds
+        """
+        super().__init__()
+        self._queue = queue
+        self._stores = stores
+        self._shards = list(shards)
+        self._target_store = target_store
+        self._lease = lease
+        self._versions = None  # shard target set versions of the last merge
+        self._version = 0      # version of the last published target set
+
+        if merge_interval > 0:
+            self.run_service(self.merge_round, period=merge_interval, mode=FIXED_DELAY)
+
+    async def merge_round(self) -> Optional[TargetSet]:
+        """
+        Merge the results of a completed round & submit the next one
+
+        :return: published target set (None if nothing changed or the round is still running)
+        """
+        if self._lease is not None and not await self._lease.acquire():
+            return None
+        if await self._queue.pending():
+            return None
+
+        target_set = await self.merge()
+        await self._queue.submit([shard.id for shard in self._shards])
+        return target_set
+
+    async def merge(self) -> Optional[TargetSet]:
+        """
+        Merge the latest shard targets & publish them if any shard published newer targets
+
+        :return: published target set (None if nothing changed)
+        """
+        results = [await self._stores[shard.id].latest() for shard in self._shards]
+        versions = [r.version if r is not None else 0 for r in results]
+        if versions == self._versions or not any(versions):
+            return None
+
+        if not self._version:
+            # continue version numbering of the target store
+            latest = await self._target_store.latest()
+            self._version = latest.version if latest is not None else 0
+
+        targets = merge_shard_targets(self._shards, [r.targets if r is not None else () for r in results])
+        self._version += 1
+        target_set = TargetSet(version=self._version, timestamp=time.time(), targets=tuple(targets))
+        await self._target_store.publish(target_set)
+        self._versions = versions
+        return target_set
+
+    async def shutdown(self):
+        """
+        Shutdown running services and give up the analysis lease
+        """
+        await super().shutdown()
+        if self._lease is not None:
+            await self._lease.release()
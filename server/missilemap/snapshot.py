@@ -0,0 +1,94 @@
+"""
+Snapshot & restore of the analysis state.
+
+Snapshots allow the server to serve the last known targets right after a restart
+and to analyze only the sightings that were added after the snapshot was taken.
+"""
+import dataclasses
+import os
+import tempfile
+from typing import Optional, Sequence
+
+from bson import ObjectId
+from geopy import Point
+import numpy
+
+from .definitions import Target, TargetSet
+
+SNAPSHOT_FORMAT = 2       # snapshot file format version
+READABLE_FORMATS = (1, 2)  # formats load_snapshot() reads (format 1 has an unused high_water_mark array)
+
+
+@dataclasses.dataclass
+class AnalysisState:
+    """
+    Analysis results together with the sightings they were computed from
+    """
+    target_set: TargetSet = dataclasses.field(default_factory=TargetSet)
+    sighting_ids: Sequence[ObjectId] = ()  # analyzed sightings
+    assignment: Sequence[int] = ()         # target index per analyzed sighting (-1 if not assigned)
+
+
+def save_snapshot(path: str, state: AnalysisState):
+    """
+    Save analysis state into a compressed numpy (.npz) file.
+    The file is replaced atomically.
+
+    :param path: snapshot file path
+    :param state: state to save
+    """
+    targets = state.target_set.targets
+    path_lengths = [len(t.path) for t in targets]
+
+    arrays = {
+        'format': numpy.array(SNAPSHOT_FORMAT),
+        'version': numpy.array(state.target_set.version, dtype=numpy.int64),
+        'timestamp': numpy.array(state.target_set.timestamp, dtype=numpy.float64),
+        'start_time': numpy.array([t.start_time for t in targets], dtype=numpy.float64),
+        'speed': numpy.array([t.speed for t in targets], dtype=numpy.float64),
+        'path_offsets': numpy.cumsum([0] + path_lengths, dtype=numpy.int64),
+        'path': numpy.array([(p.latitude, p.longitude) for t in targets for p in t.path], dtype=numpy.float64).reshape(-1, 2),
+        'sighting_ids': numpy.frombuffer(b''.join(i.binary for i in state.sighting_ids), dtype=numpy.uint8).reshape(-1, 12),
+        'assignment': numpy.array(state.assignment, dtype=numpy.int32)
+    }
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='snapshot', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as stream:
+            numpy.savez_compressed(stream, **arrays)
+        os.replace(tmp_path, path)
+    except:  # noqa
+        os.remove(tmp_path)
+        raise
+
+
+def load_snapshot(path: str) -> Optional[AnalysisState]:
+    """
+    Load analysis state saved by save_snapshot()
+
+    :param path: snapshot file path
+    :return: AnalysisState object or None if the snapshot does not exist
+    """
+    if not os.path.exists(path):
+        return None
+
+    with numpy.load(path) as data:
+        if int(data['format']) not in READABLE_FORMATS:
+            raise ValueError(f'Unsupported snapshot format: {int(data["format"])}')
+
+        offsets = data['path_offsets']
+        points = data['path']
+        targets = tuple(
+            Target(
+                start_time=float(start_time),
+                speed=float(speed),
+                path=[Point(latitude=lat, longitude=lon) for lat, lon in points[offsets[i]:offsets[i + 1]]]
+            )
+            for i, (start_time, speed) in enumerate(zip(data['start_time'], data['speed']))
+        )
+
+        return AnalysisState(
+            target_set=TargetSet(version=int(data['version']), timestamp=float(data['timestamp']), targets=targets),
+            sighting_ids=[ObjectId(row.tobytes()) for row in data['sighting_ids']],
+            assignment=data['assignment'].tolist()
+        )
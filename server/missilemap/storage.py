@@ -2,12 +2,21 @@
 Object storage support
 """
 from abc import ABC, abstractmethod
+import asyncio
+import datetime
+import time
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
 from odmantic import AIOEngine
+from pymongo.errors import DuplicateKeyError
 from typing import Sequence
 
 
 from missilemap import Sighting
+from missilemap.table import COLUMNS, SightingRecord, SightingTable
+
+SYNC_OVERLAP = 60.0         # re-read sightings with ids generated up to specified time (seconds) before the high-water mark
+FULL_SYNC_INTERVAL = 300.0  # time (seconds) between full re-synchronizations of MongoDB storage mirror
 
 
 class ISightingStorage(ABC):
@@ -21,10 +30,19 @@ class ISightingStorage(ABC):
         """
         raise NotImplementedError()
 
+    async def sync(self):
+        """
+        Pick up changes made to the underlying storage by other processes (updates checksum if anything changed).
+        Does nothing by default.
+        """
+        pass
+
     @abstractmethod
     async def add_sighting(self, sighting: Sighting) -> Sighting:
         """
-        Adds a new sighting to the storage
+        Adds a new sighting to the storage.
+        Adding a sighting with an id that is already stored does nothing and returns the stored sighting,
+        so retried requests are idempotent.
         """
         raise NotImplementedError()
 
@@ -42,6 +60,14 @@ class ISightingStorage(ABC):
         """
         raise NotImplementedError()
 
+    async def list_records(self) -> Sequence[SightingRecord]:
+        """
+        List current set of sightings for the analysis: any objects with Sighting attributes
+        (timestamp, latitude, longitude, bearing, location, id). Returns Sighting objects by default.
+        Call sync() first to pick up changes made by other servers.
+        """
+        return await self.list_sightings()
+
     @abstractmethod
     async def clear_sightings(self):
         """
@@ -52,14 +78,15 @@ class ISightingStorage(ABC):
 
 class MemoryStorage(ISightingStorage):
     """
-    Default in-memory storage implementation
+    Default in-memory storage implementation.
+    Sightings are kept in a compact columnar table, Sighting objects are only created when listing.
     """
 
     def __init__(self):
         """
         Initialize the object
         """
-        self._sightings = {}
+        self._sightings = SightingTable()
         self._checksum = 0
 
     @property
@@ -70,7 +97,11 @@ class MemoryStorage(ISightingStorage):
         """
         Add a sighting to in-memory storage
         """
-        self._sightings[sighting.id] = sighting
+        existing = self._sightings.get(sighting.id)
+        if existing is not None:
+            return existing
+
+        self._sightings.add_sighting(sighting)
         self._checksum += 1
         return sighting
 
@@ -78,14 +109,21 @@ class MemoryStorage(ISightingStorage):
         """
         Removes a sighting from the storage
         """
-        self._sightings.pop(sighting.id)
+        if not self._sightings.remove(sighting.id):
+            raise KeyError(sighting.id)
         self._checksum += 1
 
     async def list_sightings(self) -> Sequence[Sighting]:
         """
         Get all sightings
         """
-        return list(self._sightings.values())
+        return self._sightings.to_sightings()
+
+    async def list_records(self) -> Sequence[SightingRecord]:
+        """
+        Get all sightings as lightweight records
+        """
+        return self._sightings.to_records()
 
     async def clear_sightings(self):
         """
@@ -97,49 +135,144 @@ class MemoryStorage(ISightingStorage):
 
 class MongoDBStorage(ISightingStorage):
     """
-    MongoDB-based storage implementation
+    MongoDB-based storage implementation.
+
+    Keeps an in-process mirror of the sightings collection (compact columnar table).
+    The mirror is synchronized incrementally: only documents with _id above the high-water mark are read
+    using raw projected cursor (without creating model objects).
+
+    Sightings removed by other processes are detected by comparing document count with the mirror size.
+    Since ObjectIds are generated by clients and are not strictly increasing, the incremental read overlaps
+    the high-water mark by SYNC_OVERLAP seconds & the mirror is fully re-synchronized every full_sync_interval seconds.
     """
-    def __init__(self, db: AIOEngine):
+    def __init__(self, db: AIOEngine, full_sync_interval: float = FULL_SYNC_INTERVAL):
+        """
+        :param db: odmantic engine
+        :param full_sync_interval: time (seconds) between full mirror re-synchronizations
+        """
         self.db = db
         self._checksum = 0
+        self._mirror = SightingTable()
+        self._high_water_mark: ObjectId = None  # largest synchronized _id
+        self._full_sync_interval = full_sync_interval
+        self._last_full_sync = None             # time.monotonic() of the last full synchronization
+        self._sync_lock = asyncio.Lock()
 
     @property
     def checksum(self) -> int:
         """
-        Checksum is incremented on add/remove calls
+        Checksum is incremented on add/remove calls and when synchronization picks up any changes
         """
         return self._checksum
 
+    async def sync(self, full: bool = False):
+        """
+        Synchronize the mirror with the DB
+
+        :param full: if True, re-read all documents
+        """
+        async with self._sync_lock:
+            if full or self._last_full_sync is None or time.monotonic() - self._last_full_sync > self._full_sync_interval:
+                await self._full_sync()
+                return
+
+            start_id = ObjectId.from_datetime(self._high_water_mark.generation_time - datetime.timedelta(seconds=SYNC_OVERLAP)) \
+                if self._high_water_mark is not None else None
+            if await self._read(self._mirror, start_id):
+                self._checksum += 1
+
+            # documents were removed by other processes:
+            if await self.db.get_collection(Sighting).estimated_document_count() < len(self._mirror):
+                await self._full_sync()
+
     async def add_sighting(self, sighting: Sighting):
         """
         Store sighting into DB
 
         :param sighting: sighting object
         """
-        res = await self.db.save(sighting)
+        existing = self._mirror.get(sighting.id)
+        if existing is not None:
+            return existing
+
+        try:
+            await self.db.get_collection(Sighting).insert_one(sighting.doc())
+        except DuplicateKeyError:
+            # added by another process
+            existing = await self.db.find_one(Sighting, Sighting.id == sighting.id)
+            if existing is not None:
+                return existing
+            raise
+
+        self._mirror.add_sighting(sighting)
         self._checksum += 1
-        return res
+        return sighting
 
     async def remove_sighting(self, sighting: Sighting):
         """
         Remove specified sighting from the storage
         """
         await self.db.delete(sighting)
+        self._mirror.remove(sighting.id)
         self._checksum += 1
 
     async def list_sightings(self) -> Sequence[Sighting]:
         """
         List stored sightings
         """
-        return await self.db.find(model=Sighting)
+        await self.sync()
+        return self._mirror.to_sightings()
+
+    async def list_records(self) -> Sequence[SightingRecord]:
+        """
+        List mirrored sightings as lightweight records (without synchronizing: the analysis calls sync() first
+        to compare checksums)
+        """
+        return self._mirror.to_records()
 
     async def clear_sightings(self):
         """
         Clear all sightings
         """
         self._checksum += 1
+        self._mirror.clear()
+        self._high_water_mark = None
         return await self.db.get_collection(Sighting).drop()
 
+    async def _full_sync(self):
+        """
+        Replace the mirror with all documents from the DB
+        """
+        mirror = SightingTable(capacity=len(self._mirror))
+        self._high_water_mark = None
+        await self._read(mirror, None)
+
+        if not mirror.equals(self._mirror):
+            self._checksum += 1
+
+        self._mirror = mirror
+        self._last_full_sync = time.monotonic()
+
+    async def _read(self, mirror: SightingTable, start_id: ObjectId = None) -> int:
+        """
+        Read documents with _id > start_id into the mirror & update the high-water mark
+
+        :return: number of new sightings
+        """
+        cursor = self.db.get_collection(Sighting).find(
+            {'_id': {'$gt': start_id}} if start_id is not None else {},
+            projection={name: True for name, _ in COLUMNS},
+            sort=[('_id', 1)]
+        )
+
+        added = 0
+        async for doc in cursor:
+            added += mirror.add(doc['_id'], doc['timestamp'], doc['latitude'], doc['longitude'], doc['bearing'])
+            if self._high_water_mark is None or doc['_id'] > self._high_water_mark:
+                self._high_water_mark = doc['_id']
+
+        return added
+
 
 def get_storage(db_type="mongodb", url='mongodb://localhost:21017', database='missilemap') -> ISightingStorage:
     """
@@ -157,4 +290,3 @@ def get_storage(db_type="mongodb", url='mongodb://localhost:21017', database='mi
         return MemoryStorage()
     else:
         raise ValueError(f'Unknown DB type: {db_type}')
-
@@ -0,0 +1,331 @@
+"""
+Compact in-memory columnar table of sightings.
+
+Sightings are stored in append-only typed (numpy) arrays, one array per field.
+Removed rows are marked with tombstones and dropped by periodic compaction.
+Sighting model objects are only created when requested (at the API boundary),
+the analysis reads lightweight SightingRecord tuples built directly from the columns.
+"""
+from typing import Dict, List, Mapping, NamedTuple, Optional
+
+from bson import ObjectId
+from geopy import Point
+import numpy
+
+from .definitions import Sighting
+
+# (field name, type) for every stored sighting field except the id:
+COLUMNS = (
+    ('timestamp', numpy.int64),
+    ('latitude', numpy.float64),
+    ('longitude', numpy.float64),
+    ('bearing', numpy.float64)
+)
+
+ID_SIZE = 12               # ObjectId size (bytes)
+MIN_CAPACITY = 1024        # minimum number of allocated rows
+MIN_RECENT = 4096          # minimum number of recently added ids before merging them into the sorted index
+MIN_COMPACTION = 1024      # minimum number of removed rows before compacting the table
+
+
+class SightingRecord(NamedTuple):
+    """
+    Read-only sighting row with the same attributes as Sighting (without model validation overhead)
+    """
+    id: ObjectId
+    timestamp: int
+    latitude: float
+    longitude: float
+    bearing: float
+
+    @property
+    def location(self) -> Point:
+        """
+        Get location as geopy.Point()
+        """
+        return Point(latitude=self.latitude, longitude=self.longitude)
+
+
+class SightingTable:
+    """
+    Columnar table of sightings with id -> row index.
+
+    The index consists of sorted id array (binary search) for the bulk of the rows and
+    a small dictionary for recently added rows. The dictionary is merged into the sorted array once it grows.
+    """
+
+    def __init__(self, capacity: int = MIN_CAPACITY):
+        """
+        :param capacity: initial number of allocated rows
+        """
+        self._size = 0     # number of used rows (including removed ones)
+        self._removed = 0  # number of removed rows
+        self._allocate(max(capacity, MIN_CAPACITY))
+        self._reset_index()
+
+    @classmethod
+    def from_columns(cls, columns: Mapping[str, numpy.ndarray]) -> 'SightingTable':
+        """
+        Create a table from columns (see columns()) in bulk. Of rows with the same id the last one is kept.
+
+        :param columns: {'id': uint8 array (N, 12), 'timestamp': ..., 'latitude': ..., 'longitude': ..., 'bearing': ...}
+        """
+        ids = numpy.asarray(columns['id'], dtype=numpy.uint8).reshape(-1, ID_SIZE)
+        _, last = numpy.unique(ids[::-1].view(f'S{ID_SIZE}').ravel(), return_index=True)
+        rows = numpy.sort(len(ids) - 1 - last)
+
+        table = cls(capacity=len(rows))
+        table._size = len(rows)
+        table._ids[:len(rows)] = ids[rows]
+        table._alive[:len(rows)] = True
+        for name, column in table._columns.items():
+            column[:len(rows)] = numpy.asarray(columns[name])[rows]
+
+        table._merge_index()
+        return table
+
+    def __len__(self) -> int:
+        """
+        Number of stored sightings
+        """
+        return self._size - self._removed
+
+    def __contains__(self, sighting_id: ObjectId) -> bool:
+        return self._find(sighting_id.binary) >= 0
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Approximate memory used by the table (bytes)
+        """
+        return (
+            self._ids.nbytes + self._alive.nbytes + sum(c.nbytes for c in self._columns.values()) +
+            self._index_keys.nbytes + self._index_rows.nbytes +
+            len(self._recent) * 100  # rough estimate of bytes per dict entry (including the key object)
+        )
+
+    def add(self, sighting_id: ObjectId, timestamp: int, latitude: float, longitude: float, bearing: float) -> bool:
+        """
+        Add a sighting (or replace an existing sighting with the same id)
+
+        :return: True if a new sighting was added
+        """
+        key = sighting_id.binary
+        row = self._find(key)
+        is_new = row < 0
+
+        if is_new:
+            if self._size == len(self._alive):
+                self._allocate(2 * len(self._alive))
+
+            row = self._size
+            self._size += 1
+            self._ids[row] = numpy.frombuffer(key, dtype=numpy.uint8)
+            self._alive[row] = True
+            self._recent[key] = row
+
+            if len(self._recent) > max(MIN_RECENT, len(self._index_keys) // 8):
+                self._merge_index()
+
+        self._columns['timestamp'][row] = timestamp
+        self._columns['latitude'][row] = latitude
+        self._columns['longitude'][row] = longitude
+        self._columns['bearing'][row] = bearing
+        return is_new
+
+    def add_sighting(self, sighting: Sighting) -> bool:
+        """
+        Add a sighting model object (or replace an existing one)
+
+        :return: True if a new sighting was added
+        """
+        return self.add(sighting.id, sighting.timestamp, sighting.latitude, sighting.longitude, sighting.bearing)
+
+    def get(self, sighting_id: ObjectId) -> Optional[Sighting]:
+        """
+        Get sighting by id
+
+        :return: Sighting object or None if not found
+        """
+        row = self._find(sighting_id.binary)
+        if row < 0:
+            return None
+        return self._to_sighting(sighting_id, row)
+
+    def remove(self, sighting_id: ObjectId) -> bool:
+        """
+        Remove a sighting by id
+
+        :return: True if the sighting was found & removed
+        """
+        key = sighting_id.binary
+        row = self._find(key)
+        if row < 0:
+            return False
+
+        self._alive[row] = False
+        self._recent.pop(key, None)
+        self._removed += 1
+
+        if self._removed > max(MIN_COMPACTION, self._size // 4):
+            self.compact()
+        return True
+
+    def clear(self):
+        """
+        Remove all sightings & release memory
+        """
+        self._size = 0
+        self._removed = 0
+        self._allocate(MIN_CAPACITY)
+        self._reset_index()
+
+    def compact(self):
+        """
+        Drop removed rows & rebuild the index
+        """
+        rows = numpy.flatnonzero(self._alive[:self._size])
+        ids = self._ids[rows]
+        columns = {name: column[rows] for name, column in self._columns.items()}
+
+        self._size = 0
+        self._removed = 0
+        self._allocate(max(MIN_CAPACITY, len(rows) + len(rows) // 8))
+        self._size = len(rows)
+        self._ids[:self._size] = ids
+        self._alive[:self._size] = True
+        for name, column in columns.items():
+            self._columns[name][:self._size] = column
+
+        self._reset_index()
+        self._merge_index()
+
+    def columns(self) -> Dict[str, numpy.ndarray]:
+        """
+        Get copies of columns for all stored sightings.
+
+        :return: {'id': uint8 array (N, 12), 'timestamp': ..., 'latitude': ..., 'longitude': ..., 'bearing': ...}
+        """
+        rows = numpy.flatnonzero(self._alive[:self._size])
+        return {
+            'id': self._ids[rows],
+            **{name: column[rows] for name, column in self._columns.items()}
+        }
+
+    def equals(self, other) -> bool:
+        """
+        Check if both tables contain the same sightings (regardless of the order)
+        """
+        if len(self) != len(other):
+            return False
+
+        columns = [self.columns(), other.columns()]
+        for c in columns:
+            order = numpy.argsort(c['id'].view(f'S{ID_SIZE}').ravel(), kind='stable')
+            for name in c:
+                c[name] = c[name][order]
+
+        return all(numpy.array_equal(columns[0][name], columns[1][name]) for name in columns[0])
+
+    def to_sightings(self) -> List[Sighting]:
+        """
+        Create Sighting objects for all stored sightings
+        """
+        columns = self.columns()
+        ids = columns['id'].tobytes()
+        return [
+            Sighting(id=ObjectId(ids[ID_SIZE * i:ID_SIZE * (i + 1)]), timestamp=timestamp, latitude=latitude, longitude=longitude, bearing=bearing)
+            for i, (timestamp, latitude, longitude, bearing) in enumerate(zip(
+                *[columns[name].tolist() for name, _ in COLUMNS]
+            ))
+        ]
+
+    def to_records(self) -> List[SightingRecord]:
+        """
+        Create SightingRecord tuples for all stored sightings (much cheaper than Sighting objects)
+        """
+        columns = self.columns()
+        ids = columns['id'].tobytes()
+        return list(map(
+            SightingRecord,
+            [ObjectId(ids[i:i + ID_SIZE]) for i in range(0, len(ids), ID_SIZE)],
+            *[columns[name].tolist() for name, _ in COLUMNS]
+        ))
+
+    def _to_sighting(self, sighting_id: ObjectId, row: int) -> Sighting:
+        """
+        Create Sighting object for specified row
+        """
+        return Sighting(id=sighting_id, **{name: column[row].item() for name, column in self._columns.items()})
+
+    def _allocate(self, capacity: int):
+        """
+        Allocate arrays with specified capacity & copy existing rows
+        """
+        size = self._size
+
+        ids = numpy.zeros((capacity, ID_SIZE), dtype=numpy.uint8)
+        alive = numpy.zeros(capacity, dtype=bool)
+        columns = {name: numpy.zeros(capacity, dtype=dtype) for name, dtype in COLUMNS}
+
+        if size:
+            ids[:size] = self._ids[:size]
+            alive[:size] = self._alive[:size]
+            for name, column in columns.items():
+                column[:size] = self._columns[name][:size]
+
+        self._ids = ids
+        self._alive = alive
+        self._columns = columns
+
+    def _reset_index(self):
+        """
+        Create an empty index
+        """
+        self._index_keys = numpy.empty(0, dtype=f'S{ID_SIZE}')  # sorted ids
+        self._index_rows = numpy.empty(0, dtype=numpy.int64)    # row per sorted id
+        self._recent = {}                                       # id (bytes) -> row for recently added rows
+
+    def _merge_index(self):
+        """
+        Merge recently added rows into the sorted index
+        """
+        if self._recent:
+            rows = numpy.fromiter(self._recent.values(), dtype=numpy.int64, count=len(self._recent))
+        else:
+            # rebuild from scratch
+            rows = numpy.flatnonzero(self._alive[:self._size])
+            self._index_keys = self._index_keys[:0]
+            self._index_rows = self._index_rows[:0]
+
+        keys = numpy.concatenate((self._index_keys, self._ids[rows].view(f'S{ID_SIZE}').ravel()))
+        rows = numpy.concatenate((self._index_rows, rows))
+        order = numpy.argsort(keys, kind='stable')
+
+        self._index_keys = keys[order]
+        self._index_rows = rows[order]
+        self._recent = {}
+
+    def _find(self, key: bytes) -> int:
+        """
+        Find row for specified id
+
+        :param key: id bytes
+        :return: row index or -1 if not found (or removed)
+        """
+        row = self._recent.get(key)
+        if row is not None:
+            return row
+
+        # NOTE: numpy strips trailing zero bytes when accessing 'S' array items
+        stripped = key.rstrip(b'\0')
+
+        # the same id might appear multiple times if it was removed & added again:
+        pos = self._index_keys.searchsorted(key)
+        while pos < len(self._index_keys) and self._index_keys[pos] == stripped:
+            row = int(self._index_rows[pos])
+            if self._alive[row]:
+                return row
+            pos += 1
+
+        return -1
@@ -6,6 +6,7 @@ from odmantic import Model
 
 class User(Model):
     """
-
+    Registered user (alerts subscriber)
     """
-    pass
+    latitude: float   # location latitude (degrees)
+    longitude: float  # location longitude (degrees)
@@ -9,6 +9,9 @@ from typing import Sequence, Union, Tuple
 
 logger = logging.Logger('missilemap')
 
+EARTH_RADIUS = 6371008.8                          # mean earth radius (meters)
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180.0  # meters per degree of latitude (and of longitude at the equator)
+
 
 def closest_point(p1: Sequence[float], p2: Sequence[float], x: Sequence[float]) -> float:
     """
@@ -30,7 +33,7 @@ def closest_point(p1: Sequence[float], p2: Sequence[float], x: Sequence[float])
     p2 = numpy.asarray(p2)
     x = numpy.asarray(x)
 
-    assert((p1.shape[0] == 2) and (p2.shape[0] == 2) and (x.shape[0] == 2))
+    assert (p1.shape[0] == 2) and (p2.shape[0] == 2) and (x.shape[0] == 2)
 
     p2_p1 = p2 - p1
     p2_p1_dot = numpy.dot(p2_p1, p2_p1)
@@ -98,6 +101,43 @@ def normalize_bearing(bearing: float) -> float:
     return bearing
 
 
+def to_local_xy(latitudes, longitudes, origin: Tuple[float, float] = None) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Project points to local planar coordinates (equirectangular projection around the origin).
+    Accurate enough for distances of up to a few hundred kilometers.
+
+    :param latitudes: array of latitudes (degrees)
+    :param longitudes: array of longitudes (degrees)
+    :param origin: (latitude, longitude) of the projection origin. Default: mean of the points.
+    :return: tuple (x, y) of arrays in meters (x - east, y - north)
+    """
+    latitudes = numpy.asarray(latitudes, dtype=float)
+    longitudes = numpy.asarray(longitudes, dtype=float)
+
+    if origin is None:
+        origin = (latitudes.mean(), longitudes.mean()) if latitudes.size else (0.0, 0.0)
+
+    scale = METERS_PER_DEGREE
+    x = (longitudes - origin[1]) * scale * math.cos(math.radians(origin[0]))
+    y = (latitudes - origin[0]) * scale
+    return x, y
+
+
+def from_local_xy(x, y, origin: Tuple[float, float]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Inverse of to_local_xy()
+
+    :param x: array of x coordinates (meters east of the origin)
+    :param y: array of y coordinates (meters north of the origin)
+    :param origin: (latitude, longitude) of the projection origin
+    :return: tuple (latitudes, longitudes) of arrays in degrees
+    """
+    scale = METERS_PER_DEGREE
+    latitudes = origin[0] + numpy.asarray(y, dtype=float) / scale
+    longitudes = origin[1] + numpy.asarray(x, dtype=float) / (scale * math.cos(math.radians(origin[0])))
+    return latitudes, longitudes
+
+
 def normalize_point(latitude, longitude) -> Point:
     """
     Normalize point to be within acceptable range
@@ -0,0 +1,99 @@
+"""
+Compact binary wire format for targets.
+
+JSON produced by Target.json_encoder spends most of its bytes on keys & decimal digits of path points.
+The binary format is a fixed little-endian layout of columns:
+
+    header:       magic (4 bytes) | format version (uint16) | number of targets N (uint32)
+    start_time:   N x float64 (seconds since epoch)
+    speed:        N x float32 (m/sec)
+    path_length:  N x uint16 (number of path points per target)
+    path:         M x (int32 latitude, int32 longitude), M - total number of path points
+
+Coordinates are quantized to COORDINATE_SCALE units (about 0.1 meter). The first point of every path
+is absolute, the next points are deltas from the previous point. Deltas are small numbers with mostly
+zero high bytes, so the payload compresses well with HTTP gzip.
+"""
+import struct
+from typing import List, Sequence
+
+from geopy import Point
+import numpy
+
+from .definitions import Target
+
+MEDIA_TYPE = 'application/x-missilemap-targets'  # content type of the binary format
+WIRE_MAGIC = b'MMTG'                             # format signature
+WIRE_FORMAT = 1                                  # format version
+COORDINATE_SCALE = 1e6                           # quantization units per degree
+
+_HEADER = struct.Struct('<4sHI')
+
+
+def encode_targets(targets: Sequence[Target]) -> bytes:
+    """
+    Encode targets into the binary wire format
+
+    :param targets: list of targets
+    :return: encoded bytes
+    """
+    path_lengths = numpy.array([len(t.path) for t in targets], dtype='<u2')
+    coordinates = numpy.array([(p.latitude, p.longitude) for t in targets for p in t.path], dtype=numpy.float64).reshape(-1, 2)
+
+    quantized = numpy.rint(coordinates * COORDINATE_SCALE).astype(numpy.int64)
+    deltas = quantized.copy()
+    deltas[1:] -= quantized[:-1]
+    firsts = numpy.cumsum(path_lengths, dtype=numpy.int64) - path_lengths
+    deltas[firsts[path_lengths > 0]] = quantized[firsts[path_lengths > 0]]
+
+    return b''.join((
+        _HEADER.pack(WIRE_MAGIC, WIRE_FORMAT, len(targets)),
+        numpy.array([t.start_time for t in targets], dtype='<f8').tobytes(),
+        numpy.array([t.speed for t in targets], dtype='<f4').tobytes(),
+        path_lengths.tobytes(),
+        deltas.astype('<i4').tobytes()
+    ))
+
+
+def decode_targets(data: bytes) -> List[Target]:
+    """
+    Decode targets from the binary wire format
+
+    :param data: encoded bytes
+    :return: list of targets
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("Truncated targets payload")
+
+    magic, version, count = _HEADER.unpack_from(data)
+    if magic != WIRE_MAGIC or version != WIRE_FORMAT:
+        raise ValueError(f"Unsupported targets payload: {magic!r}, version {version}")
+
+    offset = _HEADER.size
+    start_times = numpy.frombuffer(data, dtype='<f8', count=count, offset=offset)
+    offset += start_times.nbytes
+    speeds = numpy.frombuffer(data, dtype='<f4', count=count, offset=offset)
+    offset += speeds.nbytes
+    path_lengths = numpy.frombuffer(data, dtype='<u2', count=count, offset=offset).astype(numpy.int64)
+    offset += 2 * count
+
+    n_points = int(path_lengths.sum())
+    if len(data) != offset + 8 * n_points:
+        raise ValueError("Truncated targets payload")
+    deltas = numpy.frombuffer(data, dtype='<i4', count=2 * n_points, offset=offset).reshape(-1, 2).astype(numpy.int64)
+
+    # cumulative sum restarted at the first point of every path:
+    totals = numpy.cumsum(deltas, axis=0)
+    firsts = numpy.cumsum(path_lengths) - path_lengths
+    bases = (totals - deltas)[firsts[path_lengths > 0]]
+    coordinates = ((totals - numpy.repeat(bases, path_lengths[path_lengths > 0], axis=0)) / COORDINATE_SCALE).tolist()
+
+    targets = []
+    for start_time, speed, first, length in zip(start_times.tolist(), speeds.tolist(), firsts.tolist(), path_lengths.tolist()):
+        targets.append(Target(
+            start_time=start_time,
+            speed=speed,
+            path=[Point(latitude=lat, longitude=lon) for lat, lon in coordinates[first:first + length]]
+        ))
+
+    return targets
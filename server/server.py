@@ -14,25 +14,100 @@ Config file structure:
         "mongodb": {
             "url": "mongodb://localhost:21017",
             "db_name": "missilemap"
+        },
+        "cluster": {
+            "type": "file",
+            "path": "/tmp/missilemap"
+        },
+        "snapshot": {
+            "path": "/tmp/missilemap/snapshot.npz",
+            "interval": 10.0
+        },
+        "admission": {
+            "rate": 1.0,
+            "burst": 30,
+            "max_in_flight": 256,
+            "max_clients": 100000,
+            "priority": true,
+            "trusted_proxies": []
+        },
+        "analysis": {
+            "restarts": 4,
+            "n_jobs": -1,
+            "debounce": 0.1,
+            "max_latency": 1.0,
+            "window": null,
+            "sample_size": null,
+            "ring_capacity": null
         }
     }
+
+    "cluster" section is only required when running with multiple workers (uvicorn --workers N).
+    Cluster type is either "file" (workers on a single host sharing "path" directory) or "mongodb".
+    Workers must share the sightings storage as well, i.e. use "mongodb" db_type.
+
+    "snapshot" section is optional: analysis state is saved periodically and restored on startup.
+
+    "shards" section (see analysis_worker.py) switches the server to serve-only mode: the geo-sharded analysis
+    workers & the merger analyze the sightings, the server only serves the merged targets (requires "cluster").
+
+    "admission" section is optional (defaults are shown above): limits sightings rate per client (device or IP address)
+    and the number of concurrently processed requests. With "priority", /targets requests are never rejected.
+    "rate": null disables per-client limit (default in testing mode).
+    Clients are identified by IP address. Behind a reverse proxy / load balancer (App Engine, Cloud Run etc.)
+    "trusted_proxies" must list the networks the proxies connect from (e.g. ["10.0.0.0/8"]), so the client
+    address is taken from X-Forwarded-For instead of the proxy address. Client supplied headers are never trusted.
+
+    "analysis" section is optional: "restarts" independently seeded EM fits run on "n_jobs" processes (-1 - all cores)
+    and the best fit is used. Default: a single fit. A single worker analyzes sightings "debounce" seconds after
+    the last one was added, but no later than "max_latency" seconds after the first one (seconds, defaults shown above).
+    With "window" (seconds), only sightings within the trailing window are analyzed & older targets are kept as is.
+    With "sample_size", targets are fitted on a stratified sample of about that many sightings (faster, less accurate).
+    With "ring_capacity" (single worker only), added sightings are kept in a shared-memory ring of that many records
+    (see missilemap.ring) and the analysis reads them from the ring instead of querying the storage every round.
+
+Content negotiation:
+    GET /targets returns the compact binary format (see missilemap.wire) if the Accept header contains
+    "application/x-missilemap-targets", JSON otherwise. Responses are gzip-compressed for clients sending
+    "Accept-Encoding: gzip".
+
+Viewport queries:
+    GET /targets?bbox=<min longitude>,<min latitude>,<max longitude>,<max latitude>&horizon=<minutes>
+    returns only targets flying through the box now or within the horizon (default: 10 minutes).
+
+Predictions:
+    GET /targets/predictions returns target positions every 10 seconds for 10 minutes after the current target set
+    was produced: {"version", "start_time", "step", "positions": [[[latitude, longitude], ...] per target]}.
+    Targets are in the order of GET /targets (without bbox); "version" increases with every analysis run.
+    Positions more than 5 minutes before the start or after the end of a target path are [null, null].
 """
-from fastapi import FastAPI, status
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse
+import dataclasses
 import json
 import time
 import os
-from typing import List
+from typing import List, Optional
 
 
 from missilemap import Sighting, MissileMap, Target
+from missilemap.admission import AdmissionController
+from missilemap.cluster import get_cluster
+from missilemap.prediction import Predictions
+from missilemap.ring import SightingRing
 from missilemap.storage import get_storage
+from missilemap.user import User
+from missilemap.wire import MEDIA_TYPE, encode_targets
 
 
 CONFIG_NAME = 'MISSILEMAP_CONFIG'
 DEFAULT_DB_URL = 'mongodb://localhost:21017'
 DEFAULT_DB_NAME = 'missilemap'
 TESTING = False
+GZIP_MIN_SIZE = 1000            # responses smaller than this (bytes) are not compressed
+DEFAULT_HORIZON_MINUTES = 10.0  # default prediction horizon (minutes) for viewport queries
 
 # custom JSON encoders
 CUSTOM_ENCODER = {
@@ -62,6 +137,7 @@ app = FastAPI(
     title="MissileMap",
     description="MissileMap REST API server"
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
 
 # ======================
 # Initialize DB storage:
@@ -71,15 +147,91 @@ db_url = config.get('mongodb', {}).get('url', DEFAULT_DB_URL)
 db_name = config.get('mongodb', {}).get('db_name', DEFAULT_DB_NAME)
 storage = get_storage(db_type=db_type, url=db_url, database=db_name)  # odmantic object storage
 
+# ========================================
+# Initialize multi-worker synchronization:
+# ========================================
+lease, target_store = get_cluster(
+    cluster_type=config.get('cluster', {}).get('type'),
+    path=config.get('cluster', {}).get('path'),
+    url=db_url,
+    database=db_name
+)
+
 # ===================================
 # Initialize core application logic:
 # ===================================
 extra_args = {}
 if TESTING:
     extra_args['cleanup_interval'] = -1
+if 'shards' in config:
+    if target_store is None:
+        raise ValueError('"shards" requires a "cluster" section')
+    extra_args['serve_only'] = True
+    extra_args['target_store'] = target_store
+elif lease is not None:
+    extra_args['lease'] = lease
+    extra_args['target_store'] = target_store
+if 'analysis' in config:
+    extra_args['restarts'] = config['analysis'].get('restarts', 1)
+    extra_args['n_jobs'] = config['analysis'].get('n_jobs')
+    for name in ('debounce', 'max_latency', 'window', 'sample_size'):
+        if name in config['analysis']:
+            extra_args[f'analysis_{name}'] = config['analysis'][name]
+ring = None
+if config.get('analysis', {}).get('ring_capacity'):
+    if lease is not None:
+        raise ValueError('"ring_capacity" requires a single worker (no "cluster" section)')
+    ring = SightingRing.create(capacity=config['analysis']['ring_capacity'])
+    extra_args['ring'] = ring
+if 'snapshot' in config:
+    extra_args['snapshot_path'] = config['snapshot']['path']
+    if 'interval' in config['snapshot']:
+        extra_args['snapshot_interval'] = config['snapshot']['interval']
 
 core = MissileMap(storage=storage, **extra_args)
 
+# ==============================
+# Initialize admission control:
+# ==============================
+admission_config = config.get('admission', {})
+if TESTING and 'rate' not in admission_config:
+    admission_config = {**admission_config, 'rate': None}
+admission = AdmissionController(**admission_config)
+
+
+@app.on_event('shutdown')
+async def _shutdown():
+    """
+    Stop the services & release the shared memory of the sighting ring
+    """
+    await core.shutdown()
+    if ring is not None:
+        ring.close()
+
+
+@app.middleware('http')
+async def _admission_control(request: Request, call_next):
+    """
+    Shed requests that exceed per-client rate or the server capacity
+    """
+    if request.method == 'POST' and request.url.path == '/sightings':
+        key = admission.client_key(request.client.host if request.client else None, request.headers.get('x-forwarded-for'))
+        rejection = admission.enter_ingest(key)
+    else:
+        rejection = admission.enter_read()
+
+    if rejection is not None:
+        return JSONResponse(
+            status_code=rejection.status_code,
+            content={'detail': rejection.reason},
+            headers={'Retry-After': str(rejection.retry_after)}
+        )
+
+    try:
+        return await call_next(request)
+    finally:
+        admission.leave()
+
 
 # @app.get('/sightings')
 # async def _get_sightings():
@@ -111,19 +263,55 @@ if TESTING:
 
 
 @app.get('/targets')
-async def _get_targets() -> List[Target]:
+async def _get_targets(request: Request, response: Response, bbox: Optional[str] = None, horizon: float = DEFAULT_HORIZON_MINUTES,
+                       timestamp: Optional[float] = None) -> List[Target]:
     """
-    Get list of currently identified targets
+    Get list of currently identified targets (as JSON or in the binary format, depending on the Accept header)
+
+    :param bbox: (optional) viewport "min_lon,min_lat,max_lon,max_lat": only targets flying through it are returned
+    :param horizon: prediction horizon (minutes) for the viewport
+    :param timestamp: (optional) start time of the viewport query (default: now)
     """
-    return jsonable_encoder(await core.list_targets(), custom_encoder=CUSTOM_ENCODER)
+    if bbox is None:
+        targets = await core.list_targets()
+    else:
+        try:
+            min_lon, min_lat, max_lon, max_lat = map(float, bbox.split(','))
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail='bbox must be "min_lon,min_lat,max_lon,max_lat"')
+        targets = await core.list_targets(bbox=(min_lon, min_lat, max_lon, max_lat), horizon=horizon * 60, timestamp=timestamp)
 
+    # the representation depends on the Accept header: caches must not serve one to clients asking for the other
+    if MEDIA_TYPE in request.headers.get('accept', ''):
+        return Response(content=encode_targets(targets), media_type=MEDIA_TYPE, headers={'Vary': 'Accept'})
+    response.headers['Vary'] = 'Accept'
+    return jsonable_encoder(targets, custom_encoder=CUSTOM_ENCODER)
 
-# @app.post('/register')
-# async def _register_user(user):
-#     """
-#     Called to register a new user
-#
-#     :param user:
-#     :return:
-#     """
-#     pass
+
+@app.get('/targets/predictions')
+async def _get_predictions() -> dict:
+    """
+    Get predicted positions of currently identified targets
+    """
+    return Predictions.json_encoder(await core.get_predictions())
+
+
+@app.get('/metrics')
+async def _get_metrics() -> dict:
+    """
+    Get server metrics
+    """
+    return {
+        'admission': dataclasses.asdict(admission.stats),
+        'services': {name: dataclasses.asdict(stats) for name, stats in core.service_stats().items()}
+    }
+
+
+@app.post('/register', status_code=status.HTTP_201_CREATED)
+async def _register_user(user: User) -> User:
+    """
+    Called to register a new user: the user is alerted about targets approaching the user's location
+
+    :param user: user object (location)
+    """
+    return await core.register_user(user)
@@ -1,17 +1,74 @@
 """
 Plotting support using bokeh & Jupyter
+
+Sightings (with their bearing arrows) and paths are converted to columns with vectorized numpy code and
+rendered from a single ColumnDataSource each, so figures stay interactive with 100k+ sightings.
+SightingAnimation updates a figure incrementally over simulation time (ColumnDataSource stream & patch)
+instead of rebuilding it for every time step.
 """
-from bokeh.models import GMapOptions
-from bokeh.plotting import gmap, GMap
-from geopy import Point
-from geopy.distance import distance
 import math
 import os
-import pandas
-from typing import Sequence, Tuple, Union
+from typing import Dict, Mapping, Sequence, Tuple, Union
+
+from bokeh.models import ColumnDataSource, GMapOptions
+from bokeh.plotting import gmap, GMap
+from geopy import Point
+import numpy
+
+from missilemap import Sighting, Target
+from missilemap.prediction import predict_positions
+from missilemap.utils import METERS_PER_DEGREE
+
+ARROW_LENGTH = 2000.0  # bearing arrow length (meters)
 
+Sightings = Union[Sequence[Sighting], Mapping[str, Sequence[float]]]
 
-from missilemap import Sighting
+
+def sighting_columns(sightings: Sightings, arrow_length: float = ARROW_LENGTH) -> Dict[str, numpy.ndarray]:
+    """
+    Convert sightings to plot columns: location (x, y), bearing arrow head (x_end, y_end) & timestamp
+
+    :param sightings: list of sightings (or records) or a mapping of columns: timestamp, latitude, longitude, bearing
+        (e.g. SightingTable.columns())
+    :param arrow_length: bearing arrow length (meters)
+    :return: dict of float arrays
+    """
+    if isinstance(sightings, Mapping):
+        columns = {name: numpy.asarray(sightings[name], dtype=float) for name in ('timestamp', 'latitude', 'longitude', 'bearing')}
+    else:
+        columns = {
+            name: numpy.fromiter((getattr(s, name) for s in sightings), dtype=float, count=len(sightings))
+            for name in ('timestamp', 'latitude', 'longitude', 'bearing')
+        }
+
+    # arrows are short: a local planar approximation is accurate enough
+    latitudes, longitudes, bearings = columns['latitude'], columns['longitude'], columns['bearing']
+    y_end = latitudes + arrow_length * numpy.cos(bearings) / METERS_PER_DEGREE
+    x_end = longitudes + arrow_length * numpy.sin(bearings) / (METERS_PER_DEGREE * numpy.cos(numpy.radians(latitudes)))
+
+    return {'x': longitudes, 'y': latitudes, 'x_end': x_end, 'y_end': y_end, 'timestamp': columns['timestamp']}
+
+
+def path_columns(paths: Sequence[Sequence[Union[Point, Tuple[float, float]]]]) -> Dict[str, numpy.ndarray]:
+    """
+    Convert paths to plot columns of their segments: (x0, y0) - (x1, y1) & path index per segment
+
+    :param paths: list of paths where each path is a sequence of points [(latitude, longitude), ...]
+    :return: dict of arrays
+    """
+    lengths = numpy.array([len(path) for path in paths], dtype=numpy.int64)
+    points = numpy.array([(p[0], p[1]) for path in paths for p in path], dtype=float).reshape(-1, 2)
+
+    # drop the segments between the last point of a path & the first point of the next one:
+    segments = numpy.ones(max(len(points) - 1, 0), dtype=bool)
+    last_points = numpy.cumsum(lengths) - 1
+    segments[last_points[(last_points >= 0) & (last_points < len(segments))]] = False
+    starts, ends = points[:-1][segments], points[1:][segments]
+
+    return {
+        'x0': starts[:, 1], 'y0': starts[:, 0], 'x1': ends[:, 1], 'y1': ends[:, 0],
+        'path': numpy.repeat(numpy.arange(len(paths)), numpy.maximum(lengths - 1, 0))
+    }
 
 
 def render_path(figure: GMap, path: Sequence[Union[Point, Tuple[float, float]]], line_color='blue', line_width=2, line_alpha=0.8):
@@ -24,22 +81,63 @@ def render_path(figure: GMap, path: Sequence[Union[Point, Tuple[float, float]]],
     :param line_width: line width (default: 2.0)
     :param line_alpha: line alpha controlling transparency (default: 0.8)
     """
-    x_start = []
-    y_start = []
-    x_end = []
-    y_end = []
+    render_paths(figure, [path], line_color=line_color, line_width=line_width, line_alpha=line_alpha)
+
+
+def render_paths(figure: GMap, paths: Sequence[Sequence[Union[Point, Tuple[float, float]]]], line_color='blue', line_width=2,
+                 line_alpha=0.8) -> ColumnDataSource:
+    """
+    Render specified paths on the map chart (a single glyph for all paths)
+
+    :param figure: GMap object
+    :param paths: list of paths where each path is a sequence of points [(latitude, longitude), ...]
+    :param line_color: line color (default: blue)
+    :param line_width: line width (default: 2.0)
+    :param line_alpha: line alpha controlling transparency (default: 0.8)
+    :return: data source of the path segments
+    """
+    source = ColumnDataSource(data=path_columns(paths))
+    figure.segment(x0='x0', y0='y0', x1='x1', y1='y1', source=source, line_color=line_color, line_width=line_width, line_alpha=line_alpha)
+    return source
+
+
+def render_sightings(figure: GMap, sightings: Sightings, sighting_size=10) -> ColumnDataSource:
+    """
+    Render sightings with their bearing arrows on the map chart (a single data source for points & arrows)
+
+    :param figure: GMap object
+    :param sightings: sightings (see sighting_columns())
+    :param sighting_size: circle size for sightings in pixels
+    :return: data source of the sightings
+    """
+    source = ColumnDataSource(data=sighting_columns(sightings))
+    _draw_sightings(figure, source, sighting_size)
+    return source
+
+
+def _draw_sightings(figure: GMap, source: ColumnDataSource, sighting_size):
+    """
+    Add sighting points & bearing arrows glyphs for a data source of sighting columns
+    """
+    figure.scatter(x='x', y='y', source=source, marker='circle', size=sighting_size, fill_color="red", fill_alpha=0.7, line_color=None)
+    figure.segment(x0='x', y0='y', x1='x_end', y1='y_end', source=source, line_color='red', line_width=1)
 
-    for s, e in zip(path[:-1], path[1:]):
-        x_start.append(s[1])
-        y_start.append(s[0])
-        x_end.append(e[1])
-        y_end.append(e[0])
 
-    figure.segment(x0=x_start, y0=y_start, x1=x_end, y1=y_end, line_color=line_color, line_width=line_width, line_alpha=line_alpha)
+def map_figure(location, zoom=6, plot_width=1400, plot_height=800, api_key: str = None, title=None) -> GMap:
+    """
+    Create an empty map figure (see render())
+    """
+    if api_key is None:
+        if 'MAPS_API_KEY' not in os.environ:
+            raise Exception("MAPS_API_KEY environment variable must be defined or api_key= explicitly specified")
+        api_key = os.environ['MAPS_API_KEY']
+
+    gmap_options = GMapOptions(lat=location[0], lng=location[1], map_type='roadmap', zoom=zoom)
+    return gmap(api_key, gmap_options, title=title, width=plot_width, height=plot_height)
 
 
 def render(location, zoom=6, plot_width=1400, plot_height=800, api_key: str = None, title=None,
-           sightings: Sequence[Sighting] = None, sighting_size=10,
+           sightings: Sightings = None, sighting_size=10,
            paths: Sequence[Sequence[Tuple[float, float]]] = None
            ) -> GMap:
     """
@@ -51,63 +149,78 @@ def render(location, zoom=6, plot_width=1400, plot_height=800, api_key: str = No
     :param plot_height: (optional) plot height in pixels
     :param api_key: Google Maps API key with JavaScript support enabled
     :param title: (optional) figure title
-    :param sightings: (optional) list of sightings to display
+    :param sightings: (optional) list of sightings to display (or a mapping of columns, see sighting_columns())
     :param sighting_size: (optional) circle size for sightings in pixels (default: 10)
     :param paths: (optional) list of paths where each path is a sequence of points [(latitude, longitude), ...]
 
     :return: bokeh.Figure
     """
-    if api_key is None:
-        if 'MAPS_API_KEY' not in os.environ:
-            raise Exception("MAPS_API_KEY environment variable must be defined or api_key= explicitly specified")
-        api_key = os.environ['MAPS_API_KEY']
-
-    gmap_options = GMapOptions(lat=location[0], lng=location[1], map_type='roadmap', zoom=zoom)
-    figure = gmap(api_key, gmap_options, title=title, width=plot_width, height=plot_height)
+    figure = map_figure(location, zoom=zoom, plot_width=plot_width, plot_height=plot_height, api_key=api_key, title=title)
 
     if sightings is not None and len(sightings):
-        # render sighting points:
-        figure.circle(
-            x=[s.longitude for s in sightings],
-            y=[s.latitude for s in sightings],
-            size=sighting_size, fill_color="red", fill_alpha=0.7, line_color=None)
-
-        arrows = []
-        for s in sightings:
-            head = distance(kilometers=2).destination((s.latitude, s.longitude),
-                                                      bearing=math.degrees(s.bearing if s.bearing > 0 else s.bearing + 2 * math.pi))
-            arrows.append({
-                'x_start': s.longitude,
-                'y_start': s.latitude,
-                'x_end': head[1],
-                'y_end': head[0]
-            })
-
-            # render arrows (NOTE: adding Arrow did not work for some reason)
-            # for arrow in arrows:
-            #     p.add_layout(Arrow(
-            #         x_start=arrow['x_start'],
-            #         start_units='data', end_units='data',
-            #         y_start=arrow['y_start'],
-            #         x_end=arrow['x_end'],
-            #         y_end=arrow['y_end'],
-            #         line_color='red',
-            #         line_width=2
-            #     ))
-
-        arrows = pandas.DataFrame(arrows)
-        figure.segment(
-            x0=arrows['x_start'].values,
-            y0=arrows['y_start'].values,
-            x1=arrows['x_end'].values,
-            y1=arrows['y_end'].values,
-            line_color='red',
-            line_width=1
-        )
+        render_sightings(figure, sightings, sighting_size=sighting_size)
 
     if paths is not None and len(paths):
         # render specified paths as segments
-        for path in paths:
-            render_path(figure, path)
+        render_paths(figure, paths)
 
     return figure
+
+
+class SightingAnimation:
+    """
+    Incrementally updated map of a simulation over time.
+
+    Sightings are converted to columns once (sorted by time). Moving to a later time streams only the newly
+    visible sightings to the figure, target markers are patched in place. Moving back in time resets the sightings.
+
+    Usage in a notebook::
+
+        animation = simulator.animate()
+        handle = bokeh.io.show(animation.figure, notebook_handle=True)
+        for timestamp in range(0, 3600, 10):
+            animation.update(timestamp)
+            bokeh.io.push_notebook(handle=handle)
+    """
+
+    def __init__(self, figure: GMap, sightings: Sightings, targets: Sequence[Target] = (), sighting_size=10, target_size=14):
+        """
+        :param figure: map figure (see map_figure())
+        :param sightings: all sightings of the simulation (see sighting_columns())
+        :param targets: (optional) targets to show moving along their paths
+        :param sighting_size: circle size for sightings in pixels
+        :param target_size: marker size for targets in pixels
+        """
+        columns = sighting_columns(sightings)
+        order = numpy.argsort(columns['timestamp'], kind='stable')
+        self._columns = {name: values[order] for name, values in columns.items()}
+        self._targets = list(targets)
+        self._visible = 0
+        self.figure = figure
+        self.timestamp = -math.inf
+
+        self.sightings = ColumnDataSource(data={name: values[:0] for name, values in self._columns.items()})
+        _draw_sightings(figure, self.sightings, sighting_size)
+        self.positions = ColumnDataSource(data={'x': numpy.full(len(self._targets), numpy.nan), 'y': numpy.full(len(self._targets), numpy.nan)})
+        figure.scatter(x='x', y='y', source=self.positions, marker='triangle', size=target_size, fill_color='blue', line_color=None)
+
+    def update(self, timestamp: float):
+        """
+        Show sightings reported up to the timestamp & current target positions
+
+        :param timestamp: simulation time (seconds)
+        """
+        visible = int(self._columns['timestamp'].searchsorted(timestamp, side='right'))
+        if timestamp < self.timestamp:
+            self.sightings.data = {name: values[:visible] for name, values in self._columns.items()}
+        elif visible > self._visible:
+            self.sightings.stream({name: values[self._visible:visible] for name, values in self._columns.items()})
+        self._visible = visible
+        self.timestamp = timestamp
+
+        if self._targets:
+            # targets are shown only while flying their paths:
+            positions = predict_positions(self._targets, [timestamp])[:, 0, :]
+            flying = numpy.array([t.start_time <= timestamp <= t.end_time for t in self._targets], dtype=bool)
+            positions[~flying] = numpy.nan
+            self.positions.patch({'x': [(slice(None), positions[:, 1])], 'y': [(slice(None), positions[:, 0])]})
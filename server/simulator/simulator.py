@@ -18,7 +18,7 @@ from missilemap.analysis import expectation_maximization
 from missilemap.definitions import Target
 from missilemap.utils import closest_point, get_bearing, normalize_bearing, interpolate
 
-from .plotting import render
+from .plotting import map_figure, render, render_paths, SightingAnimation
 
 
 def random_sighting(location: Point, distance: float, azimuth: float) -> Sighting:
@@ -243,3 +243,17 @@ class Simulator:
             sightings=sightings,
             paths=[[(p.latitude, p.longitude) for p in target.path] for target in self.targets]
         )
+
+    def animate(self, plot_width=1400, plot_height=800) -> SightingAnimation:
+        """
+        Render the simulation over a map for incremental updates over time (see SightingAnimation).
+
+        :param plot_width: (optional) figure width (pixels, default=1400)
+        :param plot_height: (optional) figure height (pixels, default=800)
+
+        :return: SightingAnimation, call update(timestamp) to advance it
+        """
+        figure = map_figure(location=self.field.center, plot_width=plot_width, plot_height=plot_height)
+        animation = SightingAnimation(figure, self.sightings, targets=self.targets)
+        render_paths(figure, [[(p.latitude, p.longitude) for p in target.path] for target in self.targets], line_alpha=0.3)
+        return animation
@@ -0,0 +1,88 @@
+"""
+Test admission control
+"""
+from unittest import TestCase
+
+from missilemap.admission import AdmissionController, TokenBuckets
+
+
+class TestAdmission(TestCase):
+
+    def test_token_buckets(self):
+        """
+        Tokens are consumed per client & refilled with the specified rate
+        """
+        buckets = TokenBuckets(rate=2.0, burst=3, capacity=4)
+
+        self.assertListEqual([0.0, 0.0, 0.0], [buckets.take('a', now=0.0) for _ in range(3)])
+        self.assertAlmostEqual(0.5, buckets.take('a', now=0.0))
+        self.assertEqual(0.0, buckets.take('b', now=0.0))  # other clients are not affected
+        self.assertEqual(0.0, buckets.take('a', now=0.5))  # refilled one token
+        self.assertAlmostEqual(0.25, buckets.take('a', now=0.75))
+
+    def test_bucket_eviction(self):
+        """
+        Number of tracked clients is bounded
+        """
+        buckets = TokenBuckets(rate=1.0, burst=2, capacity=8)
+        for i in range(100):
+            self.assertEqual(0.0, buckets.take(i, now=i * 0.01))
+            self.assertLessEqual(len(buckets), 8)
+
+        # recently seen clients are kept:
+        buckets.take(99, now=1.0)
+        self.assertGreater(buckets.take(99, now=1.0), 0.0)
+
+    def test_admission(self):
+        """
+        Test rate limiting, in-flight cap & priority of read requests
+        """
+        controller = AdmissionController(rate=1.0, burst=1, max_in_flight=2)
+
+        self.assertIsNone(controller.enter_ingest('a', now=0.0))
+        rejection = controller.enter_ingest('a', now=0.0)
+        self.assertEqual(429, rejection.status_code)
+        self.assertEqual(1, rejection.retry_after)
+
+        self.assertIsNone(controller.enter_ingest('b', now=0.0))
+        rejection = controller.enter_ingest('c', now=0.0)
+        self.assertEqual(503, rejection.status_code)
+
+        # reads are still served:
+        self.assertIsNone(controller.enter_read())
+        controller.leave()
+
+        controller.leave()
+        self.assertIsNone(controller.enter_ingest('c', now=0.0))
+
+        stats = controller.stats
+        self.assertEqual(3, stats.admitted)
+        self.assertEqual(1, stats.rate_limited)
+        self.assertEqual(1, stats.overloaded)
+        self.assertEqual(2, stats.in_flight)
+        self.assertEqual(3, stats.clients)
+
+        # without priority, reads are shed as well:
+        controller = AdmissionController(rate=None, max_in_flight=1, priority=False)
+        self.assertIsNone(controller.enter_ingest('a'))
+        self.assertEqual(503, controller.enter_read().status_code)
+
+    def test_client_key(self):
+        """
+        Client address is taken from X-Forwarded-For entries appended by trusted proxies only
+        """
+        controller = AdmissionController(trusted_proxies=['10.0.0.0/8'])
+
+        # direct connection: forwarded header is ignored
+        self.assertEqual('1.2.3.4', controller.client_key('1.2.3.4', '5.6.7.8'))
+
+        # behind the proxy:
+        self.assertEqual('5.6.7.8', controller.client_key('10.1.1.1', '5.6.7.8'))
+        self.assertEqual('5.6.7.8', controller.client_key('10.1.1.1', '5.6.7.8, 10.2.2.2'))
+
+        # entries prepended by the client are not used:
+        self.assertEqual('5.6.7.8', controller.client_key('10.1.1.1', 'spoofed, 9.9.9.9, 5.6.7.8'))
+
+        # no trusted proxies:
+        self.assertEqual('10.1.1.1', AdmissionController().client_key('10.1.1.1', '5.6.7.8'))
+        self.assertIsNone(controller.client_key(None, '5.6.7.8'))
@@ -0,0 +1,96 @@
+"""
+Test subscriber alerts
+"""
+import random
+from unittest import TestCase
+
+from bson import ObjectId
+from geopy import Point
+import numpy
+
+from missilemap import Target
+from missilemap.alerts import Alert, AlertCooldown, SubscriptionIndex, fan_out
+from missilemap.definitions import TargetSet
+from missilemap.prediction import predict
+from missilemap.utils import to_local_xy
+
+
+class TestAlerts(TestCase):
+
+    def test_subscription_index(self):
+        """
+        Subscribers are found by cell, moved & removed
+        """
+        index = SubscriptionIndex(cell_size=0.1)
+        user_id = ObjectId()
+        index.add(user_id, 48.05, 30.05)
+        self.assertEqual(1, len(index))
+        self.assertSetEqual({user_id}, index.subscribers(index.cell(48.01, 30.09)))
+
+        index.add(user_id, 49.05, 30.05)
+        self.assertEqual(1, len(index))
+        self.assertSetEqual(set(), index.subscribers(index.cell(48.05, 30.05)))
+        self.assertSetEqual({user_id}, index.subscribers(index.cell(49.05, 30.05)))
+
+        self.assertTrue(index.remove(user_id))
+        self.assertFalse(index.remove(user_id))
+        self.assertEqual(0, len(index))
+
+    def test_fan_out(self):
+        """
+        Subscribers close to predicted paths are alerted, distant subscribers are not
+        """
+        r = random.Random(12345)
+        targets = []
+        for _ in range(10):
+            start = Point(r.uniform(46.0, 50.0), r.uniform(26.0, 36.0))
+            end = Point(start.latitude + r.uniform(-1.0, 1.0), start.longitude + r.uniform(-1.5, 1.5))
+            targets.append(Target(start_time=r.uniform(0, 600), path=[start, end]))
+
+        predictions = predict(TargetSet(version=1, timestamp=300.0, targets=tuple(targets)))
+        index = SubscriptionIndex(cell_size=0.05)
+        users = {}
+        for _ in range(500):
+            user_id = ObjectId()
+            users[user_id] = Point(r.uniform(45.0, 51.0), r.uniform(24.0, 38.0))
+            index.add(user_id, users[user_id].latitude, users[user_id].longitude)
+
+        alerts = fan_out(predictions, [t.end_time for t in targets], index, radius=10000, max_extrapolation=300)
+        alerted = {(a.user_id, a.target) for a in alerts}
+        self.assertEqual(len(alerts), len(alerted))
+        self.assertTrue(alerted)
+
+        # brute force: distance from every user to every predicted position (local projection around the target start)
+        user_ids = list(users)
+        for idx, target in enumerate(targets):
+            samples = predictions.positions[idx][predictions.times <= target.end_time + 300]
+            origin = (target.start_location.latitude, target.start_location.longitude)
+            x, y = to_local_xy(samples[:, 0], samples[:, 1], origin=origin)
+            ux, uy = to_local_xy([users[u].latitude for u in user_ids], [users[u].longitude for u in user_ids], origin=origin)
+            closest = numpy.hypot(ux[:, None] - x[None, :], uy[:, None] - y[None, :]).min(axis=1)
+            for user_id, d in zip(user_ids, closest.tolist()):
+                if d < 10000:
+                    self.assertIn((user_id, idx), alerted)
+                elif d > 30000:
+                    self.assertNotIn((user_id, idx), alerted)
+
+        for alert in alerts:
+            self.assertEqual(1, alert.version)
+            self.assertTrue(predictions.start_time <= alert.eta <= predictions.times[-1])
+
+    def test_cooldown(self):
+        """
+        Repeated alerts about the same target are suppressed, alerts about other targets are not
+        """
+        cooldown = AlertCooldown(cooldown=60, eta_tolerance=30)
+        user_id = ObjectId()
+        first = Alert(user_id=user_id, version=1, target=0, eta=1100.0)
+        self.assertListEqual([first], cooldown.filter([first], now=1000.0))
+
+        # the same target in the next generation (different index, about the same eta) & another target:
+        repeated = Alert(user_id=user_id, version=2, target=1, eta=1105.0)
+        other = Alert(user_id=user_id, version=2, target=0, eta=1300.0)
+        self.assertListEqual([other], cooldown.filter([repeated, other], now=1001.0))
+
+        # after the cooldown the alert is repeated:
+        self.assertListEqual([repeated], cooldown.filter([repeated], now=1070.0))
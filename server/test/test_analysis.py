@@ -1,14 +1,21 @@
 """
 Test for analysis code
 """
+import math
 import random
+import time
 from unittest import TestCase
 
 import numpy
 from geopy import Point
 
-from missilemap import Target
-from missilemap.analysis import expectation_maximization, sightings_to_targets
+from missilemap import Sighting, Target
+from missilemap.analysis import (
+    _estimate_segment, _score, analyze_sightings, analyze_window, expectation_maximization, MAX_DISTANCE, multi_restart_em, propose_segments,
+    sightings_to_targets, update_analysis
+)
+from missilemap.coalesce import coalesce_sightings, stratified_sample
+from missilemap.linking import link_segments
 from simulator import Observer, random_location, Simulator
 
 
@@ -37,10 +44,333 @@ class TestAnalysis(TestCase):
         proj = expectation_maximization(
             sightings=sim.sightings,
             n_segments=len(path) - 1,
-            iterations=100
+            iterations=100,
+            random_state=0
         )
 
-        # expected to reconstruct the original segments with 10 sightings per segment
+        # expected to reconstruct the original segments with 10 sightings per segment (in any order)
         res = sightings_to_targets(sightings=sim.sightings, targets=proj)
         counts = numpy.bincount(res)
-        self.assertListEqual(list(counts), [9, 10, 11])
+        self.assertListEqual(sorted(counts.tolist()), [9, 10, 11])
+
+    def test_coalesce(self):
+        """
+        Near-duplicate sightings are merged into weighted representatives
+        """
+        r = random.Random(12345)
+
+        sightings = []
+        for i in range(10):
+            # 5 reports of the same target from approximately the same location:
+            for _ in range(5):
+                sightings.append(Sighting(
+                    timestamp=60 * i + r.randint(0, 4),
+                    latitude=48.0 + 0.1 * i + r.uniform(-0.0005, 0.0005),
+                    longitude=32.0 + 0.1 * i + r.uniform(-0.0005, 0.0005),
+                    bearing=r.uniform(-0.1, 0.1)
+                ))
+
+        representatives, weights, groups = coalesce_sightings(sightings)
+
+        self.assertLessEqual(len(representatives), 25)
+        self.assertEqual(len(sightings), weights.sum())
+        self.assertEqual(len(sightings), len(groups))
+        for s, g in zip(sightings, groups):
+            self.assertLess(abs(s.latitude - representatives[g].latitude), 0.01)
+
+        # weighted estimate from representatives is close to the estimate from all sightings:
+        expected = _estimate_segment(sightings)
+        estimated = _estimate_segment(representatives, weights)
+        self.assertAlmostEqual(expected.speed, estimated.speed, delta=0.01 * expected.speed)
+        for p1, p2 in zip(expected.path, estimated.path):
+            self.assertAlmostEqual(p1.latitude, p2.latitude, places=2)
+            self.assertAlmostEqual(p1.longitude, p2.longitude, places=2)
+
+    def test_propose_segments(self):
+        """
+        RANSAC proposals recover crossing straight-line targets & skip excluded sightings
+        """
+        r = random.Random(12345)
+
+        sightings = []
+        for i in range(20):
+            # two targets crossing at t=600 (one moving north-east, the other south-east) + noise:
+            sightings.append(Sighting(timestamp=60 * i, latitude=48.0 + 0.1 * i + r.uniform(-0.01, 0.01), longitude=32.0 + 0.1 * i, bearing=0.6))
+            sightings.append(Sighting(timestamp=60 * i, latitude=50.0 - 0.1 * i + r.uniform(-0.01, 0.01), longitude=32.0 + 0.1 * i, bearing=2.5))
+
+        proposals = propose_segments(sightings, 2, random_state=0)
+        self.assertEqual(2, len(proposals))
+        assignment = sightings_to_targets(sightings, proposals, with_distance=True)
+        self.assertTrue(all(d < MAX_DISTANCE for _, d in assignment))
+        self.assertEqual(2, len(set(a[0] for a in assignment)))
+
+        # reproducible with the same seed:
+        self.assertEqual([t.to_json() for t in proposals], [t.to_json() for t in propose_segments(sightings, 2, random_state=0)])
+
+        # excluded sightings are not proposed again:
+        exclude = [i % 2 == 0 for i in range(len(sightings))]
+        proposals = propose_segments(sightings, 2, exclude=exclude, random_state=0)
+        self.assertEqual(1, len(proposals))
+        self.assertTrue(all(d < MAX_DISTANCE for _, d in sightings_to_targets(sightings[1::2], proposals, with_distance=True)))
+
+    def test_link_segments(self):
+        """
+        Segments of a turning target are linked into a single multi-segment target
+        """
+        r = random.Random(12345)
+
+        path = [
+            Point(45.361285195897885, 33.90794799044153),
+            Point(47.487079766379715, 33.081535775384715),
+            Point(49.47728424495352, 27.901909920451157),
+            Point(49.83269083681804, 24.09401307480089)
+        ]
+
+        observers = []
+        for p_from, p_to in zip(path[:-1], path[1:]):
+            for _ in range(10):
+                observers.append(Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000))
+
+        sim = Simulator(targets=[Target(path=path)], observers=observers, random=r)
+
+        targets, assignment = analyze_sightings(sim.sightings, with_assignment=True)
+        self.assertEqual(1, len(targets))
+        self.assertGreater(len(targets[0].path), 2)
+        self.assertListEqual([0] * len(sim.sightings), assignment)
+        self.assertTrue(all(d < MAX_DISTANCE for _, d in sightings_to_targets(sim.sightings, targets, with_distance=True)))
+
+        # segments with different speeds or far apart are not linked:
+        first = Target(start_time=0, path=[Point(48.0, 32.0), Point(48.5, 32.0)])
+        slow = Target(start_time=first.end_time + 60, speed=first.speed / 2, path=[Point(48.62, 32.0), Point(49.0, 32.0)])
+        far = Target(start_time=first.end_time + 60, path=[Point(48.62, 34.0), Point(49.0, 34.0)])
+        close = Target(start_time=first.end_time + 60, path=[Point(48.62, 32.0), Point(49.0, 32.0)])
+
+        self.assertEqual(2, len(link_segments([first, slow])[0]))
+        self.assertEqual(2, len(link_segments([first, far])[0]))
+        linked, mapping = link_segments([close, far, first])
+        self.assertEqual(2, len(linked))
+        self.assertEqual(mapping[0], mapping[2])
+        self.assertNotEqual(mapping[0], mapping[1])
+        self.assertEqual(first.start_time, linked[mapping[0]].start_time)
+        self.assertAlmostEqual(close.end_time, linked[mapping[0]].end_time)
+
+    def test_window(self):
+        """
+        Windowed analysis keeps older targets & stitches tracks across window boundaries
+        """
+        r = random.Random(12345)
+
+        path = [
+            Point(45.361285195897885, 33.90794799044153),
+            Point(47.487079766379715, 33.081535775384715),
+            Point(49.47728424495352, 27.901909920451157),
+            Point(49.83269083681804, 24.09401307480089)
+        ]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(10)
+        ]
+        target = Target(path=path)
+        sightings = sorted(Simulator(targets=[target], observers=observers, random=r).sightings, key=lambda s: s.timestamp)
+        far = Target(start_time=-3600, path=[Point(44.0, 22.0), Point(45.0, 22.0)])
+
+        targets = [far]
+        for end in range(600, round(target.end_time) + 600, 600):
+            window_start = end - 900
+            analyzed = [s for s in sightings if s.timestamp < end]
+            targets, assignment = analyze_window(analyzed, targets, window_start, with_assignment=True, random_state=0)
+
+            # frozen target is kept, the track is a single target (sightings before the window might be re-assigned):
+            self.assertEqual(2, len(targets))
+            self.assertIs(far, targets[0])
+            self.assertTrue(all(a == 1 if s.timestamp >= window_start else a in (-1, 1) for s, a in zip(analyzed, assignment)))
+
+        # junctions are smoothed out: the path does not grow with every window
+        self.assertLessEqual(len(targets[1].path), 2 * len(path))
+        self.assertAlmostEqual(sightings[0].timestamp, targets[1].start_time, delta=60)
+        self.assertTrue(all(d < MAX_DISTANCE for _, d in sightings_to_targets(sightings, targets[1:], with_distance=True)))
+
+    def test_gating(self):
+        """
+        Assignment uses the reported bearing to choose between crossing targets & implausible speeds are rejected
+        """
+        north = Target(start_time=0, path=[Point(48.0, 32.0), Point(49.0, 32.0)])
+        east = Target(start_time=0, path=[Point(48.5, 31.25), Point(48.5, 32.75)])
+
+        # both targets pass (almost) the same point at the same time:
+        crossing = north.at_time(north.end_time / 2)
+        sightings = [
+            Sighting(timestamp=round(north.end_time / 2), latitude=crossing.latitude, longitude=crossing.longitude, bearing=b)
+            for b in (0.0, math.pi / 2)
+        ]
+        self.assertListEqual([0, 1], sightings_to_targets(sightings, [north, east]))
+        self.assertListEqual([1, 0], sightings_to_targets(sightings, [east, north]))
+
+        # without gating, the closest target is chosen regardless of the bearing:
+        ungated = sightings_to_targets(sightings, [north, east], bearing_tolerance=None)
+        self.assertEqual(ungated[0], ungated[1])
+
+        # slow target (~100 m/sec) is not plausible:
+        slow = [Sighting(timestamp=60 * i, latitude=48.0 + 0.054 * i, longitude=32.0, bearing=0.0) for i in range(10)]
+        self.assertListEqual([], propose_segments(slow, 1, random_state=0))
+        self.assertEqual(1, len(propose_segments(slow, 1, speed_range=None, random_state=0)))
+        self.assertEqual(1, len(analyze_sightings(slow, speed_range=None)))
+
+    def test_deadline(self):
+        """
+        Analysis stops at the deadline & returns the best solution found so far
+        """
+        r = random.Random(12345)
+
+        paths = [
+            [Point(45.361285195897885, 33.90794799044153), Point(47.487079766379715, 33.081535775384715),
+             Point(49.47728424495352, 27.901909920451157)],
+            [Point(45.361285195897885, 33.90794799044153), Point(49.3, 33.081535775384715), Point(50.3, 28.3)]
+        ]
+
+        observers = []
+        for path in paths:
+            for p_from, p_to in zip(path[:-1], path[1:]):
+                for _ in range(10):
+                    observers.append(Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000))
+
+        sim = Simulator(targets=[Target(path=path, start_time=30 * i) for i, path in enumerate(paths)], observers=observers, random=r)
+
+        targets, assignment, converged = analyze_sightings(sim.sightings, with_assignment=True, with_converged=True)
+        self.assertTrue(converged)
+
+        start = time.monotonic()
+        targets, assignment, converged = analyze_sightings(sim.sightings, with_assignment=True, with_converged=True, deadline=start)
+        self.assertFalse(converged)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertGreater(len(targets), 0)
+        self.assertEqual(len(sim.sightings), len(assignment))
+
+        targets, converged = expectation_maximization(sim.sightings, 4, random_state=0, deadline=start, with_converged=True)
+        self.assertFalse(converged)
+        self.assertEqual(4, len(targets))
+
+        # budgeted rounds continue from the previous best targets: the result never gets worse & eventually converges
+        unexplained = _score(sim.sightings, targets)[0]
+        for _ in range(20):
+            targets, converged = analyze_sightings(sim.sightings, with_converged=True, deadline=time.monotonic() + 0.2, initial=targets)
+            self.assertLessEqual(_score(sim.sightings, targets)[0], unexplained)
+            unexplained = _score(sim.sightings, targets)[0]
+            if converged:
+                break
+        self.assertTrue(converged)
+        self.assertEqual(0, unexplained)
+
+    def test_multi_restart(self):
+        """
+        The best of several EM fits is selected
+        """
+        r = random.Random(12345)
+
+        path = [
+            Point(45.361285195897885, 33.90794799044153),
+            Point(47.487079766379715, 33.081535775384715),
+            Point(49.47728424495352, 27.901909920451157)
+        ]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(10)
+        ]
+        sightings = Simulator(targets=[Target(path=path)], observers=observers, random=r).sightings
+
+        # single segment can't explain a turn: all fits run, the best one is selected
+        targets = multi_restart_em(sightings, 1, restarts=3, n_jobs=1, random_state=0)
+        seeds = numpy.random.SeedSequence(0).spawn(3)
+        scores = [_score(sightings, expectation_maximization(sightings, 1, random_state=seed)) for seed in seeds]
+        self.assertEqual(min(scores), _score(sightings, targets))
+
+        # parallel fits:
+        targets, converged = multi_restart_em(sightings, 2, restarts=2, n_jobs=2, random_state=0, with_converged=True)
+        self.assertTrue(converged)
+        self.assertEqual(0, _score(sightings, targets)[0])
+
+    def test_stratified_sample(self):
+        """
+        Every space-time cell is represented, weighted sums over the sample estimate the sums over all sightings
+        """
+        r = random.Random(12345)
+        # a dense area (900 sightings) & a sparse track (20 sightings far apart):
+        sightings = [
+            Sighting(timestamp=r.uniform(0, 30), latitude=48.0 + r.uniform(0, 0.01), longitude=32.0 + r.uniform(0, 0.01), bearing=0.0)
+            for _ in range(900)
+        ] + [
+            Sighting(timestamp=120 * i, latitude=49.0 + 0.1 * i, longitude=30.0, bearing=0.0) for i in range(20)
+        ]
+
+        indices, weights = stratified_sample(sightings, 100, random_state=0)
+        self.assertEqual(len(indices), len(weights))
+        self.assertListEqual(sorted(indices.tolist()), indices.tolist())
+        self.assertLess(abs(len(indices) - 100), 20)
+        # sightings of the sparse track (single sighting cells) are sampled with probability ~ size / N & weighted up:
+        sparse = indices >= 900
+        self.assertGreater(numpy.sum(sparse), 0)
+        numpy.testing.assert_allclose(weights[sparse], len(sightings) / 100)
+        self.assertAlmostEqual(len(sightings), weights.sum(), delta=0.1 * len(sightings))
+
+        # unbiased with existing weights:
+        base = numpy.arange(1.0, len(sightings) + 1)
+        totals = [stratified_sample(sightings, 50, weights=base, random_state=seed)[1].sum() for seed in range(50)]
+        self.assertAlmostEqual(base.sum(), numpy.mean(totals), delta=0.02 * base.sum())
+
+        # small sets are not sampled:
+        indices, weights = stratified_sample(sightings[:10], 100)
+        self.assertListEqual(list(range(10)), indices.tolist())
+        self.assertListEqual([1.0] * 10, weights.tolist())
+
+    def test_sampled_analysis(self):
+        """
+        Targets fitted on samples (or mini-batches) explain all sightings like the full analysis
+        """
+        r = random.Random(12345)
+
+        paths = [
+            [Point(45.361285195897885, 33.90794799044153), Point(47.487079766379715, 33.081535775384715),
+             Point(49.47728424495352, 27.901909920451157)],
+            [Point(50.5, 24.0), Point(51.0, 25.5)]
+        ]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for path in paths for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(50)
+        ]
+        sim = Simulator(targets=[Target(path=path) for path in paths], observers=observers, random=r)
+
+        expected = analyze_sightings(sim.sightings, coalesce=True)
+        for batches in (1, 2):
+            targets, assignment = analyze_sightings(sim.sightings, with_assignment=True, sample_size=60, batches=batches, random_state=0)
+            self.assertEqual(len(expected), len(targets))
+            self.assertEqual(len(sim.sightings), len(assignment))
+            self.assertEqual(0, _score(sim.sightings, targets)[0])
+            self.assertListEqual(sightings_to_targets(sim.sightings, targets), assignment)
+
+    def test_random_state(self):
+        """
+        Seeded analyses (full, sampled, incremental & windowed) are reproducible
+        """
+        r = random.Random(12345)
+
+        path = [
+            Point(45.361285195897885, 33.90794799044153),
+            Point(47.487079766379715, 33.081535775384715),
+            Point(49.47728424495352, 27.901909920451157)
+        ]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(20)
+        ]
+        sightings = Simulator(targets=[Target(path=path)], observers=observers, random=r).sightings
+
+        def _json(targets):
+            return [t.to_json() for t in targets]
+
+        for kwargs in ({}, {'restarts': 2, 'n_jobs': 1}, {'sample_size': 20}):
+            self.assertListEqual(_json(analyze_sightings(sightings, random_state=7, **kwargs)),
+                                 _json(analyze_sightings(sightings, random_state=7, **kwargs)))
+        self.assertListEqual(_json(update_analysis(sightings, [], [], random_state=7)[0]),
+                             _json(update_analysis(sightings, [], [], random_state=7)[0]))
+        self.assertListEqual(_json(analyze_window(sightings, [], 600, random_state=7)),
+                             _json(analyze_window(sightings, [], 600, random_state=7)))
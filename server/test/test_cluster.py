@@ -0,0 +1,88 @@
+"""
+Test multi-worker support (leader election & target publishing)
+"""
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from geopy import Point
+
+from missilemap import MissileMap, Sighting, Target
+from missilemap.cluster import FileLease, FileTargetStore, get_cluster
+from missilemap.definitions import TargetSet
+from missilemap.storage import MemoryStorage
+
+
+class TestCluster(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory(prefix='test_cluster')
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    async def test_file_lease(self):
+        """
+        Only one lease object can hold the lease at a time
+        """
+        lease1, _ = get_cluster('file', path=self._dir.name)
+        lease2, _ = get_cluster('file', path=self._dir.name)
+
+        self.assertTrue(await lease1.acquire())
+        self.assertTrue(await lease1.acquire())  # renew
+        self.assertFalse(await lease2.acquire())
+
+        await lease1.release()
+        self.assertFalse(lease1.is_held)
+        self.assertTrue(await lease2.acquire())
+        self.assertTrue(lease2.is_held)
+        await lease2.release()
+
+    async def test_file_target_store(self):
+        """
+        Test publishing & reading target sets
+        """
+        store = FileTargetStore(self._dir.name)
+        self.assertIsNone(await store.latest())
+
+        target_set = TargetSet(version=3, timestamp=1.5, targets=(
+            Target(start_time=10.5, speed=200.0, path=[Point(48.0, 32.0), Point(49.0, 33.0)]),
+        ))
+        await store.publish(target_set)
+
+        result = await FileTargetStore(self._dir.name).latest()
+        self.assertEqual(3, result.version)
+        self.assertEqual(target_set.to_json(), result.to_json())
+        self.assertIsNone(await FileTargetStore(self._dir.name).latest(since=3))
+
+    async def test_leader_follower(self):
+        """
+        The leader analyzes the sightings, the follower serves the published targets
+        """
+        storage = MemoryStorage()
+        for timestamp, latitude in ((0, 48.0), (60, 48.12), (120, 48.24), (180, 48.36)):
+            await storage.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+
+        maps = [
+            MissileMap(storage, analysis_interval=-1, cleanup_interval=-1,
+                       lease=FileLease(f'{self._dir.name}/lease.lock'), target_store=FileTargetStore(self._dir.name))
+            for _ in range(2)
+        ]
+
+        await maps[0]._analysis_service()
+        await maps[1]._analysis_service()
+
+        self.assertTrue(maps[0].is_leader)
+        self.assertFalse(maps[1].is_leader)
+
+        leader_set = await maps[0].get_target_set()
+        follower_set = await maps[1].get_target_set()
+        self.assertEqual(1, leader_set.version)
+        self.assertEqual(1, len(leader_set.targets))
+        self.assertEqual(leader_set.to_json(), follower_set.to_json())
+
+        # leadership moves to the follower after shutdown, versions keep increasing:
+        await maps[0].shutdown()
+        await maps[1]._analysis_service()
+        self.assertTrue(maps[1].is_leader)
+        self.assertEqual(2, (await maps[1].get_target_set()).version)
+        await maps[1].shutdown()
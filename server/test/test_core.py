@@ -2,9 +2,14 @@
 Test core logic implementation
 """
 import asyncio
+import math
+import random
 from unittest import IsolatedAsyncioTestCase
 
+from missilemap import MissileMap, Sighting
 from missilemap.missilemap import AsyncServer
+from missilemap.scheduler import DebouncedTrigger, FIXED_DELAY
+from missilemap.storage import MemoryStorage
 
 
 class TestCore(IsolatedAsyncioTestCase):
@@ -49,3 +54,192 @@ class TestCore(IsolatedAsyncioTestCase):
             'test1': 1,
             'test2': 2
         }, result)
+
+    async def test_scheduler(self):
+        """
+        Services keep their schedule, survive failures & report stats
+        """
+        server = AsyncServer()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        starts = {'rate': [], 'delay': []}
+        failures = []
+
+        async def _rate():
+            starts['rate'].append(loop.time() - start)
+            if len(starts['rate']) == 3:
+                await asyncio.sleep(0.25)  # overrun: the missed ticks are coalesced
+
+        async def _delay():
+            starts['delay'].append(loop.time() - start)
+            await asyncio.sleep(0.05)
+
+        async def _failing():
+            failures.append(loop.time() - start)
+            if len(failures) < 3:
+                raise RuntimeError('failure')
+
+        async def _once():
+            pass
+
+        rate = server.run_service(_rate, period=0.1)
+        delay = server.run_service(_delay, period=0.1, mode=FIXED_DELAY)
+        failing = server.run_service(_failing, backoff=0.05, name='failing')
+        server.run_service(_once)
+        with self.assertRaises(ValueError):
+            server.run_service(_failing, name='failing')
+        with self.assertRaises(ValueError):
+            server.run_service(_delay, period=0.2)  # stats are reported by name: the default name is taken
+
+        await asyncio.sleep(1.02)
+        self.assertSetEqual({'_rate', '_delay'}, set(server.service_stats()))  # completed services are removed
+        await server.shutdown()
+        self.assertDictEqual({}, server.service_stats())
+
+        # fixed rate: runs start at multiples of the period (no drift), the overrun skipped 2 ticks
+        self.assertEqual(1, rate.stats.overruns)
+        self.assertEqual(2, rate.stats.missed)
+        self.assertListEqual([1, 2, 3, 6, 7, 8, 9], [round(t / 0.1) for t in starts['rate']][:7])
+        self.assertLess(max(abs(t - round(t / 0.1) * 0.1) for t in starts['rate']), 0.05)
+
+        # fixed delay: a period between the end of a run & the next start
+        self.assertTrue(all(t2 - t1 >= 0.15 for t1, t2 in zip(starts['delay'][:-1], starts['delay'][1:])))
+        self.assertGreaterEqual(delay.stats.max_duration, 0.05)
+
+        # failed runs are restarted with exponential backoff:
+        self.assertEqual(3, len(failures))
+        self.assertEqual(2, failing.stats.failures)
+        self.assertIn('failure', failing.stats.last_error)
+        self.assertGreaterEqual(failures[2] - failures[1], 0.1)
+
+    async def test_jitter(self):
+        """
+        Jitter delays runs within the period without being reported as lag or missed ticks
+        """
+        random.seed(0)
+        server = AsyncServer()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        starts = []
+
+        async def _run():
+            starts.append(loop.time() - start)
+            await asyncio.sleep(0.02)
+
+        service = server.run_service(_run, period=0.1, jitter=0.9)
+        await asyncio.sleep(1.0)
+        await server.shutdown()
+
+        phases = [t % 0.1 for t in starts]
+        self.assertGreater(max(phases) - min(phases), 0.02)  # runs are spread within the period
+        self.assertEqual(0, service.stats.missed)
+        self.assertLess(service.stats.max_lag, 0.02)
+
+    async def test_triggered_analysis(self):
+        """
+        Analysis runs shortly after sightings are added & not at all while idle
+        """
+        storage = MemoryStorage()
+        core = MissileMap(storage, analysis_interval=0.3, cleanup_interval=-1, alert_interval=-1, analysis_debounce=0.05)
+        await asyncio.sleep(0.5)
+        stats = core.service_stats()['_analysis_service']
+        self.assertEqual(1, stats.runs)  # startup run
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for timestamp, latitude in ((0, 48.0), (60, 48.12), (120, 48.24), (180, 48.36)):
+            await core.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+        while not (await core.get_target_set()).targets:
+            await asyncio.sleep(0.01)
+        self.assertLess(loop.time() - start, 0.25)  # sooner than the analysis interval
+        self.assertEqual(2, stats.runs)  # the burst is analyzed at once
+
+        # idle: no analysis
+        await asyncio.sleep(0.5)
+        self.assertEqual(2, stats.runs)
+        await core.shutdown()
+
+    async def test_windowed_analysis(self):
+        """
+        Only sightings within the trailing window are analyzed, older targets are kept
+        """
+        storage = MemoryStorage()
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1, alert_interval=-1, analysis_window=600)
+        for timestamp, latitude in ((0, 48.0), (60, 48.12), (120, 48.24), (180, 48.36)):
+            await core.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+        await core._analysis_service()
+        first = (await core.get_target_set()).targets
+        self.assertEqual(1, len(first))
+
+        # another target an hour later: the first one is out of the window & kept as is
+        for timestamp, longitude in ((3600, 30.0), (3660, 30.17), (3720, 30.34), (3780, 30.51)):
+            await core.add_sighting(Sighting(timestamp=timestamp, latitude=47.0, longitude=longitude, bearing=math.pi / 2))
+        await core._analysis_service()
+        targets = (await core.get_target_set()).targets
+        self.assertEqual(2, len(targets))
+        self.assertIs(first[0], targets[0])
+        self.assertEqual(4, len(core._state.sighting_ids))
+        await core.shutdown()
+
+    async def test_debounced_trigger(self):
+        """
+        Triggered runs are debounced, spaced & their latency is bounded
+        """
+        loop = asyncio.get_running_loop()
+        trigger = DebouncedTrigger(debounce=0.1, min_spacing=0.2, max_latency=0.3)
+        server = AsyncServer()
+        runs = []
+
+        async def _run():
+            runs.append(loop.time())
+
+        service = server.run_service(_run, trigger=trigger)
+        await asyncio.sleep(0.3)
+        self.assertListEqual([], runs)
+
+        # sustained events: runs are spaced by min_spacing, events wait no longer than max_latency (+ spacing)
+        start = loop.time()
+        while loop.time() - start < 1.5:
+            trigger.notify()
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.5)
+        await server.shutdown()
+
+        self.assertGreaterEqual(len(runs), 4)
+        self.assertTrue(all(t2 - t1 >= 0.2 for t1, t2 in zip(runs[:-1], runs[1:])))
+        self.assertLess(service.stats.max_lag, 0.3 + 0.2 + 0.05)
+        self.assertLess(trigger.window(), trigger.debounce)  # adapted to the event rate
+
+    async def test_bbox_targets(self):
+        """
+        Bounding box queries return only targets flying through the box within the horizon
+        """
+        storage = MemoryStorage()
+        for timestamp, latitude in ((0, 48.0), (60, 48.12), (120, 48.24), (180, 48.36)):
+            await storage.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1)
+        await core._analysis_service()
+        self.assertEqual(1, len(await core.list_targets()))
+
+        # the target flies north along longitude 32:
+        self.assertEqual(1, len(await core.list_targets(bbox=(31.9, 48.1, 32.1, 48.2), timestamp=0)))
+        self.assertEqual(0, len(await core.list_targets(bbox=(30.0, 48.1, 31.0, 48.2), timestamp=0)))
+
+        # the box is reached only after the horizon:
+        self.assertEqual(0, len(await core.list_targets(bbox=(31.9, 48.3, 32.1, 48.4), horizon=60, timestamp=0)))
+        self.assertEqual(1, len(await core.list_targets(bbox=(31.9, 48.3, 32.1, 48.4), horizon=600, timestamp=0)))
+
+        # the target has already passed the box:
+        self.assertEqual(0, len(await core.list_targets(bbox=(31.9, 48.0, 32.1, 48.1), timestamp=150)))
+
+        # after the last sighting the target keeps flying north along its last leg:
+        for timestamp in (170, 185, 200):
+            self.assertEqual(1, len(await core.list_targets(bbox=(31.9, 48.5, 32.1, 48.8), timestamp=timestamp)))
+        self.assertEqual(0, len(await core.list_targets(bbox=(31.9, 48.5, 32.1, 48.8), horizon=10, timestamp=185)))
+
+        # predictions are computed for the same generation:
+        predictions = await core.get_predictions()
+        self.assertEqual((await core.get_target_set()).version, predictions.version)
+        self.assertTupleEqual((1, 61, 2), predictions.positions.shape)
+        await core.shutdown()
@@ -0,0 +1,136 @@
+"""
+Test columnar dataset files
+"""
+import importlib.util
+import os
+import random
+import tempfile
+import unittest
+from unittest import IsolatedAsyncioTestCase
+
+from geopy import Point
+import numpy
+
+from missilemap import Target
+from missilemap.analysis import analyze_sightings
+from missilemap.dataset import (
+    export_sightings, import_sightings, load_sightings, load_table, read_sightings, read_targets, write_sightings, write_targets
+)
+from missilemap.storage import MemoryStorage
+from missilemap.table import SightingTable
+from simulator import Observer, random_location, Simulator
+
+HAS_PARQUET = importlib.util.find_spec('pyarrow') is not None
+
+
+class TestDataset(IsolatedAsyncioTestCase):
+    """
+    Test saving & loading sightings and targets
+    """
+
+    def setUp(self) -> None:
+        r = random.Random(12345)
+        path = [Point(45.361285195897885, 33.90794799044153), Point(47.487079766379715, 33.081535775384715),
+                Point(49.47728424495352, 27.901909920451157)]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(10)
+        ]
+        self.sim = Simulator(targets=[Target(path=path, start_time=100)], observers=observers, random=r)
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _round_trip(self, suffix: str):
+        """
+        Save & load simulated sightings & analysis results
+        """
+        file_name = os.path.join(self.dir.name, 'sightings' + suffix)
+        write_sightings(file_name, self.sim.sightings)
+
+        table = SightingTable()
+        for s in self.sim.sightings:
+            table.add_sighting(s)
+        self.assertTrue(table.equals(load_table(file_name)))
+
+        # loaded records are ready for the analysis:
+        records = load_sightings(file_name)
+        self.assertListEqual([s.id for s in self.sim.sightings], [r.id for r in records])
+        targets = analyze_sightings(records)
+        self.assertEqual(1, len(targets))
+
+        file_name = os.path.join(self.dir.name, 'targets' + suffix)
+        targets = list(self.sim.targets) + targets
+        write_targets(file_name, targets)
+        loaded = read_targets(file_name)
+        self.assertEqual(len(targets), len(loaded))
+        for target, other in zip(targets, loaded):
+            self.assertEqual(target.start_time, other.start_time)
+            self.assertEqual(target.speed, other.speed)
+            self.assertListEqual([(p.latitude, p.longitude) for p in target.path], [(p.latitude, p.longitude) for p in other.path])
+
+    def test_npz(self):
+        """
+        NumPy archives round-trip & are memory-mapped on read
+        """
+        self._round_trip('.npz')
+
+        columns = read_sightings(os.path.join(self.dir.name, 'sightings.npz'))
+        self.assertIsInstance(columns['latitude'], numpy.memmap)
+        self.assertTupleEqual((len(self.sim.sightings), 12), columns['id'].shape)
+
+        # empty files:
+        file_name = os.path.join(self.dir.name, 'empty.npz')
+        write_sightings(file_name, [])
+        self.assertEqual(0, len(load_table(file_name)))
+        write_targets(file_name, [])
+        self.assertListEqual([], read_targets(file_name))
+
+        with self.assertRaises(ValueError):
+            write_sightings(os.path.join(self.dir.name, 'sightings.csv'), self.sim.sightings)
+
+    @unittest.skipUnless(HAS_PARQUET, 'requires pyarrow')
+    def test_parquet(self):
+        """
+        Parquet files round-trip
+        """
+        self._round_trip('.parquet')
+
+    async def test_storage(self):
+        """
+        Sightings are exported from & imported into storage
+        """
+        storage = MemoryStorage()
+        for s in self.sim.sightings:
+            await storage.add_sighting(s)
+
+        file_name = os.path.join(self.dir.name, 'capture.npz')
+        self.assertEqual(len(self.sim.sightings), await export_sightings(storage, file_name))
+
+        other = MemoryStorage()
+        self.assertEqual(len(self.sim.sightings), await import_sightings(other, file_name))
+        self.assertListEqual(
+            sorted((s.id, s.timestamp, s.latitude, s.longitude, s.bearing) for s in await storage.list_sightings()),
+            sorted((s.id, s.timestamp, s.latitude, s.longitude, s.bearing) for s in await other.list_sightings())
+        )
+
+        # importing again does not duplicate sightings:
+        await import_sightings(other, file_name)
+        self.assertEqual(len(self.sim.sightings), len(await other.list_records()))
+
+    def test_from_columns(self):
+        """
+        Bulk table creation keeps the last row per id
+        """
+        table = SightingTable()
+        for s in self.sim.sightings:
+            table.add_sighting(s)
+
+        columns = table.columns()
+        duplicated = {name: numpy.concatenate((column, column[:5])) for name, column in columns.items()}
+        duplicated['latitude'][-5:] += 1.0
+        loaded = SightingTable.from_columns(duplicated)
+        self.assertEqual(len(table), len(loaded))
+        for s in self.sim.sightings[:5]:
+            self.assertAlmostEqual(s.latitude + 1.0, loaded.get(s.id).latitude)
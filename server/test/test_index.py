@@ -0,0 +1,105 @@
+"""
+Test target indexes
+"""
+import random
+from unittest import TestCase
+
+from geopy import Point
+from geopy.distance import distance
+import numpy
+
+from missilemap import Target
+from missilemap.index import IntervalTree, TargetIndex
+
+
+class TestIndex(TestCase):
+
+    def test_interval_tree(self):
+        """
+        Interval tree returns the same intervals as a full scan
+        """
+        r = random.Random(12345)
+        starts = [r.uniform(0, 1000) for _ in range(500)]
+        ends = [s + r.expovariate(1 / 50) for s in starts]
+        tree = IntervalTree(starts, ends)
+        self.assertEqual(500, len(tree))
+
+        for _ in range(200):
+            t0 = r.uniform(-100, 1100)
+            t1 = t0 + r.choice([0, r.uniform(0, 100)])
+            expected = [i for i, (s, e) in enumerate(zip(starts, ends)) if s <= t1 and e >= t0]
+            self.assertListEqual(expected, sorted(tree.overlap(t0, t1).tolist()))
+
+        self.assertListEqual([], IntervalTree([], []).query(0).tolist())
+
+    def test_target_index(self):
+        """
+        Targets close to a place & time are always candidates, distant targets are pruned
+        """
+        r = random.Random(12345)
+        targets = []
+        for _ in range(200):
+            start = Point(r.uniform(44.0, 52.0), r.uniform(22.0, 40.0))
+            end = Point(start.latitude + r.uniform(-1.0, 1.0), start.longitude + r.uniform(-1.5, 1.5))
+            targets.append(Target(start_time=r.uniform(0, 86400), path=[start, end]))
+
+        index = TargetIndex(targets, distance=10000)
+        sizes = []
+        for _ in range(200):
+            target = r.choice(targets)
+            timestamp = r.uniform(target.start_time - 60, target.end_time + 60)
+            pos = target.at_time(timestamp)
+            candidates = index.candidates(timestamp, pos.latitude, pos.longitude)
+
+            active = [idx for idx, t in enumerate(targets) if t.start_time - 60 <= timestamp <= t.end_time + 60]
+            close = [idx for idx in active if distance(targets[idx].at_time(timestamp), pos).meters < 10000]
+            self.assertTrue(set(close) <= set(candidates.tolist()))
+            sizes.append(len(candidates))
+
+        self.assertLess(numpy.mean(sizes), 10)
+
+        # box & time range query:
+        found = index.query(0, 86400, (44.0, 52.0), (22.0, 40.0))
+        self.assertListEqual(list(range(200)), found.tolist())
+        self.assertListEqual([], index.query(0, 86400, (10.0, 11.0), (10.0, 11.0)).tolist())
+
+    def test_intersecting(self):
+        """
+        Targets flying through a box during a time range are found through the index
+        """
+        r = random.Random(12345)
+        targets = []
+        for _ in range(200):
+            start = Point(r.uniform(44.0, 52.0), r.uniform(22.0, 40.0))
+            middle = Point(start.latitude + r.uniform(-1.0, 1.0), start.longitude + r.uniform(-1.5, 1.5))
+            end = Point(middle.latitude + r.uniform(-1.0, 1.0), middle.longitude + r.uniform(-1.5, 1.5))
+            targets.append(Target(start_time=r.uniform(0, 86400), path=[start, middle, end]))
+
+        index = TargetIndex(targets, distance=0, time_padding=0)
+        for _ in range(100):
+            lat, lon = r.uniform(44.0, 52.0), r.uniform(22.0, 40.0)
+            lat_range, lon_range = (lat, lat + r.uniform(0.1, 2.0)), (lon, lon + r.uniform(0.1, 2.0))
+            t0 = r.uniform(0, 86400)
+            t1 = t0 + 600
+
+            # sampled positions inside the box must belong to found targets:
+            found = set(index.intersecting(t0, t1, lat_range, lon_range).tolist())
+            for idx, target in enumerate(targets):
+                for t in numpy.linspace(t0, t1, 61):
+                    pos = target.at_time(t, extrapolate=False)
+                    if pos is not None and lat_range[0] <= pos.latitude <= lat_range[1] and lon_range[0] <= pos.longitude <= lon_range[1]:
+                        self.assertIn(idx, found)
+
+        # a target flying through the box (without any path point inside it):
+        target = Target(start_time=0, path=[Point(48.0, 30.0), Point(48.0, 32.0)])
+        index = TargetIndex([target], distance=0, time_padding=0)
+        self.assertListEqual([0], index.intersecting(0, target.end_time, (47.9, 48.1), (30.9, 31.1)).tolist())
+        self.assertListEqual([], index.intersecting(0, 0.1 * target.end_time, (47.9, 48.1), (30.9, 31.1)).tolist())
+        self.assertListEqual([], index.intersecting(0, target.end_time, (48.2, 48.3), (30.9, 31.1)).tolist())
+
+        # after the end of the path the target keeps flying along its last leg (within the extrapolation time):
+        index = TargetIndex([target], distance=0, time_padding=0, extrapolation=600)
+        t = target.end_time + 10
+        self.assertListEqual([0], index.intersecting(t, t + 600, (47.9, 48.1), (32.1, 32.5)).tolist())
+        self.assertListEqual([], index.intersecting(t, t + 600, (47.9, 48.1), (34.0, 34.5)).tolist())
+        self.assertListEqual([], TargetIndex([target], distance=0, time_padding=0).intersecting(t, t + 600, (47.9, 48.1), (32.1, 32.5)).tolist())
@@ -0,0 +1,87 @@
+"""
+Test predicted target positions
+"""
+import math
+import random
+from unittest import TestCase
+
+from geopy import Point
+from geopy.distance import distance
+import numpy
+
+from missilemap import Target
+from missilemap.definitions import TargetSet
+from missilemap.prediction import Predictions, predict, predict_positions
+
+
+class TestPrediction(TestCase):
+
+    def test_predict_positions(self):
+        """
+        Predicted positions match Target.at_time() along the path & continue along the last leg after the end
+        """
+        r = random.Random(12345)
+        targets = []
+        for _ in range(20):
+            path = [Point(r.uniform(44.0, 52.0), r.uniform(22.0, 40.0))]
+            for _ in range(r.randint(1, 4)):
+                path.append(Point(path[-1].latitude + r.uniform(-1.0, 1.0), path[-1].longitude + r.uniform(-1.5, 1.5)))
+            targets.append(Target(start_time=r.uniform(0, 3600), speed=r.uniform(200, 270), path=path))
+
+        times = numpy.arange(0, 10000, 10.0)
+        positions = predict_positions(targets, times, max_extrapolation=math.inf)
+        self.assertTupleEqual((len(targets), len(times), 2), positions.shape)
+
+        for target, predicted in zip(targets, positions):
+            for t, (lat, lon) in zip(times, predicted):
+                expected = target.at_time(t)
+                self.assertAlmostEqual(expected.latitude, lat, places=6)
+                self.assertAlmostEqual(expected.longitude, lon, places=6)
+
+            # after the end the target flies along the last leg with the same speed:
+            after = predict_positions([target], [target.end_time, target.end_time + 60])[0]
+            step = numpy.hypot(*(after[1] - after[0]))
+            last_leg = numpy.hypot(target.path[-1].latitude - target.path[-2].latitude, target.path[-1].longitude - target.path[-2].longitude)
+            self.assertAlmostEqual(step, last_leg * 60 * target.speed / target.distances[-1], places=6)
+
+        self.assertTupleEqual((0, 3, 2), predict_positions([], [0, 1, 2]).shape)
+
+    def test_max_extrapolation(self):
+        """
+        Positions are only extrapolated up to max_extrapolation seconds beyond the path
+        """
+        target = Target(start_time=1000, path=[Point(48.0, 30.0), Point(48.0, 32.0)])
+        times = [target.start_time - 301, target.start_time - 300, target.end_time + 300, target.end_time + 301, target.end_time + 3600]
+        positions = predict_positions([target], times)[0]
+        self.assertListEqual([True, False, False, True, True], numpy.isnan(positions[:, 0]).tolist())
+        self.assertEqual(1, numpy.isnan(predict_positions([target], times, max_extrapolation=600)[0, :, 0]).sum())
+
+        # a target that ended long ago has no predicted positions, unknown positions are null in JSON:
+        predictions = predict(TargetSet(version=1, timestamp=target.end_time + 200, targets=(target,)), step=10.0, horizon=600.0)
+        self.assertEqual(11, (~numpy.isnan(predictions.positions[0, :, 0])).sum())
+        self.assertIsNone(predictions.to_json()['positions'][0][-1][0])
+        decoded = Predictions.json_decoder(predictions.to_json())
+        self.assertTrue(numpy.array_equal(predictions.positions, decoded.positions, equal_nan=True))
+
+    def test_target_extrapolation(self):
+        """
+        Multi-leg targets keep their speed when extrapolated beyond the path
+        """
+        target = Target(start_time=0, path=[Point(48.0, 30.0), Point(48.5, 30.0), Point(48.5, 31.0)])
+        for t0, t1 in ((target.end_time, target.end_time + 60), (-60, 0)):
+            self.assertAlmostEqual(60 * target.speed, distance(target.at_time(t0), target.at_time(t1)).meters, delta=0.01 * 60 * target.speed)
+
+    def test_predict(self):
+        """
+        Predictions grid starts at the target set time
+        """
+        target = Target(start_time=100, path=[Point(48.0, 30.0), Point(48.0, 32.0)])
+        predictions = predict(TargetSet(version=3, timestamp=100.0, targets=(target,)), step=10.0, horizon=600.0)
+        self.assertEqual(3, predictions.version)
+        self.assertTupleEqual((1, 61, 2), predictions.positions.shape)
+        self.assertListEqual([100.0, 110.0], predictions.times[:2].tolist())
+        self.assertAlmostEqual(30.0, predictions.positions[0, 0, 1])
+
+        decoded = Predictions.json_decoder(predictions.to_json())
+        self.assertTrue(numpy.array_equal(predictions.positions, decoded.positions))
+        self.assertEqual((0, 0, 2), Predictions.json_decoder(Predictions().to_json()).positions.shape)
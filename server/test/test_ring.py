@@ -0,0 +1,151 @@
+"""
+Test shared-memory sighting ring buffer
+"""
+import multiprocessing
+import tempfile
+from unittest import IsolatedAsyncioTestCase, mock
+
+import numpy
+
+from missilemap import MissileMap, Sighting
+from missilemap.cluster import get_cluster
+from missilemap.ring import GENERATION, SightingRing
+from missilemap.storage import MemoryStorage
+
+
+def _read_ring(name: str, queue):
+    """
+    Worker process: sum latitudes of the ring records
+    """
+    ring = SightingRing.attach(name)
+    snapshot = ring.snapshot()
+    queue.put((len(snapshot), float(snapshot.column('latitude').sum()), snapshot.is_valid()))
+    del snapshot
+    ring.close()
+
+
+class TestRing(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self.ring = SightingRing.create(capacity=100)
+        self._dir = tempfile.TemporaryDirectory(prefix='test_ring')
+
+    def tearDown(self) -> None:
+        self.ring.close()
+        self._dir.cleanup()
+
+    def test_ring(self):
+        """
+        Snapshots see the last `capacity` records, overwritten & cleared records invalidate snapshots
+        """
+        sightings = [Sighting(timestamp=i, latitude=float(i), longitude=30.0, bearing=0.1) for i in range(250)]
+        self.ring.extend(sightings[:60])
+        snapshot = self.ring.snapshot()
+        self.assertEqual(60, len(snapshot))
+        self.assertEqual(1, len(snapshot.parts))
+        self.assertTrue(numpy.shares_memory(snapshot.parts[0], self.ring.records))
+        self.assertListEqual([s.id for s in sightings[:60]], [r.id for r in snapshot.to_records()])
+
+        # wrap around: the oldest records are overwritten
+        generation = self.ring.generation
+        for s in sightings[60:130]:
+            self.ring.append(s)
+        self.assertNotEqual(generation, self.ring.generation)
+        self.assertFalse(snapshot.is_valid())
+        snapshot = self.ring.snapshot()
+        self.assertTrue(snapshot.is_valid())
+        self.assertEqual(2, len(snapshot.parts))
+        self.assertListEqual(list(range(30, 130)), snapshot.column('timestamp').tolist())
+        self.assertListEqual(list(range(30, 130)), snapshot.column('seq').tolist())
+
+        # more records than capacity at once:
+        self.ring.extend(sightings[130:])
+        self.assertListEqual(list(range(150, 250)), self.ring.snapshot().column('timestamp').tolist())
+
+        self.ring.clear()
+        self.assertFalse(snapshot.is_valid())
+        self.assertEqual(0, len(self.ring.snapshot()))
+        self.ring.append(sightings[0])
+        self.assertListEqual([sightings[0].id], [r.id for r in self.ring.snapshot().to_records()])
+
+    def test_worker(self):
+        """
+        Worker processes map the ring by name
+        """
+        self.ring.extend([Sighting(timestamp=i, latitude=float(i), longitude=30.0, bearing=0.1) for i in range(10)])
+        queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_read_ring, args=(self.ring.name, queue))
+        worker.start()
+        self.assertTupleEqual((10, 45.0, True), queue.get(timeout=30))
+        worker.join(timeout=30)
+
+    async def test_core(self):
+        """
+        New sightings are appended to the ring, retried ones are not
+        """
+        core = MissileMap(MemoryStorage(), analysis_interval=-1, cleanup_interval=-1, alert_interval=-1, ring=self.ring)
+        sighting = Sighting(timestamp=0, latitude=48.0, longitude=30.0, bearing=0.1)
+        await core.add_sighting(sighting)
+        await core.add_sighting(Sighting(**sighting.dict()))
+        self.assertListEqual([sighting.id], [r.id for r in self.ring.snapshot().to_records()])
+
+        await core.clear_sightings()
+        self.assertEqual(0, len(self.ring.snapshot()))
+        await core.shutdown()
+
+    def test_snapshot(self):
+        """
+        Snapshots of new records only, overflow is reported, a writer that died mid-update doesn't block readers
+        """
+        sightings = [Sighting(timestamp=i, latitude=float(i), longitude=30.0, bearing=0.1) for i in range(150)]
+        self.ring.extend(sightings[:40])
+        head = self.ring.snapshot().end
+        self.ring.extend(sightings[40:50])
+        snapshot = self.ring.snapshot(since=head)
+        self.assertListEqual(list(range(40, 50)), snapshot.column('timestamp').tolist())
+        self.assertFalse(snapshot.truncated)
+        self.assertEqual(0, len(self.ring.snapshot(since=1000)))
+
+        self.ring.extend(sightings[50:])
+        self.assertTrue(self.ring.snapshot().truncated)
+        self.assertFalse(self.ring.snapshot(since=50).truncated)
+
+        self.ring.header[GENERATION] += 1  # the writer died in the middle of an update
+        with self.assertRaises(TimeoutError):
+            self.ring.snapshot(timeout=0.01)
+        self.ring.header[GENERATION] += 1
+
+    async def test_analysis(self):
+        """
+        The analysis reads sightings from the ring (loaded from the storage once), the storage is not queried any more
+        """
+        storage = MemoryStorage()
+        for timestamp, latitude in ((0, 48.0), (60, 48.12), (120, 48.24)):
+            await storage.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1, alert_interval=-1, ring=self.ring)
+        await core._analysis_service()
+        self.assertEqual(3, len(self.ring.snapshot()))
+        self.assertEqual(1, len((await core.get_target_set()).targets))
+
+        with mock.patch.object(storage, 'list_records', side_effect=AssertionError('storage queried')), \
+                mock.patch.object(storage, 'sync', side_effect=AssertionError('storage queried')):
+            for timestamp, latitude in ((180, 48.36), (240, 48.48)):
+                await core.add_sighting(Sighting(timestamp=timestamp, latitude=latitude, longitude=32.0, bearing=0.0))
+            await core._analysis_service()
+        target_set = await core.get_target_set()
+        self.assertEqual(2, target_set.version)
+        self.assertAlmostEqual(240.0, target_set.targets[0].end_time, delta=10.0)
+        await core.shutdown()
+
+        # more sightings than the ring capacity: read from the storage
+        for i in range(100):
+            await storage.add_sighting(Sighting(timestamp=300 + i, latitude=48.5 + 0.001 * i, longitude=32.0, bearing=0.0))
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1, alert_interval=-1, ring=self.ring)
+        await core._analysis_service()
+        self.assertEqual(105, len(core._state.sighting_ids))
+        await core.shutdown()
+
+        lease, target_store = get_cluster('file', path=self._dir.name)
+        with self.assertRaises(ValueError):
+            MissileMap(storage, lease=lease, target_store=target_store, ring=self.ring)
@@ -12,6 +12,7 @@ from unittest import IsolatedAsyncioTestCase
 
 # requires "Mark directory as -> Source root on top level directory"
 from geopy import Point
+import requests
 
 from clientapi import ClientAPI
 from missilemap import Sighting, Target
@@ -169,4 +170,20 @@ class TestServer(IsolatedAsyncioTestCase):
 
         # await asyncio.sleep(1000)
 
-        self.assertEqual(5, len(targets))
+        # segments of both turning targets are linked into multi-segment targets:
+        self.assertEqual(2, len(targets))
+
+        # binary format returns the same targets (coordinates are quantized):
+        binary_targets = self._api.list_targets(binary=True)
+        self.assertEqual(len(targets), len(binary_targets))
+        for target, binary_target in zip(targets, binary_targets):
+            self.assertAlmostEqual(target.start_time, binary_target.start_time)
+            self.assertAlmostEqual(target.speed, binary_target.speed, places=3)
+            for p, binary_p in zip(target.path, binary_target.path):
+                self.assertAlmostEqual(p.latitude, binary_p.latitude, places=5)
+                self.assertAlmostEqual(p.longitude, binary_p.longitude, places=5)
+
+        # both representations vary by the Accept header:
+        for accept in ('application/json', 'application/x-missilemap-targets'):
+            resp = requests.get(f'{URL}/targets', headers={'Accept': accept})
+            self.assertIn('Accept', [v.strip() for v in resp.headers['Vary'].split(',')])
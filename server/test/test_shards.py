@@ -0,0 +1,163 @@
+"""
+Test geo-sharded analysis (work queue, workers & merger)
+"""
+import asyncio
+import fcntl
+import os
+import random
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+from geopy import Point
+
+from missilemap import MissileMap, Sighting, Target
+from missilemap.analysis import MAX_DISTANCE, sightings_to_targets
+from missilemap.cluster import FileTargetStore, get_cluster
+from missilemap.shards import FileShardQueue, get_shard_cluster, merge_shard_targets, shard_grid, ShardMerger, ShardWorker
+from missilemap.storage import MemoryStorage
+from simulator import Observer, random_location, Simulator
+
+
+class TestShards(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory(prefix='test_shards')
+
+        r = random.Random(12345)
+        paths = [
+            # crosses the shard borders:
+            [Point(45.361285195897885, 33.90794799044153), Point(47.487079766379715, 33.081535775384715),
+             Point(49.47728424495352, 27.901909920451157)],
+            # within a single shard:
+            [Point(50.5, 24.0), Point(51.0, 25.5)]
+        ]
+        observers = [
+            Observer(location=random_location(p_from, p_to, 5000, random=r), radius=5000)
+            for path in paths for p_from, p_to in zip(path[:-1], path[1:]) for _ in range(10)
+        ]
+        self.sim = Simulator(targets=[Target(path=path, start_time=100) for path in paths], observers=observers, random=r)
+        self.shards = shard_grid((22.0, 44.0, 40.0, 52.0), rows=2, cols=2)
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def test_shard_grid(self):
+        """
+        Shards cover the area & select sightings within the overlap margin
+        """
+        self.assertListEqual(['0-0', '0-1', '1-0', '1-1'], [shard.id for shard in self.shards])
+        self.assertTupleEqual((31.0, 48.0, 40.0, 52.0), self.shards[3].bbox)
+
+        sightings = [Sighting(timestamp=0, latitude=48.0 + d, longitude=30.0, bearing=0.0) for d in (-0.6, -0.4, 0.0, 0.5)]
+        self.assertListEqual(sightings[1:], self.shards[2].select(sightings))  # margin: 50km ~ 0.45 degrees
+        self.assertListEqual(sightings[:3], self.shards[0].select(sightings))
+        self.assertListEqual([], self.shards[0].select([]))
+
+    async def test_file_queue(self):
+        """
+        Shards are claimed once per round, expired claims are taken over
+        """
+        queue1 = FileShardQueue(self._dir.name)
+        queue2 = FileShardQueue(self._dir.name, ttl=0.0)
+        self.assertEqual(0, await queue1.pending())
+        self.assertIsNone(await queue1.claim())
+
+        await queue1.submit(['a', 'b', 'c'])
+        self.assertEqual(3, await queue1.pending())
+        self.assertEqual('a', await queue1.claim())
+        self.assertEqual('b', await queue1.claim())
+        self.assertEqual('c', await queue2.claim())
+        self.assertTrue(await queue1.complete('a'))
+        self.assertFalse(await queue2.complete('b'))  # not claimed by queue2
+        self.assertEqual(2, await queue1.pending())
+
+        # the claim of queue2 expired immediately:
+        self.assertEqual('c', await queue1.claim())
+        self.assertIsNone(await queue1.claim())
+        self.assertFalse(await queue2.complete('c'))
+        self.assertTrue(await queue1.complete('b'))
+        self.assertTrue(await queue1.complete('c'))
+        self.assertEqual(0, await queue1.pending())
+
+        # next round:
+        await queue2.submit(['a', 'b', 'c'])
+        self.assertEqual(3, await queue1.pending())
+
+        # waiting for the lock held by another process does not block the event loop:
+        fd = os.open(os.path.join(self._dir.name, 'shards.json.lock'), os.O_RDWR)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        claim = asyncio.create_task(queue1.claim())
+        await asyncio.sleep(0.05)
+        self.assertFalse(claim.done())
+        os.close(fd)
+        self.assertEqual('a', await asyncio.wait_for(claim, timeout=5))
+
+    def test_merge(self):
+        """
+        Targets seen by neighboring shards are deduplicated & partial tracks are stitched across the border
+        """
+        shards = shard_grid((31.0, 47.0, 33.0, 50.0), rows=2, cols=1)  # border at latitude 48.5
+        target = Target(start_time=0, path=[Point(48.0, 32.0), Point(49.0, 32.0)])
+        south = Target(start_time=0, path=[target.path[0], target.at_time(300)])
+        north = Target(start_time=200, path=[target.at_time(200), target.path[1]])
+        inside = Target(start_time=0, path=[Point(47.5, 32.0), Point(48.0, 32.0)])
+
+        for shard_targets in ([[target], [target]], [[south], [north]], [[target], [north]]):
+            merged = merge_shard_targets(shards, shard_targets)
+            self.assertEqual(1, len(merged))
+            self.assertAlmostEqual(target.start_time, merged[0].start_time, delta=1.0)
+            self.assertAlmostEqual(target.end_time, merged[0].end_time, delta=1.0)
+
+        # seen in the margin of the northern shard:
+        merged = merge_shard_targets(shards, [[inside], [inside]])
+        self.assertEqual(1, len(merged))
+        self.assertIs(inside, merged[0])
+        self.assertListEqual([], merge_shard_targets(shards, [[], []]))
+
+    async def test_workers(self):
+        """
+        Workers analyze all shards, the merger publishes merged targets served by MissileMap workers
+        """
+        storage = MemoryStorage()
+        for s in self.sim.sightings:
+            await storage.add_sighting(s)
+
+        lease, target_store = get_cluster('file', path=self._dir.name)
+        queue, stores = get_shard_cluster('file', self.shards, path=self._dir.name)
+        merger = ShardMerger(queue, stores, self.shards, target_store, lease=lease, merge_interval=-1)
+        workers = [
+            ShardWorker(storage, *get_shard_cluster('file', self.shards, path=self._dir.name), self.shards, poll_interval=-1)
+            for _ in range(2)
+        ]
+
+        self.assertIsNone(await merger.merge_round())  # submits the first round
+        self.assertEqual(4, await queue.pending())
+        self.assertEqual(4, sum([await worker.work() for worker in workers]))
+        self.assertEqual(0, await queue.pending())
+
+        target_set = await merger.merge_round()
+        self.assertEqual(1, target_set.version)
+        self.assertEqual(2, len(target_set.targets))
+        self.assertTrue(all(d < MAX_DISTANCE for _, d in sightings_to_targets(self.sim.sightings, target_set.targets, with_distance=True)))
+
+        # unchanged sightings: shards are not re-analyzed & nothing is re-published
+        for worker in workers:
+            await worker.work()
+        self.assertEqual(4, sum(worker.analyzed for worker in workers))
+        self.assertIsNone(await merger.merge_round())
+
+        # serve-only MissileMap workers never analyze sightings or take the lease, they serve the merged targets:
+        _, follower_store = get_cluster('file', path=self._dir.name)
+        core = MissileMap(storage, analysis_interval=0.01, cleanup_interval=-1, alert_interval=-1, target_store=follower_store,
+                          serve_only=True)
+        while (await core.get_target_set()).version < target_set.version:
+            await asyncio.sleep(0.01)
+        self.assertFalse(core.is_leader)
+        self.assertTrue(lease.is_held)
+        self.assertEqual(target_set.to_json(), (await core.get_target_set()).to_json())
+        self.assertEqual(target_set.to_json(), (await FileTargetStore(self._dir.name).latest()).to_json())
+
+        await core.shutdown()
+        for worker in workers:
+            await worker.shutdown()
+        await merger.shutdown()
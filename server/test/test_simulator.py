@@ -1,11 +1,16 @@
+import math
+import random
 from unittest import TestCase
 
+from bokeh.models import ColumnDataSource
 from geopy import Point
 from geopy.distance import distance
+import numpy
 
 from missilemap.utils import closest_point
 from simulator import Simulator, Observer, random_location
-from missilemap.definitions import Target
+from simulator.plotting import ARROW_LENGTH, map_figure, path_columns, render, sighting_columns, SightingAnimation
+from missilemap.definitions import Sighting, Target
 
 
 class TestSimulator(TestCase):
@@ -60,3 +65,46 @@ class TestSimulator(TestCase):
                     break
 
             self.assertTrue(is_ok)
+
+    def test_plotting(self):
+        """
+        Plot columns are computed for all sightings & paths at once, animation updates are incremental
+        """
+        r = random.Random(12345)
+        sightings = [
+            Sighting(timestamp=r.randint(0, 3600), latitude=r.uniform(44.0, 52.0), longitude=r.uniform(22.0, 40.0),
+                     bearing=r.uniform(-math.pi, math.pi))
+            for _ in range(1000)
+        ]
+
+        # arrow heads match geodesic destinations:
+        columns = sighting_columns(sightings)
+        for s, x_end, y_end in zip(sightings[:20], columns['x_end'].tolist(), columns['y_end'].tolist()):
+            head = distance(meters=ARROW_LENGTH).destination((s.latitude, s.longitude), bearing=math.degrees(s.bearing))
+            self.assertLess(distance(head, (y_end, x_end)).meters, 0.01 * ARROW_LENGTH)
+
+        # segments of separate paths are not connected:
+        paths = [[(48.0, 30.0), (48.5, 31.0), (49.0, 31.0)], [], [(50.0, 30.0), (50.0, 32.0)]]
+        columns = path_columns(paths)
+        self.assertListEqual([0, 0, 2], columns['path'].tolist())
+        self.assertListEqual([30.0, 31.0, 30.0], columns['x0'].tolist())
+        self.assertListEqual([48.5, 49.0, 50.0], columns['y1'].tolist())
+
+        # a single data source for sightings & arrows, a single one for paths:
+        figure = render((48.0, 30.0), api_key='test', sightings=sightings, paths=paths)
+        sources = {id(r.data_source): r.data_source for r in figure.renderers if isinstance(r.data_source, ColumnDataSource)}
+        self.assertListEqual([3, 1000], sorted(len(source.data['x0' if 'x0' in source.data else 'x']) for source in sources.values()))
+
+        # animation streams newly visible sightings & patches target positions:
+        target = Target(path=[Point(48.0, 30.0), Point(49.0, 31.0)], start_time=600)
+        animation = SightingAnimation(map_figure((48.0, 30.0), api_key='test'), sightings, targets=[target])
+        timestamps = numpy.array([s.timestamp for s in sightings])
+        for timestamp in (0, 900, 1800, 1000, 3600):
+            animation.update(timestamp)
+            self.assertEqual((timestamps <= timestamp).sum(), len(animation.sightings.data['x']))
+            self.assertListEqual(sorted(timestamps[timestamps <= timestamp].tolist()), animation.sightings.data['timestamp'].tolist())
+            position = target.at_time(timestamp, extrapolate=False)
+            if position is None:
+                self.assertTrue(math.isnan(animation.positions.data['x'][0]))
+            else:
+                self.assertAlmostEqual(position.longitude, animation.positions.data['x'][0], places=6)
@@ -0,0 +1,90 @@
+"""
+Test analysis state snapshot & restore
+"""
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+
+import numpy
+
+from missilemap import MissileMap, Sighting
+from missilemap.snapshot import load_snapshot, save_snapshot
+from missilemap.storage import MemoryStorage
+
+
+def _line_sightings(count, start=0):
+    """
+    Sightings of a target moving north with ~200 m/sec
+    """
+    return [
+        Sighting(timestamp=60 * i, latitude=48.0 + 0.108 * i, longitude=32.0, bearing=0.0)
+        for i in range(start, start + count)
+    ]
+
+
+class TestSnapshot(IsolatedAsyncioTestCase):
+
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory(prefix='test_snapshot')
+        self._path = os.path.join(self._dir.name, 'snapshot.npz')
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    async def test_save_load(self):
+        """
+        Saved state is restored as is
+        """
+        storage = MemoryStorage()
+        for s in _line_sightings(10):
+            await storage.add_sighting(s)
+
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1)
+        await core._analysis_service()
+
+        save_snapshot(self._path, core._state)
+        state = load_snapshot(self._path)
+
+        self.assertEqual(core._state.target_set.to_json(), state.target_set.to_json())
+        self.assertListEqual(list(core._state.sighting_ids), state.sighting_ids)
+        self.assertListEqual(list(core._state.assignment), state.assignment)
+        self.assertIsNone(load_snapshot(os.path.join(self._dir.name, 'missing.npz')))
+
+        # format 1 snapshots (with the unused high_water_mark) are still readable:
+        with numpy.load(self._path) as data:
+            arrays = dict(data)
+        numpy.savez_compressed(self._path, **{**arrays, 'format': numpy.array(1), 'high_water_mark': numpy.array(540.0)})
+        self.assertEqual(state.target_set.to_json(), load_snapshot(self._path).target_set.to_json())
+
+    async def test_warm_restore(self):
+        """
+        Restarted server serves the snapshot targets & only processes new sightings
+        """
+        storage = MemoryStorage()
+        for s in _line_sightings(10):
+            await storage.add_sighting(s)
+
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1, snapshot_path=self._path)
+        await core._analysis_service()
+        targets = await core.list_targets()
+        self.assertEqual(1, len(targets))
+        await core.shutdown()
+
+        # restart:
+        core = MissileMap(storage, analysis_interval=-1, cleanup_interval=-1, snapshot_path=self._path)
+        self.assertEqual([t.to_json() for t in targets], [t.to_json() for t in await core.list_targets()])
+
+        # nothing changed -> no new version:
+        await core._analysis_service()
+        self.assertEqual(1, (await core.get_target_set()).version)
+
+        # new sightings on the same path extend the known target:
+        for s in _line_sightings(2, start=10):
+            await storage.add_sighting(s)
+        await core._analysis_service()
+
+        target_set = await core.get_target_set()
+        self.assertEqual(2, target_set.version)
+        self.assertEqual(1, len(target_set.targets))
+        self.assertListEqual([0] * 12, list(core._state.assignment))
+        await core.shutdown()
@@ -5,8 +5,11 @@ Unit-testing for storage objects
 from unittest import IsolatedAsyncioTestCase
 
 from missilemap.storage import get_storage
+from missilemap.table import SightingTable
 from missilemap import Sighting
 
+from test.mongoutils import start_mongodb, stop_mongodb
+
 
 class TestStorage(IsolatedAsyncioTestCase):
     """
@@ -46,3 +49,108 @@ class TestStorage(IsolatedAsyncioTestCase):
         result = await db.find(Sighting)
 
         self.assertListEqual(result, items)
+
+    async def test_memory_storage(self):
+        """
+        Test adding, listing & removing sightings with in-memory storage
+        """
+        items = [
+            Sighting(timestamp=i, latitude=1 + i / 10, longitude=2 + i / 10, bearing=0.1) for i in range(10)
+        ]
+        storage = get_storage('memory')
+
+        for s in items:
+            await storage.add_sighting(s)
+        # same sighting is only stored once:
+        stored = await storage.add_sighting(Sighting(id=items[3].id, timestamp=0, latitude=0, longitude=0, bearing=0))
+        self.assertEqual(items[3], stored)
+
+        self.assertListEqual(items, await storage.list_sightings())
+
+        # records for the analysis have the same fields:
+        records = await storage.list_records()
+        self.assertListEqual([s.dict() for s in items], [r._asdict() for r in records])
+        self.assertEqual(items[0].location, records[0].location)
+
+        await storage.remove_sighting(items[3])
+        self.assertListEqual(items[:3] + items[4:], await storage.list_sightings())
+
+        await storage.add_sighting(items[3])
+        self.assertListEqual(items[:3] + items[4:] + [items[3]], await storage.list_sightings())
+
+        await storage.clear_sightings()
+        self.assertListEqual([], await storage.list_sightings())
+
+    def test_table_compaction(self):
+        """
+        Test sighting table index merging & compaction
+        """
+        items = [
+            Sighting(timestamp=i, latitude=i / 1000, longitude=i / 1000, bearing=0.0) for i in range(10000)
+        ]
+        table = SightingTable()
+        for s in items:
+            table.add_sighting(s)
+
+        # remove odd sightings (triggers compaction):
+        for s in items[1::2]:
+            self.assertTrue(table.remove(s.id))
+        self.assertFalse(table.remove(items[1].id))
+
+        self.assertEqual(5000, len(table))
+        self.assertListEqual(items[::2], table.to_sightings())
+        self.assertEqual(items[10], table.get(items[10].id))
+        self.assertIsNone(table.get(items[11].id))
+        self.assertTrue(all(s.id in table for s in items[::2]))
+
+
+class TestMongoDBStorage(IsolatedAsyncioTestCase):
+    """
+    Test MongoDB storage mirror synchronization
+    """
+    _db_port = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls._db_port = start_mongodb()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        stop_mongodb()
+
+    async def test_mirror(self):
+        """
+        Changes made through one storage object are picked up by another one
+        """
+        url = f'mongodb://localhost:{self._db_port}'
+        storage = get_storage(url=url, database='test_mirror')
+        other = get_storage(url=url, database='test_mirror')
+        await storage.clear_sightings()
+
+        items = [Sighting(timestamp=i, latitude=1.0, longitude=2.0, bearing=0.0) for i in range(5)]
+        for s in items[:3]:
+            await other.add_sighting(s)
+        self.assertListEqual(items[:3], await storage.list_sightings())
+
+        # nothing changed:
+        checksum = storage.checksum
+        await storage.sync()
+        self.assertEqual(checksum, storage.checksum)
+
+        # only new documents are read:
+        for s in items[3:]:
+            await other.add_sighting(s)
+        await storage.sync()
+        self.assertNotEqual(checksum, storage.checksum)
+        self.assertListEqual(items, await storage.list_sightings())
+
+        # removal by another process:
+        await other.remove_sighting(items[0])
+        self.assertListEqual(items[1:], await storage.list_sightings())
+
+        # full re-synchronization with no changes:
+        checksum = storage.checksum
+        await storage.sync(full=True)
+        self.assertEqual(checksum, storage.checksum)
+
+        await storage.clear_sightings()
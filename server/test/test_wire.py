@@ -0,0 +1,42 @@
+"""
+Test binary wire format
+"""
+import random
+from unittest import TestCase
+
+from geopy import Point
+
+from missilemap import Target
+from missilemap.wire import decode_targets, encode_targets
+
+
+class TestWire(TestCase):
+
+    def test_roundtrip(self):
+        """
+        Decoded targets match the encoded ones up to quantization
+        """
+        r = random.Random(12345)
+        targets = [Target(start_time=0, path=[])]
+        for _ in range(50):
+            path = [Point(r.uniform(-89.0, 89.0), r.uniform(-179.0, 179.0)) for _ in range(r.randint(2, 6))]
+            targets.append(Target(start_time=r.uniform(0, 1e9), speed=r.uniform(100, 300), path=path))
+
+        data = encode_targets(targets)
+        decoded = decode_targets(data)
+
+        self.assertEqual(len(targets), len(decoded))
+        for target, result in zip(targets, decoded):
+            self.assertEqual(target.start_time, result.start_time)
+            self.assertAlmostEqual(target.speed, result.speed, places=4)
+            self.assertEqual(len(target.path), len(result.path))
+            for p, q in zip(target.path, result.path):
+                self.assertAlmostEqual(p.latitude, q.latitude, delta=1e-6)
+                self.assertAlmostEqual(p.longitude, q.longitude, delta=1e-6)
+
+        self.assertListEqual([], decode_targets(encode_targets([])))
+
+        with self.assertRaises(ValueError):
+            decode_targets(data[:-1])
+        with self.assertRaises(ValueError):
+            decode_targets(b'JSON' + data[4:])